@@ -0,0 +1,74 @@
+"""
+/agent/chat 每轮对话的 Redis 往返次数和内存分配：每次重建 vs 按会话缓存
+
+只测试会话记忆的加载和保存，不调用 LLM。需要可用的 Redis，在项目根目录运行：
+python -m benchmarks.bench_chat_memory
+"""
+import time
+import tracemalloc
+
+from redis import Redis
+from redis.client import Pipeline
+
+from src.agentapi.utils.redis_tool import RedisConversationMemory, SessionStore, redis_client
+
+TURNS = 200
+ANSWER = "这是一个比较长的回答。" * 20
+
+
+class CountingPipeline(Pipeline):
+    def execute(self, raise_on_error=True):
+        self.counter["round_trips"] += 1
+        return super().execute(raise_on_error)
+
+
+class CountingRedis(Redis):
+    """统计 Redis 往返次数，pipeline 一次 execute 记为一次往返"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.counter = {"round_trips": 0}
+
+    def execute_command(self, *args, **options):
+        self.counter["round_trips"] += 1
+        return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipeline = CountingPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+        pipeline.counter = self.counter
+        return pipeline
+
+
+def run(name, get_memory, client):
+    client.delete("chat:bench", "chat:bench:seq")
+    client.counter["round_trips"] = 0
+    tracemalloc.start()
+    start = time.perf_counter()
+    for i in range(TURNS):
+        memory = get_memory()
+        memory.load_memory_variables({})
+        memory.save_context({"input": f"第{i}个问题"}, {"response": ANSWER})
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size for stat in snapshot.statistics("filename"))
+    print(f"{name:<12}每轮往返 {client.counter['round_trips'] / TURNS:.2f} 次，"
+          f"每轮耗时 {elapsed / TURNS * 1000:.2f} ms，峰值内存 {peak / 1024:.1f} KB，"
+          f"剩余分配 {allocated / 1024:.1f} KB")
+
+
+def main():
+    client = CountingRedis(**redis_client.connection_pool.connection_kwargs)
+
+    run("每次重建", lambda: RedisConversationMemory(
+        redis_client=client, session_id="bench", max_history=5
+    ), client)
+
+    store = SessionStore(client, max_history=5)
+    run("按会话缓存", lambda: store.get("bench").memory, client)
+    client.delete("chat:bench", "chat:bench:seq")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+压缩向量索引：各存储模式的内存、索引大小、p50 / p99 检索延迟和召回率，以及各推理后端编码问题的延迟
+
+第一部分用随机生成的聚类向量（默认 100000 个 1024 维，与 bge-large-zh 相同），不需要模型；
+"小模型召回" 用随机投影到 512 维的向量模拟 bge-small-zh 的召回向量。每种模式在单独的子进程中加载和检索，
+内存为加载索引和检索后进程内存峰值的增量；召回率为 recall@10（相对 float32 精确检索）。
+第二部分需要本地模型，没有的模型或后端跳过。在项目根目录运行：
+python -m benchmarks.bench_compact_index [向量数]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+K = 10
+QUERIES = 200
+DIM = 1024
+SMALL_DIM = 512
+
+# (名称, 存储精度, 是否使用小模型召回向量, 是否全精度重排)
+MODES = [
+    ("float32", "float32", False, False),
+    ("float16 + 重排", "float16", False, True),
+    ("int8 不重排", "int8", False, False),
+    ("int8 + 重排", "int8", False, True),
+    ("小模型 int8 + 重排", "int8", True, True),
+]
+
+
+def normalize(vectors):
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def generate(root, count):
+    """生成向量、问题和精确检索的结果，写出各模式的索引目录"""
+    from src.agentapi.utils.compact_index import CompactIndex
+
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(max(count // 100, 1), DIM))
+    full = normalize(centers[rng.integers(len(centers), size=count)] + rng.normal(scale=0.8, size=(count, DIM)))
+    queries = normalize(full[rng.integers(count, size=QUERIES)] + rng.normal(scale=0.05, size=(QUERIES, DIM)))
+    projection = rng.normal(size=(DIM, SMALL_DIM)) / np.sqrt(SMALL_DIM)
+    small = normalize(full @ projection)
+    small_queries = normalize(queries @ projection)
+    exact = np.argsort(-(queries @ full.T), axis=1)[:, :K]
+    np.savez(os.path.join(root, "queries.npz"), full=queries, small=small_queries, exact=exact)
+
+    texts = [f"片段 {i}" for i in range(count)]
+    metadatas = [{"i": i} for i in range(count)]
+    for mode, use_small in {(mode, use_small) for _, mode, use_small, _ in MODES}:
+        CompactIndex.write(os.path.join(root, f"{mode}_{use_small}"), full, small if use_small else full, mode,
+                           texts, texts, metadatas, {"model": "bench", "recall_model": "bench", "synced_version": None})
+
+
+def child(directory, rerank, use_small):
+    """在子进程中加载索引并检索，输出一行 JSON"""
+    from src.agentapi.utils.compact_index import CompactIndex
+    from src.agentapi.utils.rag_ingest import peak_rss
+
+    with np.load(os.path.join(os.path.dirname(directory), "queries.npz")) as f:
+        queries, small_queries, exact = f["full"], f["small"], f["exact"]
+    baseline = peak_rss()
+    index = CompactIndex(directory, rerank=rerank)
+    recall_queries = small_queries if use_small else queries
+
+    latencies = []
+    hits = 0
+    for recall_query, full_query, expected in zip(recall_queries, queries, exact):
+        start = time.perf_counter()
+        result = index.search_by_vector(recall_query, full_query, K)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len({i for i, _ in result} & set(expected.tolist()))
+    latencies.sort()
+    size = index.size()
+    print(json.dumps({
+        "rss": peak_rss() - baseline,
+        "recall_bytes": size["recall_bytes"],
+        "files": sum(size["files"].values()),
+        "p50": statistics.median(latencies),
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "recall": hits / (len(exact) * K)
+    }))
+
+
+def bench_modes(count):
+    with tempfile.TemporaryDirectory() as root:
+        start = time.perf_counter()
+        generate(root, count)
+        print(f"{count} 个 {DIM} 维向量，{QUERIES} 个问题，生成耗时 {time.perf_counter() - start:.1f} 秒")
+        print(f"{'模式':<16}{'内存增量':>10}{'召回向量':>10}{'索引文件':>10}{'p50':>10}{'p99':>10}{'recall@' + str(K):>11}")
+        for name, mode, use_small, rerank in MODES:
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_compact_index", "--child",
+                 os.path.join(root, f"{mode}_{use_small}"), str(int(rerank)), str(int(use_small))],
+                capture_output=True, text=True, check=True
+            ).stdout
+            r = json.loads(output.strip().splitlines()[-1])
+            print(f"{name:<16}{r['rss'] / 2 ** 20:>8.0f}MB{r['recall_bytes'] / 2 ** 20:>8.0f}MB"
+                  f"{r['files'] / 2 ** 20:>8.0f}MB{r['p50']:>8.2f}ms{r['p99']:>8.2f}ms{r['recall']:>11.3f}")
+
+
+def bench_backends():
+    from src.agentapi.utils import embedding
+
+    backends = [
+        ("bge-large torch", embedding.EMBEDDING_MODEL, "torch", None),
+        ("bge-large onnx", embedding.EMBEDDING_MODEL, "onnx", embedding.EMBEDDING_MODEL_FILE),
+        ("bge-large openvino", embedding.EMBEDDING_MODEL, "openvino", None),
+        ("bge-small torch", embedding.SMALL_EMBEDDING_MODEL, "torch", None),
+    ]
+    questions = ["宫保鸡丁多少钱", "双人套餐里有什么", "几点开门", "外卖多久能送到", "会员有什么优惠"]
+    for name, model_name, backend, model_file in backends:
+        try:
+            from sentence_transformers import SentenceTransformer
+            kwargs = {} if backend == "torch" else {"backend": backend}
+            if model_file:
+                kwargs["model_kwargs"] = {"file_name": model_file}
+            model = SentenceTransformer(model_name, device="cpu", **kwargs)
+        except Exception as e:
+            print(f"{name}：跳过（{e}）")
+            continue
+        model.encode(questions, normalize_embeddings=True)
+        latencies = []
+        for _ in range(20):
+            for question in questions:
+                start = time.perf_counter()
+                model.encode([question], normalize_embeddings=True)
+                latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        print(f"{name}：编码问题 p50 {statistics.median(latencies):.1f} ms，"
+              f"p99 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]:.1f} ms")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child(sys.argv[2], sys.argv[3] == "1", sys.argv[4] == "1")
+        return
+    bench_modes(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
+    bench_backends()
+
+
+if __name__ == "__main__":
+    main()
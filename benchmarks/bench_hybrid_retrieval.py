@@ -0,0 +1,132 @@
+"""
+RAG 检索：纯向量、纯 BM25、混合（RRF）和混合 + 精确匹配快速路径的召回率与延迟对比
+
+语料是内置的菜单片段（菜品、套餐和门店说明），每个问题标注了应该召回的片段，
+输出 recall@K、p50 / p99 延迟和走快速路径的问题比例。需要向量模型，在项目根目录运行：
+python -m benchmarks.bench_hybrid_retrieval
+"""
+import statistics
+import tempfile
+import time
+
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+
+from src.agentapi.utils.embedding import ServiceEmbeddings, embedding_service
+from src.agentapi.utils.hybrid_retriever import BM25Index, HybridRetriever
+
+K = 3
+REPEAT = 20
+
+DISHES = [
+    ("宫保鸡丁", 38, "川菜", "鸡腿肉丁配花生米，微辣，酸甜口"),
+    ("鱼香肉丝", 32, "川菜", "猪里脊切丝，配木耳和胡萝卜，鱼香味"),
+    ("麻婆豆腐", 22, "川菜", "嫩豆腐配牛肉末，麻辣鲜香"),
+    ("水煮牛肉", 58, "川菜", "牛里脊片配豆芽，重辣"),
+    ("回锅肉", 42, "川菜", "五花肉配蒜苗，咸香微辣"),
+    ("清蒸鲈鱼", 68, "粤菜", "鲜活鲈鱼清蒸，淋豉油，不辣"),
+    ("白切鸡", 48, "粤菜", "三黄鸡白煮后切块，配姜葱蘸料，不辣"),
+    ("蜜汁叉烧", 45, "粤菜", "梅花肉蜜汁烤制，甜口"),
+    ("干炒牛河", 28, "粤菜", "河粉配牛肉片和豆芽，大火快炒"),
+    ("蒜蓉西兰花", 18, "素菜", "西兰花焯水后配蒜蓉清炒，不辣，素食"),
+    ("地三鲜", 24, "素菜", "土豆、茄子和青椒过油后合炒，素食"),
+    ("清炒时蔬", 16, "素菜", "当季青菜清炒，不辣，素食"),
+    ("酸辣土豆丝", 14, "素菜", "土豆切丝，酸辣爽口，素食"),
+    ("扬州炒饭", 20, "主食", "米饭配虾仁、火腿和鸡蛋"),
+    ("担担面", 18, "主食", "碱水面配肉末和芝麻酱，微辣"),
+    ("酸梅汤", 8, "饮品", "乌梅熬制，冰镇，解辣"),
+    ("鲜榨橙汁", 15, "饮品", "现榨橙汁，不加糖"),
+]
+
+SET_MEALS = [
+    ("单人川味套餐", 49, ["宫保鸡丁", "扬州炒饭", "酸梅汤"]),
+    ("双人粤式套餐", 128, ["清蒸鲈鱼", "白切鸡", "蒜蓉西兰花", "鲜榨橙汁"]),
+    ("家庭欢聚套餐", 198, ["水煮牛肉", "回锅肉", "地三鲜", "扬州炒饭", "酸梅汤"]),
+    ("轻食素菜套餐", 39, ["蒜蓉西兰花", "清炒时蔬", "鲜榨橙汁"]),
+]
+
+NOTICES = [
+    ("营业时间", "本店营业时间为每天上午十点到晚上十点，节假日正常营业。"),
+    ("包间预订", "包间需要提前一天电话预订，十人以上包间收取最低消费五百元。"),
+    ("外卖配送", "外卖配送范围为门店三公里内，满五十元免配送费，高峰期配送约四十分钟。"),
+    ("退款规则", "菜品有质量问题可以在用餐后两小时内申请退款，外卖订单在配送完成后申请。"),
+    ("会员优惠", "会员每周三享受八八折，生日当月赠送长寿面一份，积分可以抵扣现金。"),
+]
+
+# (问题, 应该召回的片段标题)
+QUESTIONS = [
+    ("宫保鸡丁多少钱", "宫保鸡丁"),
+    ("麻婆豆腐", "麻婆豆腐"),
+    ("蜜汁叉烧的价格", "蜜汁叉烧"),
+    ("双人粤式套餐里有什么", "双人粤式套餐"),
+    ("家庭欢聚套餐多少钱", "家庭欢聚套餐"),
+    ("单人川味套餐", "单人川味套餐"),
+    ("担担面辣吗", "担担面"),
+    ("几点开门", "营业时间"),
+    ("怎么订包间", "包间预订"),
+    ("送餐要多久，有没有运费", "外卖配送"),
+    ("菜不新鲜能退钱吗", "退款规则"),
+    ("办会员有什么好处", "会员优惠"),
+    ("有什么不辣的素菜", "蒜蓉西兰花"),
+    ("推荐一个清淡的鱼", "清蒸鲈鱼"),
+    ("解辣的饮料", "酸梅汤"),
+    ("一个人吃川菜选哪个套餐", "单人川味套餐"),
+]
+
+
+def build_corpus():
+    docs = []
+    for name, price, category, description in DISHES:
+        docs.append(Document(page_content=f"{name}，{category}，价格{price}元。{description}。",
+                             metadata={"source": "menu", "title": name}))
+    for name, price, dishes in SET_MEALS:
+        docs.append(Document(page_content=f"{name}，价格{price}元，包含：{'、'.join(dishes)}。",
+                             metadata={"source": "set_meals", "title": name}))
+    for title, text in NOTICES:
+        docs.append(Document(page_content=f"{title}：{text}", metadata={"source": "notices", "title": title}))
+    return docs
+
+
+def run(name, search, retriever=None):
+    hits = 0
+    latencies = []
+    for question, title in QUESTIONS:
+        docs = search(question)
+        hits += any(doc.metadata["title"] == title for doc in docs[:K])
+        for _ in range(REPEAT):
+            # 清空查询向量的缓存，向量检索的延迟包含问题的编码
+            embedding_service.clear()
+            start = time.perf_counter()
+            search(question)
+            latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    line = (f"{name:<14} recall@{K} {hits / len(QUESTIONS):.2f}  "
+            f"p50 {statistics.median(latencies):.2f} ms  p99 {p99:.2f} ms")
+    if retriever is not None:
+        fast = retriever.stats["fast_path"]
+        line += f"  快速路径 {fast / (fast + retriever.stats['hybrid']):.0%}"
+    print(line)
+
+
+def main():
+    docs = build_corpus()
+    embedding_service.cache_path = None
+    with tempfile.TemporaryDirectory() as persist_dir:
+        store = Chroma.from_documents(docs, ServiceEmbeddings(), persist_directory=persist_dir,
+                                      collection_metadata={"hnsw:space": "cosine"})
+        bm25 = BM25Index(docs)
+        # 先检索一次，避免模型加载时间计入延迟
+        store.similarity_search("预热", k=K)
+
+        hybrid = HybridRetriever(vector_store=store, lexical_source=lambda: bm25, k=K, exact_coverage=2.0)
+        fast = HybridRetriever(vector_store=store, lexical_source=lambda: bm25, k=K)
+        print(f"{len(docs)} 个片段，{len(QUESTIONS)} 个问题，每个问题重复 {REPEAT} 次")
+        run("纯向量", lambda q: store.similarity_search(q, k=K))
+        run("纯 BM25", lambda q: [doc for doc, _, _ in bm25.search(q, K)])
+        run("混合 RRF", hybrid.invoke, hybrid)
+        run("混合 + 快速路径", fast.invoke, fast)
+
+
+if __name__ == "__main__":
+    main()
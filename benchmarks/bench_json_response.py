@@ -0,0 +1,67 @@
+"""
+JSON 响应序列化对比：
+- 原来的 create_response：JSONResponse（json.dumps）
+- 原来路由返回字典：jsonable_encoder + JSONResponse
+- 现在的 json_response / create_response：orjson 直接编码为字节串
+
+覆盖几种典型的响应大小：登录结果、验证码（Base64 图片）、SQL 代理答案、缓存统计，
+不需要数据库和 Redis，在项目根目录运行：
+python -m benchmarks.bench_json_response
+"""
+import base64
+import os
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from src.agentapi.entity.result import json_response
+
+REPEAT = 5000
+
+
+def envelope(data):
+    return {"code": 200, "message": "success", "data": data}
+
+
+PAYLOADS = {
+    "登录结果": envelope({"message": "登录成功"}),
+    "验证码": envelope({
+        "id": 123456,
+        "image": "data:image/png;base64," + base64.b64encode(os.urandom(1500)).decode("utf-8")
+    }),
+    "代理答案": {
+        "question": "今天订单总额是多少？",
+        "answer": "今天的订单总额为 3280.50 元，共 56 笔订单，其中堂食 32 笔、外卖 24 笔。" * 20
+    },
+    "缓存统计": {
+        "answer": {f"table_{i}": {"hits": i, "misses": i * 2, "hit_rate": 0.33} for i in range(200)},
+        "plan": {"size": 200, "hits": 1000, "misses": 300}
+    },
+}
+
+
+def bench(name, build, payload):
+    body = build(payload).body
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        build(payload)
+    elapsed = time.perf_counter() - start
+    return len(body), REPEAT / elapsed
+
+
+def main():
+    builders = [
+        ("JSONResponse", lambda p: JSONResponse(content=p)),
+        ("encoder+JSONResponse", lambda p: JSONResponse(content=jsonable_encoder(p))),
+        ("orjson", json_response),
+    ]
+    for payload_name, payload in PAYLOADS.items():
+        print(payload_name)
+        for name, build in builders:
+            size, per_sec = bench(name, build, payload)
+            print(f"  {name:<22}{size:>8} 字节 {per_sec:>10.0f} 次/秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+对话消息编码对比：JSON vs 紧凑二进制编码（不压缩 / 长消息 zlib 压缩）
+
+统计每个会话（10 轮对话）的字节数和解码吞吐量，不需要 Redis，在项目根目录运行：
+python -m benchmarks.bench_message_codec
+"""
+import json
+import time
+
+from src.agentapi.utils.message_codec import encode_message, decode_message
+
+ROUNDS = 10
+REPEAT = 2000
+
+QUESTIONS = ["今天订单总额是多少？", "最贵的菜是什么？", "帮我推荐一个适合四个人的套餐"]
+ANSWERS = [
+    "今天的订单总额为 3280.50 元，共 56 笔订单。",
+    "最贵的菜是蒜蓉帝王蟹，售价 488 元。",
+    "推荐您选择商务套餐 A：包含宫保鸡丁、水煮鱼、清炒时蔬和米饭四份，适合四个人用餐。" * 8,
+]
+
+
+def build_session():
+    messages = []
+    for i in range(ROUNDS):
+        messages.append(("human", QUESTIONS[i % len(QUESTIONS)], time.time()))
+        messages.append(("ai", ANSWERS[i % len(ANSWERS)], time.time()))
+    return messages
+
+
+def encode_json(message_type, content, timestamp):
+    return json.dumps({'type': message_type, 'content': content, 'timestamp': timestamp}).encode("utf-8")
+
+
+def bench(name, encode, decode, messages):
+    encoded = [encode(*m) for m in messages]
+    size = sum(len(e) for e in encoded)
+
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        for e in encoded:
+            decode(e)
+    elapsed = time.perf_counter() - start
+    decoded_per_sec = REPEAT * len(encoded) / elapsed
+
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        for m in messages:
+            encode(*m)
+    encoded_per_sec = REPEAT * len(messages) / (time.perf_counter() - start)
+
+    print(f"{name:<16}每个会话 {size:>6} 字节，解码 {decoded_per_sec:>10.0f} 条/秒，编码 {encoded_per_sec:>10.0f} 条/秒")
+
+
+def main():
+    messages = build_session()
+    bench("JSON", encode_json, json.loads, messages)
+    bench("二进制", lambda *m: encode_message(*m, compress_threshold=None), decode_message, messages)
+    bench("二进制+zlib", encode_message, decode_message, messages)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+中间件开销对比：@app.middleware("http")（BaseHTTPMiddleware） vs 纯 ASGI 的 ResponseHeaderMiddleware
+
+三个只有 / 接口的最小应用，直接调用 ASGI 接口（不经过网络和 uvicorn），统计每秒请求数，
+不需要数据库和 Redis，在项目根目录运行：
+python -m benchmarks.bench_middleware
+"""
+import asyncio
+import time
+
+from fastapi import FastAPI
+
+from src.agentapi.utils.middleware import ResponseHeaderMiddleware
+
+REQUESTS = 5000
+CONCURRENCY = 50
+
+
+def build_app(kind):
+    app = FastAPI()
+
+    if kind == "http":
+        @app.middleware("http")
+        async def add_custom_header(request, call_next):
+            response = await call_next(request)
+            response.headers["Custom-Response-Headers"] = "Lidongyang Service"
+            return response
+    elif kind == "asgi":
+        app.add_middleware(ResponseHeaderMiddleware, headers={"Custom-Response-Headers": "Lidongyang Service"})
+
+    @app.get("/")
+    async def root():
+        return {"message": "Welcome to the API"}
+
+    return app
+
+
+SCOPE = {
+    "type": "http",
+    "asgi": {"version": "3.0"},
+    "http_version": "1.1",
+    "method": "GET",
+    "scheme": "http",
+    "path": "/",
+    "raw_path": b"/",
+    "root_path": "",
+    "query_string": b"",
+    "headers": [(b"host", b"127.0.0.1:8000")],
+    "client": ("127.0.0.1", 50000),
+    "server": ("127.0.0.1", 8000),
+}
+
+
+async def request(app):
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    headers = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            headers.extend(message["headers"])
+
+    await app(dict(SCOPE), receive, send)
+    return headers
+
+
+async def bench(name, app):
+    headers = await request(app)
+    assert any(k == b"custom-response-headers" for k, _ in headers) or name == "无中间件"
+
+    async def worker(n):
+        for _ in range(n):
+            await request(app)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(REQUESTS // CONCURRENCY) for _ in range(CONCURRENCY)])
+    elapsed = time.perf_counter() - start
+    print(f"{name:<20}{REQUESTS / elapsed:>10.0f} 请求/秒")
+
+
+async def main():
+    await bench("无中间件", build_app(None))
+    await bench("BaseHTTPMiddleware", build_app("http"))
+    await bench("纯 ASGI 中间件", build_app("asgi"))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
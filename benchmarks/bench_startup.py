@@ -0,0 +1,54 @@
+"""
+启动耗时：导入应用（uvicorn 开始接收请求前的耗时）和预热全部子系统的耗时
+
+导入在新的子进程中执行，重复 REPEAT 次取中位数；预热时统计每个子系统的初始化耗时，
+各子系统耗时之和相当于原来在导入时串行初始化的耗时。需要 MySQL、Redis 和向量模型，在项目根目录运行：
+python -m benchmarks.bench_startup
+"""
+import asyncio
+import statistics
+import subprocess
+import sys
+
+REPEAT = 3
+
+IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import src.agentapi.main
+print(time.perf_counter() - start)
+"""
+
+
+def bench_import():
+    times = []
+    for _ in range(REPEAT):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT],
+            capture_output=True, text=True, check=True
+        ).stdout
+        times.append(float(output.strip().splitlines()[-1]))
+    print(f"导入应用：中位数 {statistics.median(times):.2f} 秒（{', '.join(f'{t:.2f}' for t in times)}）")
+
+
+def bench_warm_up():
+    from src.agentapi.main import warm_up, readiness
+
+    wall = asyncio.run(warm_up())
+    is_ready, subsystems = readiness()
+    serial = 0.0
+    for name, status in subsystems.items():
+        seconds = status["seconds"] or 0.0
+        serial += seconds
+        error = f"，错误: {status['error']}" if status["error"] else ""
+        print(f"  {name:<18}{status['state']:<8}{seconds:>8.2f} 秒{error}")
+    print(f"并发预热 {wall:.2f} 秒，串行合计 {serial:.2f} 秒，全部就绪: {is_ready}")
+
+
+def main():
+    bench_import()
+    bench_warm_up()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+选表前后 SQL 代理的对比：提示词 token 数、LLM 调用次数和耗时
+
+需要可用的 reggie 数据库和 DeepSeek API Key，在项目根目录运行：
+python -m benchmarks.bench_table_selection
+"""
+import time
+
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+
+from src.agentapi.utils.dbtool import agent_tools
+
+QUESTIONS = [
+    "今天订单总额是多少？",
+    "最贵的菜是什么？",
+    "每个分类下有多少道菜？",
+    "套餐里都有哪些菜？",
+    "下单最多的用户是谁？",
+]
+
+
+def run_once(executor, system_prompt, question):
+    start = time.perf_counter()
+    resp = executor.invoke({
+        'messages': [
+            SystemMessage(content=system_prompt),
+            HumanMessage(content=question)
+        ]
+    })
+    elapsed = time.perf_counter() - start
+
+    ai_messages = [m for m in resp['messages'] if isinstance(m, AIMessage)]
+    input_tokens = sum((m.usage_metadata or {}).get("input_tokens", 0) for m in ai_messages)
+    output_tokens = sum((m.usage_metadata or {}).get("output_tokens", 0) for m in ai_messages)
+    return input_tokens, output_tokens, len(ai_messages), elapsed
+
+
+def main():
+    agent_tools.warm_up_catalog()
+
+    totals = {"before": [0, 0, 0, 0.0], "after": [0, 0, 0, 0.0]}
+    print(f"{'问题':<16}{'模式':<8}{'输入token':>10}{'输出token':>10}{'LLM调用':>8}{'耗时(s)':>10}")
+    for question in QUESTIONS:
+        start = time.perf_counter()
+        executor, system_prompt = agent_tools.prepare(question)
+        select_ms = (time.perf_counter() - start) * 1000
+
+        runs = {
+            "before": run_once(agent_tools.agent_executor, agent_tools.system_prompt, question),
+            "after": run_once(executor, system_prompt, question),
+        }
+        for mode, result in runs.items():
+            for i, v in enumerate(result):
+                totals[mode][i] += v
+            print(f"{question:<16}{mode:<8}{result[0]:>10}{result[1]:>10}{result[2]:>8}{result[3]:>10.2f}")
+        print(f"{'':<16}选表耗时 {select_ms:.1f} ms，选中的表：{agent_tools.selector.select(question)}")
+
+    print("\n合计")
+    for mode, (input_tokens, output_tokens, calls, elapsed) in totals.items():
+        print(f"{mode:<8}输入token {input_tokens}，输出token {output_tokens}，LLM调用 {calls} 次，耗时 {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
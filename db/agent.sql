@@ -26,7 +26,8 @@ CREATE TABLE `captchas`  (
   `code` varchar(10) CHARACTER SET utf8 COLLATE utf8_general_ci NOT NULL COMMENT '验证码的具体值',
   `created_at` timestamp(0) NULL DEFAULT CURRENT_TIMESTAMP(0) COMMENT '验证码的创建时间',
   `used` tinyint(1) NULL DEFAULT 0 COMMENT '标记验证码是否已被使用',
-  PRIMARY KEY (`id`) USING BTREE
+  PRIMARY KEY (`id`) USING BTREE,
+  INDEX `idx_created_at`(`created_at`) USING BTREE COMMENT '按创建时间分批清理过期验证码'
 ) ENGINE = InnoDB AUTO_INCREMENT = 211 CHARACTER SET = utf8 COLLATE = utf8_general_ci COMMENT = '存储验证码信息的表' ROW_FORMAT = Dynamic;
 
 -- ----------------------------
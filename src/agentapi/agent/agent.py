@@ -1,34 +1,238 @@
-from fastapi import HTTPException, APIRouter
+import asyncio
+from contextlib import aclosing
+
+from fastapi import HTTPException, APIRouter, Depends, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
-from src.agentapi.utils.dbtool import agent_tools
+from src.agentapi.entity.result import json_response, sse_event
+from src.agentapi.utils.admin_auth import require_admin
+from src.agentapi.utils.dbtool import agent_tools, mysqltool
+from src.agentapi.utils.agent_runner import agent_runner
+from src.agentapi.utils.answer_cache import answer_cache, extract_sql, extract_tables, is_answered
+from src.agentapi.utils.plan_cache import plan_cache
+from src.agentapi.utils.single_flight import flight_key, single_flight
 
 # 创建路由实例，设置前缀和标签
 router = APIRouter(prefix="/agent", tags=["agent"])
 
+
+def build_payload(system_prompt: str, question: str):
+    """构造代理的输入消息"""
+    return {
+        'messages': [
+            SystemMessage(content=system_prompt),
+            HumanMessage(content=question)
+        ]
+    }
+
+
+async def finish_agent(question: str, messages):
+    """
+    从代理的消息中提取最终答案，并保存代理最终执行的 SQL
+    :return: (最终答案, SQL 涉及的表)；代理没有成功回答时表为空，调用方不缓存这个答案
+    """
+    final_answer = next(
+        (
+            msg.content
+            for msg in reversed(messages)
+            if isinstance(msg, AIMessage)
+        ),
+        "未找到有效回答"
+    )
+
+    # 保存 SQL 计划，下次同类问题直接重放
+    await run_in_threadpool(plan_cache.capture, question, messages)
+
+    tables = set()
+    if is_answered(messages):
+        for sql in extract_sql(messages):
+            tables |= extract_tables(sql)
+    return final_answer, tables
+
+
+async def run_agent(question: str):
+    """
+    调用 SQL 代理回答问题
+    :return: (最终答案, SQL 涉及的表)
+    """
+    # 根据问题挑选相关的表，提示词中直接包含表结构
+    executor, system_prompt = await run_in_threadpool(agent_tools.prepare, question)
+
+    # 调用代理处理问题，在有界执行器中运行，不阻塞事件循环
+    resp = await agent_runner.run(executor, build_payload(system_prompt, question))
+    return await finish_agent(question, resp['messages'])
+
+
+async def answer_question(question: str):
+    """
+    SQL 计划缓存重放或调用代理回答问题，并缓存答案
+    :return: 最终答案
+    """
+    # 先查 SQL 计划缓存，命中时用最新数据重新执行缓存的 SQL，最多只调用一次 LLM 总结答案
+    replayed = await run_in_threadpool(plan_cache.replay, question)
+    if replayed is not None:
+        final_answer = replayed["answer"] or await plan_cache.summarize(
+            question, replayed["sql"], replayed["result"]
+        )
+        tables = extract_tables(replayed["sql"])
+    else:
+        final_answer, tables = await run_agent(question)
+
+    # 缓存答案，并记录 SQL 涉及的表，表变化时缓存失效
+    if tables:
+        await run_in_threadpool(answer_cache.set, question, final_answer, tables)
+    return final_answer
+
+
 @router.post("/server")
 async def query_database(question: str):
     """
     接收用户问题，调用 LangChain 代理执行 SQL 查询，并返回结果。
     """
     try:
-        # 调用代理处理问题
-        resp = agent_tools.agent_executor.invoke({
-            'messages': [
-                SystemMessage(content=agent_tools.system_prompt),
-                HumanMessage(content=question)
-            ]
-        })
-
-        # 提取最终答案
-        final_answer = next(
-            (
-                msg.content
-                for msg in reversed(resp['messages'])
-                if isinstance(msg, AIMessage)
-            ),
-            "未找到有效回答"
-        )
+        # 先查答案缓存，命中时不再调用代理
+        cached = await run_in_threadpool(answer_cache.get, question)
+        if cached is not None:
+            return json_response({"question": question, "answer": cached["answer"]})
+
+        # 相同的问题（查询同一个数据库）同时只执行一次，其他请求等待并共享结果
+        key = flight_key(question, f"{mysqltool.host}:{mysqltool.port}/{mysqltool.database}")
+        final_answer = await single_flight.do(key, lambda: answer_question(question))
 
-        return {"question": question, "answer": final_answer}
+        return json_response({"question": question, "answer": final_answer})
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
+
+
+@router.post("/server/stream")
+async def query_database_stream(question: str, request: Request):
+    """
+    /agent/server 的流式版本，以 text/event-stream 返回以下事件：
+    token（模型输出的片段）、tool_start / tool_end（工具调用）、sql（执行的 SQL）、
+    rows（查询结果）、answer（最终答案）、error（错误信息）。
+    客户端断开连接时取消代理的执行。
+    """
+    cached = await run_in_threadpool(answer_cache.get, question)
+    if cached is not None:
+        events = [sse_event("answer", {"question": question, "answer": cached["answer"]})]
+        return StreamingResponse(iter(events), media_type="text/event-stream")
+
+    replayed = await run_in_threadpool(plan_cache.replay, question)
+    if replayed is not None:
+        return StreamingResponse(stream_replay(question, replayed), media_type="text/event-stream")
+
+    # 代理繁忙时在返回响应前直接拒绝
+    agent_runner.admit()
+    return StreamingResponse(stream_agent(question, request), media_type="text/event-stream")
+
+
+async def stream_replay(question: str, replayed):
+    """流式返回 SQL 计划缓存的重放结果"""
+    try:
+        yield sse_event("sql", {"query": replayed["sql"]})
+        yield sse_event("rows", {"result": replayed["result"]})
+
+        final_answer = replayed["answer"]
+        if final_answer is None:
+            final_answer = ""
+            async for token in plan_cache.astream_summary(question, replayed["sql"], replayed["result"]):
+                final_answer += token
+                yield sse_event("token", {"content": token})
+
+        await run_in_threadpool(answer_cache.set, question, final_answer, extract_tables(replayed["sql"]))
+        yield sse_event("answer", {"question": question, "answer": final_answer})
+    except Exception as e:
+        yield sse_event("error", {"detail": f"处理失败: {str(e)}"})
+
+
+async def stream_agent(question: str, request: Request):
+    """通过 astream_events 流式返回代理的输出和中间步骤"""
+    try:
+        await agent_runner.acquire()
+    except HTTPException as e:
+        yield sse_event("error", {"detail": e.detail})
+        return
+
+    try:
+        executor, system_prompt = await run_in_threadpool(agent_tools.prepare, question)
+        deadline = asyncio.get_running_loop().time() + agent_runner.timeout
+        final_state = None
+
+        events = executor.astream_events(build_payload(system_prompt, question), version="v2")
+        async with aclosing(events):
+            while True:
+                # 等待下一个事件时计算超时，LLM 调用卡住、没有任何事件时也能超时退出；
+                # 只包住 anext，不包住 yield，超时不会取消正在向客户端发送数据的任务
+                try:
+                    async with asyncio.timeout_at(deadline):
+                        event = await anext(events)
+                except StopAsyncIteration:
+                    break
+                except TimeoutError:
+                    yield sse_event("error", {"detail": "代理执行超时"})
+                    return
+
+                # 客户端断开时退出循环，关闭事件流会取消代理的执行
+                if await request.is_disconnected():
+                    return
+
+                kind, name, data = event["event"], event["name"], event["data"]
+                if kind == "on_chat_model_stream":
+                    content = data["chunk"].content
+                    if content:
+                        yield sse_event("token", {"content": content})
+                elif kind == "on_tool_start":
+                    yield sse_event("tool_start", {"name": name, "input": data.get("input")})
+                    if name == "sql_db_query":
+                        yield sse_event("sql", {"query": (data.get("input") or {}).get("query")})
+                elif kind == "on_tool_end":
+                    output = getattr(data.get("output"), "content", data.get("output"))
+                    if name == "sql_db_query":
+                        yield sse_event("rows", {"result": output})
+                    yield sse_event("tool_end", {"name": name})
+                elif kind == "on_chain_end" and not event.get("parent_ids"):
+                    final_state = data["output"]
+
+        if final_state is None:
+            yield sse_event("error", {"detail": "未找到有效回答"})
+            return
+
+        final_answer, tables = await finish_agent(question, final_state["messages"])
+        if tables:
+            await run_in_threadpool(answer_cache.set, question, final_answer, tables)
+        yield sse_event("answer", {"question": question, "answer": final_answer})
+    except Exception as e:
+        yield sse_event("error", {"detail": f"处理失败: {str(e)}"})
+    finally:
+        agent_runner.release()
+
+
+@router.get("/server/cache")
+def answer_cache_stats():
+    """
+    返回答案缓存、SQL 计划缓存和合并请求的统计
+    """
+    return json_response({
+        "answer": answer_cache.stats(),
+        "plan": plan_cache.stats(),
+        "single_flight": single_flight.stats()
+    })
+
+
+@router.post("/server/template", dependencies=[Depends(require_admin)])
+def set_answer_template(question: str, answer_template: str):
+    """
+    为一类问题配置答案模板，命中 SQL 计划缓存后直接套用模板，不再调用 LLM。
+    模板中可以使用 {result}（查询结果）以及 {p0}、{p1} ...（问题中的字面量）。
+    会影响所有用户的答案，只允许携带管理令牌（X-Admin-Token）调用。
+    """
+    try:
+        found = plan_cache.set_answer_template(question, answer_template)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not found:
+        raise HTTPException(status_code=404, detail="该问题还没有缓存的 SQL 计划")
+    return json_response({"question": question, "answer_template": answer_template})
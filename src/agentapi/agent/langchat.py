@@ -1,12 +1,48 @@
 
-from fastapi import APIRouter
-from src.agentapi.utils.redis_tool import get_conversation_chain
+from contextlib import aclosing
+
+from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
+from src.agentapi.entity.result import json_response, sse_event
+from src.agentapi.utils.redis_tool import async_conversation_chain
 
 router = APIRouter(prefix="/agent", tags=["agent"])
 
 @router.post("/chat")
 async def query_redis(user_id: str,question: str):
-    redis_chain = get_conversation_chain(user_id)
-    response1 = redis_chain.run(question)
+    # 会话记忆使用 redis.asyncio，加载和保存历史都不阻塞事件循环；同一个会话的请求依次执行
+    async with async_conversation_chain(user_id) as redis_chain:
+        response1 = (await redis_chain.ainvoke({"input": question}))["response"]
     print(response1)
-    return {"response": response1}
+    return json_response({"response": response1})
+
+
+@router.post("/chat/stream")
+async def query_redis_stream(user_id: str, question: str, request: Request):
+    """
+    /agent/chat 的流式版本，以 text/event-stream 逐个返回模型输出的片段（token），
+    最后返回完整回答（answer）。客户端断开连接时取消模型调用。
+    """
+    return StreamingResponse(stream_chat(user_id, question, request), media_type="text/event-stream")
+
+
+async def stream_chat(user_id: str, question: str, request: Request):
+    try:
+        response = None
+        # 在整个流式响应期间独占会话，同一个会话的下一个请求等本轮对话保存后再开始
+        async with async_conversation_chain(user_id) as redis_chain:
+            events = redis_chain.astream_events({"input": question}, version="v2")
+            async with aclosing(events):
+                async for event in events:
+                    if await request.is_disconnected():
+                        return
+                    if event["event"] == "on_chat_model_stream":
+                        content = event["data"]["chunk"].content
+                        if content:
+                            yield sse_event("token", {"content": content})
+                    elif event["event"] == "on_chain_end" and not event.get("parent_ids"):
+                        # 链结束时已经通过 memory.save_context 把本轮对话写入 Redis
+                        response = event["data"]["output"]["response"]
+        yield sse_event("answer", {"response": response})
+    except Exception as e:
+        yield sse_event("error", {"detail": f"处理失败: {str(e)}"})
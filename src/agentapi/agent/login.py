@@ -1,11 +1,16 @@
 
-from fastapi import HTTPException, APIRouter
+from fastapi import HTTPException, APIRouter, Response
+from fastapi.concurrency import run_in_threadpool
+import aiomysql
 import pymysql
+import redis
 
 from src.agentapi.entity.result import create_response
 from src.agentapi.entity.user import UserRegister, UserLogin
-from src.agentapi.utils.dbtool import mysql_pool  # 使用修改后的连接池工具
-from src.agentapi.utils.login_utils import generate_captcha, get_password_hash, verify_password
+from src.agentapi.utils.async_mysql import async_mysql_pool  # 异步连接池，等待连接时不占用线程
+from src.agentapi.utils.captcha_store import captcha_store
+from src.agentapi.utils.login_utils import captcha_pool
+from src.agentapi.utils.password_hasher import password_hasher
 import base64
 
 
@@ -16,116 +21,114 @@ router = APIRouter(prefix="/agent", tags=["agent"])
 # 验证码生成端点
 @router.get("/captcha")
 def get_captcha():
-    code, buffer = generate_captcha()
+    # 从预生成的验证码池中取出，不在请求中绘图
+    code, png = captcha_pool.get()
     try:
-        with mysql_pool.get_conn() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    "INSERT INTO captchas (code) VALUES (%s)",
-                    (code,)
-                )
-                captcha_id = cursor.lastrowid
-                conn.commit()
+        # 保存验证码（默认存入 Redis，5 分钟后自动过期）
+        captcha_id = captcha_store.create(code)
 
         # 将图片数据编码为Base64
-        image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+        image_base64 = base64.b64encode(png).decode('utf-8')
         image_data = f"data:image/png;base64,{image_base64}"
 
         # 使用封装函数返回响应
         return create_response("验证码生成成功", data={
+            "id": captcha_id,
             "image": image_data,
             "text": code
         })
 
-    except pymysql.Error as e:
+    except (pymysql.Error, redis.RedisError) as e:
         raise HTTPException(status_code=500, detail=f"数据库错误: {str(e)}")
 
 
+# 验证码图片端点：直接返回 PNG，省去 Base64 编码（体积增加约 1/3），验证码 ID 放在响应头中
+@router.get("/captcha.png")
+def get_captcha_png():
+    code, png = captcha_pool.get()
+    try:
+        captcha_id = captcha_store.create(code)
+    except (pymysql.Error, redis.RedisError) as e:
+        raise HTTPException(status_code=500, detail=f"数据库错误: {str(e)}")
+
+    return Response(
+        content=png,
+        media_type="image/png",
+        headers={"X-Captcha-Id": str(captcha_id), "Cache-Control": "no-store"}
+    )
+
+
 # 注册端点
+# 数据库操作使用异步连接池，bcrypt 哈希在专用进程池中执行，不占用线程池
 @router.post("/register")
-def register(user: UserRegister):
+async def register(user: UserRegister):
     try:
-        with mysql_pool.get_conn() as conn:
-            with conn.cursor() as cursor:
-                # 验证验证码
-                cursor.execute(
-                    """SELECT * FROM captchas 
-                    WHERE id = %s AND code = %s 
-                    AND used = FALSE 
-                    AND created_at >= NOW() - INTERVAL 5 MINUTE""",
-                    (user.captcha_id, user.captcha_code)
-                )
-                if not cursor.fetchone():
-                    raise HTTPException(status_code=400, detail="验证码无效或已过期")
-
-                # 标记验证码为已使用
-                cursor.execute(
-                    "UPDATE captchas SET used = TRUE WHERE id = %s",
-                    (user.captcha_id,)
-                )
-
-                # 检查用户名是否存在
-                cursor.execute(
-                    "SELECT id FROM users WHERE username = %s",
-                    (user.username,)
-                )
-                if cursor.fetchone():
-                    raise HTTPException(status_code=400, detail="用户名已存在")
-
-                # 创建用户
-                hashed_password = get_password_hash(user.password)
-                cursor.execute(
-                    "INSERT INTO users (username, hashed_password) VALUES (%s, %s)",
-                    (user.username, hashed_password)
-                )
-                conn.commit()
-
-                # 使用封装函数返回响应
-                return create_response("注册成功")
-
-    except pymysql.Error as e:
-        conn.rollback()
+        # 哈希进程池已满时直接返回 503，不消耗验证码
+        password_hasher.admit()
+
+        # 验证验证码，校验的同时标记为已使用
+        if not await run_in_threadpool(captcha_store.consume, user.captcha_id, user.captcha_code):
+            raise HTTPException(status_code=400, detail="验证码无效或已过期")
+
+        # 检查用户名是否存在
+        if await async_mysql_pool.execute_query("SELECT id FROM users WHERE username = %s", (user.username,)):
+            raise HTTPException(status_code=400, detail="用户名已存在")
+
+        # 创建用户，用户名的唯一索引保证并发注册时只有一个成功
+        hashed_password = await password_hasher.hash(user.password)
+        try:
+            await async_mysql_pool.execute_update(
+                "INSERT INTO users (username, hashed_password) VALUES (%s, %s)",
+                (user.username, hashed_password)
+            )
+        except pymysql.IntegrityError:
+            raise HTTPException(status_code=400, detail="用户名已存在")
+
+        # 使用封装函数返回响应
+        return create_response("注册成功")
+
+    except (pymysql.Error, redis.RedisError) as e:
         raise HTTPException(status_code=500, detail=f"数据库错误: {str(e)}")
 
 
 # 登录端点
 @router.post("/login")
-def login(user: UserLogin):
+async def login(user: UserLogin):
     try:
-        with mysql_pool.get_conn() as conn:
-            with conn.cursor(pymysql.cursors.DictCursor) as cursor:
-                # 验证验证码
-                cursor.execute(
-                    """SELECT * FROM captchas 
-                    WHERE id = %s 
-                    AND code = %s 
-                    AND used = FALSE 
-                    AND created_at >= NOW() - INTERVAL 5 MINUTE""",
-                    (user.captcha_id, user.captcha_code)
-                )
-                if not cursor.fetchone():
-                    raise HTTPException(status_code=400, detail="验证码无效或已过期")
-
-                # 标记验证码已使用
-                cursor.execute(
-                    "UPDATE captchas SET used = TRUE WHERE id = %s",
-                    (user.captcha_id,)
-                )
-
-                # 验证用户凭证
-                cursor.execute(
-                    "SELECT * FROM users WHERE username = %s",
-                    (user.username,)
-                )
-                db_user = cursor.fetchone()
-                if not db_user or not verify_password(user.password, db_user["hashed_password"]):
-                    raise HTTPException(status_code=401, detail="用户名或密码错误")
-
-                conn.commit()
-
-                # 使用封装函数返回响应
-                return create_response("登录成功")
-
-    except pymysql.Error as e:
-        conn.rollback()
+        password_hasher.admit()
+
+        # 验证验证码，校验的同时标记为已使用
+        if not await run_in_threadpool(captcha_store.consume, user.captcha_id, user.captcha_code):
+            raise HTTPException(status_code=400, detail="验证码无效或已过期")
+
+        # 验证用户凭证
+        rows = await async_mysql_pool.execute_query(
+            "SELECT * FROM users WHERE username = %s",
+            (user.username,),
+            cursor_class=aiomysql.DictCursor
+        )
+        db_user = rows[0] if rows else None
+        if not db_user:
+            raise HTTPException(status_code=401, detail="用户名或密码错误")
+        valid, new_hash = await password_hasher.verify_and_update(user.password, db_user["hashed_password"])
+        if not valid:
+            raise HTTPException(status_code=401, detail="用户名或密码错误")
+
+        # bcrypt 成本参数调整后，用新的成本重新保存哈希；只在哈希未被修改时更新，避免覆盖并发的改密码
+        if new_hash:
+            await async_mysql_pool.execute_update(
+                "UPDATE users SET hashed_password = %s WHERE id = %s AND hashed_password = %s",
+                (new_hash, db_user["id"], db_user["hashed_password"])
+            )
+
+        # 使用封装函数返回响应
+        return create_response("登录成功")
+
+    except (pymysql.Error, redis.RedisError) as e:
         raise HTTPException(status_code=500, detail=f"数据库错误: {str(e)}")
+
+
+# 密码哈希进程池的排队和耗时统计
+@router.get("/password/stats")
+def password_stats():
+    return create_response("查询成功", password_hasher.stats())
@@ -1,16 +1,59 @@
-from fastapi.responses import JSONResponse
+import orjson
+from fastapi.responses import Response
 
-def create_response(message: str, data: dict = None) -> JSONResponse:
+# orjson 的序列化选项：允许非字符串的键、直接序列化 numpy 数组；中文不转义，与 ensure_ascii=False 一致
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def dumps(content) -> bytes:
+    """
+    使用 orjson 序列化为 JSON 字节串，无法直接序列化的对象（例如 Decimal）转为字符串
+    """
+    return orjson.dumps(content, default=str, option=_ORJSON_OPTIONS)
+
+
+class FastJSONResponse(Response):
+    """
+    使用 orjson 序列化的 JSON 响应，作为应用的默认响应类
+    content 为 bytes 时视为已经编码好的 JSON，直接作为响应体
+    """
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
+
+
+def json_response(content, status_code: int = 200) -> FastJSONResponse:
+    """
+    直接返回 JSON 响应：路由返回 Response 对象时 FastAPI 不再执行 jsonable_encoder，只序列化一次
+    :param content: 只包含 JSON 基本类型的数据
+    :param status_code: HTTP 状态码
+    """
+    return FastJSONResponse(content=dumps(content), status_code=status_code)
+
+
+def create_response(message: str, data: dict = None) -> FastJSONResponse:
     """
     创建统一的响应格式
     :param message: 响应的消息内容
     :param data: 响应的数据部分（可选）
-    :return: JSONResponse 对象
+    :return: FastJSONResponse 对象，响应体已经编码为 JSON
     """
     response_data = {
         "code": 200,
         "message": "success",
         "data": data or {"message": message}
     }
-    return JSONResponse(content=response_data)
+    return json_response(response_data)
+
 
+def sse_event(event: str, data) -> str:
+    """
+    创建一条 Server-Sent Events 消息
+    :param event: 事件类型
+    :param data: 事件数据，会序列化为 JSON
+    :return: text/event-stream 格式的字符串
+    """
+    return f"event: {event}\ndata: {dumps(data).decode('utf-8')}\n\n"
@@ -1,19 +1,89 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 
 from src.agentapi.agent.agent import router as agent_router
 from src.agentapi.agent.langchat import router as langchat_router
 from src.agentapi.agent.login import router as login_router
+from src.agentapi.entity.result import FastJSONResponse, json_response
 from fastapi.middleware.cors import CORSMiddleware
+from src.agentapi.utils.agent_runner import agent_runner
+from src.agentapi.utils.async_mysql import async_mysql_pool
+from src.agentapi.utils.dbtool import agent_tools, mysql_pool
+from src.agentapi.utils.embedding import get_embedding_model, is_embedding_model_loaded, embedding_service
+from src.agentapi.utils.lifecycle import is_created, readiness, register_warmer, warm_up
+from src.agentapi.utils.llm_gateway import llm_gateway
+from src.agentapi.utils.login_utils import captcha_pool
+from src.agentapi.utils.middleware import ResponseHeaderMiddleware
+from src.agentapi.utils.password_hasher import password_hasher
+from src.agentapi.utils.pool_metrics import render_prometheus, pool_stats
+from src.agentapi.utils.redis_tool import async_redis_client
+
+# 启动时在后台并发预热数据库连接、SQL 代理、表结构目录和向量模型
+WARM_UP_ON_STARTUP = True
+# 为 True 时等预热完成后才开始接收请求；默认不等待，未预热的子系统在第一次使用时创建，/ready 返回 503
+WAIT_FOR_WARM_UP = False
+
+
+def warm_up_catalog():
+    agent_tools.catalog.warm_up()
+    agent_tools.selector.refresh()
+
+
+register_warmer("schema_catalog", warm_up_catalog, lambda: is_created(agent_tools) and agent_tools.catalog.is_warm())
+# 向量模型不可用时选表、语义缓存和 RAG 都会降级，不影响 /ready
+register_warmer("embedding", get_embedding_model, is_embedding_model_loaded, optional=True)
+# 池子被取空时请求会现场生成验证码，只检查后台补充线程是否在运行
+register_warmer("captcha_pool", captcha_pool.start, captcha_pool.is_running)
+register_warmer("async_mysql_pool", async_mysql_pool.get_pool, lambda: async_mysql_pool.status()["size"] > 0)
+
+
+async def _warm_up():
+    seconds = await warm_up()
+    print(f"预热完成，耗时 {seconds:.2f} 秒")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARM_UP_ON_STARTUP:
+        task = asyncio.create_task(_warm_up())
+        if WAIT_FOR_WARM_UP:
+            await task
+        # 保存任务的引用，避免被垃圾回收
+        app.state.warm_up_task = task
+    yield
+    # 关闭时释放连接池和进程池；没有创建过的子系统不需要关闭
+    agent_runner.close()
+    password_hasher.close()
+    if is_created(mysql_pool):
+        mysql_pool.close()
+    await async_mysql_pool.close()
+    if is_created(agent_tools):
+        await agent_tools.query_pool.close()
+    await async_redis_client.aclose()
+    await llm_gateway.aclose()
+
 
 # 创建主应用实例
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)  # 默认使用 orjson 序列化响应
 
 # 添加跨域中间件
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:5173"],
-    allow_methods=["*"]
+    allow_methods=["*"],
+    expose_headers=["X-Captcha-Id", "Server-Timing"]  # 允许前端读取 /agent/captcha.png 返回的验证码 ID 和服务端耗时
+)
+
+# 添加自定义响应头和 Server-Timing（纯 ASGI 中间件，不影响流式响应）
+# 响应头的键和值都是自定义，但是不能使用中文
+app.add_middleware(
+    ResponseHeaderMiddleware,
+    headers={"Custom-Response-Headers": "Lidongyang Service"},
+    timing_allow_origin="http://localhost:5173"
 )
 
 # 挂载子路由到主应用
@@ -21,23 +91,41 @@ app.include_router(agent_router)
 app.include_router(langchat_router)
 app.include_router(login_router)
 
-@app.middleware("http")  # 声明这是一个 HTTP 中间件
-async def add_custom_header(request, call_next):
-    # 1. 先将请求传递给路由处理，得到响应, 也可以提前对请求进行验证等操作
-    response = await call_next(request)
+# 根路径接口
+@app.get("/")
+def root():
+    return json_response({"message": "Welcome to the API"})
 
-    # 2. 在响应头中添加自定义字段，键和值都是自定义，但是不能自定义中文
-    response.headers["Custom-Response-Headers"] = "Lidongyang Service"
 
-    # 3. 返回修改后的响应
-    return response
+# 就绪检查：所有子系统都已初始化时返回 200，否则返回 503 和各子系统的状态
+@app.get("/ready")
+def ready():
+    is_ready, subsystems = readiness()
+    return json_response({"ready": is_ready, "subsystems": subsystems}, status_code=200 if is_ready else 503)
 
 
-# 根路径接口
-@app.get("/")
-def root():
-    return {"message": "Welcome to the API"}
+# 连接池指标（Prometheus 文本格式）：获取连接的等待时间直方图、使用中/空闲连接数、超时次数和连接抖动
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+# 连接池指标（JSON 格式）
+@app.get("/metrics/pools")
+def metrics_pools():
+    return json_response(pool_stats())
+
+
+# LLM 网关指标：每个调用方的排队时间、上游延迟、429 / 5xx 和重试次数
+@app.get("/metrics/llm")
+def metrics_llm():
+    return json_response(llm_gateway.stats())
+
 
+# 向量编码指标：编码吞吐量（条/秒）、批大小和缓存命中次数
+@app.get("/metrics/embedding")
+def metrics_embedding():
+    return json_response(embedding_service.stats())
 
 
 if __name__ == "__main__":
@@ -1,6 +1,6 @@
 from langchain.memory import ConversationBufferMemory
 from langchain_community.chat_message_histories import RedisChatMessageHistory
-from langchain_deepseek import ChatDeepSeek
+from src.agentapi.utils.llm_gateway import llm_gateway
 from langchain.agents import initialize_agent, AgentType
 from langchain_community.tools.tavily_search import TavilySearchResults
 
@@ -23,7 +23,7 @@ def create_memory(session_id: str):
     )
 
 # 初始化模型和工具
-model = ChatDeepSeek(model="deepseek-chat", max_tokens=200)
+model = llm_gateway.chat_model()
 search = TavilySearchResults(max_results=2)
 tools = [search]
 
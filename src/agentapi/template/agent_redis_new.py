@@ -4,7 +4,7 @@ from langchain.memory import ConversationBufferMemory
 from langchain_community.chat_message_histories import RedisChatMessageHistory
 from langchain_community.tools import Tool
 from langchain_core.tools import tool
-from langchain_deepseek import ChatDeepSeek
+from src.agentapi.utils.llm_gateway import llm_gateway
 
 
 # 初始化Redis消息历史
@@ -47,7 +47,7 @@ prompt = hub.pull("hwchase17/react-chat")
 print(prompt)
 
 # 初始化模型
-model = ChatDeepSeek(model="deepseek-chat", max_tokens=200)
+model = llm_gateway.chat_model()
 
 # 创建 Agent
 agent = create_react_agent(model, tools, prompt)
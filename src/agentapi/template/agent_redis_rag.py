@@ -3,17 +3,15 @@ from langchain.agents import create_react_agent, AgentExecutor
 from langchain.chains.retrieval_qa.base import RetrievalQA
 from langchain.memory import ConversationBufferMemory
 from langchain_community.chat_message_histories import RedisChatMessageHistory
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.tools import Tool
-from langchain_community.vectorstores import Chroma
 from langchain_core.tools import tool
-from langchain_deepseek import ChatDeepSeek
-from langchain_community.document_loaders import Docx2txtLoader, DirectoryLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from src.agentapi.utils.llm_gateway import llm_gateway
+from src.agentapi.utils.hybrid_retriever import hybrid_retriever
 
 
 # 初始化模型
-model = ChatDeepSeek(model="deepseek-chat", max_tokens=200)
+model = llm_gateway.chat_model()
 
 
 # 初始化Redis消息历史
@@ -43,59 +41,29 @@ def search_tool(s: str) -> str:
     return f"今天天气很好"
 
 
-# Step 1: 文档加载与处理
-# 配置Word文档加载器
-def load_documents():
-    loader = DirectoryLoader(
-        "D:/D/document/python/程序操作空间/操作读取",
-        glob="**/*.docx",
-        loader_cls=Docx2txtLoader,
-        use_multithreading=True  # 启用多线程加速加载
-    )
-    docs = loader.load()
-
-    # 文本分割（根据需求调整参数）
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        separators=["\n\n", "\n", "。", "！", "？"]  # 中文分段优化
-    )
-    return text_splitter.split_documents(docs)
-
-# Step 2: 创建向量数据库
-def create_vector_store():
-    docs = load_documents()
-    # 2、指定使用的预训练模型名称
-    model_name = "D:/D/document/donotdelete/models/bge-large-zh/bge-large-zh-v1.5"
-
-    # 配置模型加载参数，指定设备为 GPU（如果可用），则需修改为 'cuda'
-    model_kwargs = {'device': 'cpu'}
+# Step 1、2: 文档加载、切分和向量化由持久化索引负责（src/agentapi/utils/rag_index.py），
+# 只在文档变化时增量更新，更新索引：python -m src.agentapi.utils.rag_index
+_qa_chain = None
 
-    # 配置编码参数，设置 normalize_embeddings 为 True 以支持余弦相似度计算
-    encode_kwargs = {'normalize_embeddings': True}
 
-    # 初始化嵌入语义理解模型（使用镜像或本地路径），传入模型名称、加载参数、编码参数和查询指令
-    embeddings = HuggingFaceEmbeddings(
-        model_name=model_name,
-        model_kwargs=model_kwargs,
-        encode_kwargs=encode_kwargs,
-    )
-    return Chroma.from_documents(docs, embeddings)
+def get_qa_chain():
+    """问答链在第一次使用时创建，之后复用同一个索引"""
+    global _qa_chain
+    if _qa_chain is None:
+        # BM25 + 向量的混合检索，返回前3相关片段；菜名、套餐名这类关键词问题直接走 BM25
+        retriever = hybrid_retriever(k=3)
+        _qa_chain = RetrievalQA.from_chain_type(
+            llm=model,
+            chain_type="stuff",
+            retriever=retriever
+        )
+    return _qa_chain
 
 
 # Step 3: 封装 RAG 为工具
 def rag_tool(query: str) -> str:
     """当需要回答基于文档的问题时，使用此工具。输入应为具体问题。"""
-    vector_db = create_vector_store()
-    retriever = vector_db.as_retriever(search_kwargs={"k": 3})  # 返回前3相关片段
-
-    # 构建问答链
-    qa_chain = RetrievalQA.from_chain_type(
-        llm=model,
-        chain_type="stuff",
-        retriever=retriever
-    )
-    return qa_chain.invoke(query)["result"]
+    return get_qa_chain().invoke(query)["result"]
 
 
 # 将 RAG 包装成 LangChain Tool 对象
@@ -0,0 +1,15 @@
+import secrets
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+# 管理接口的令牌，请求头 X-Admin-Token 与之相同时才允许调用；为 None 时管理接口不可用
+ADMIN_TOKEN = None
+
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    """管理接口的依赖项：校验 X-Admin-Token 请求头"""
+    if ADMIN_TOKEN is None:
+        raise HTTPException(status_code=403, detail="管理接口未启用")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="管理令牌无效")
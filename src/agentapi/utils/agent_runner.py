@@ -0,0 +1,99 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+
+class AgentRunner:
+    """
+    SQL 代理的执行器：把代理调用移出事件循环，并做并发限制和准入控制。
+
+    - max_concurrency: 同时执行的代理数量上限
+    - max_queue: 排队等待的请求上限，超过后直接返回 503，不再排队
+    - timeout: 单个请求的超时时间（秒），包含排队时间
+    - use_thread_pool: False 时使用代理原生的 ainvoke；
+      True 时在专用的有界线程池中执行同步 invoke，不占用 AnyIO 默认线程池
+    """
+
+    def __init__(self, max_concurrency=4, max_queue=16, timeout=120, use_thread_pool=False):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.use_thread_pool = use_thread_pool
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._pending = 0  # 已接收的请求数（排队 + 执行中）
+        self._running = 0  # 正在执行的请求数
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency,
+            thread_name_prefix="agent-runner"
+        ) if use_thread_pool else None
+
+    def admit(self):
+        """准入控制：排队已满时快速失败（503），避免请求无限堆积"""
+        if self._pending >= self.max_concurrency + self.max_queue:
+            raise HTTPException(status_code=503, detail="代理繁忙，请稍后重试")
+
+    async def acquire(self, timeout=None):
+        """
+        排队获取一个执行名额，用完后必须调用 release
+        队列已满时返回 503，排队超时返回 504
+        """
+        self.admit()
+        self._pending += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self._pending -= 1
+            raise HTTPException(status_code=504, detail="代理排队超时")
+        except BaseException:
+            self._pending -= 1
+            raise
+        self._running += 1
+
+    def release(self):
+        """归还执行名额"""
+        self._running -= 1
+        self._pending -= 1
+        self._semaphore.release()
+
+    async def run(self, executor, payload, timeout=None):
+        """
+        执行一次代理调用
+        :param executor: LangGraph 代理执行器（支持 invoke / ainvoke）
+        :param payload: 传给代理的输入
+        :param timeout: 本次请求的超时时间（秒），包含排队时间，不传时使用默认值
+        :return: 代理的输出
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or self.timeout)
+        await self.acquire(timeout or self.timeout)
+        try:
+            return await asyncio.wait_for(self._invoke(executor, payload), deadline - loop.time())
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="代理执行超时")
+        finally:
+            self.release()
+
+    async def _invoke(self, executor, payload):
+        if self._executor is None:
+            return await executor.ainvoke(payload)
+        # 线程池模式下超时只能放弃等待结果，线程内的调用会继续执行到结束
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, executor.invoke, payload)
+
+    def stats(self):
+        """返回当前的执行状态"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "running": self._running,
+            "waiting": self._pending - self._running
+        }
+
+    def close(self):
+        """关闭专用线程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+agent_runner = AgentRunner()
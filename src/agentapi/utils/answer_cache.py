@@ -0,0 +1,301 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import redis
+from langchain_core.messages import AIMessage, ToolMessage
+
+from src.agentapi.utils.dbtool import agent_tools
+from src.agentapi.utils.embedding import embed_query
+from src.agentapi.utils.lifecycle import Lazy
+from src.agentapi.utils.redis_tool import redis_client
+
+_PUNCTUATION = re.compile(r"[\s,.!?;:，。！？；：、\"'“”‘’()（）]+")
+_TABLE = re.compile(r"\b(?:from|join)\s+`?(\w+)`?(?:\s*\.\s*`?(\w+)`?)?", re.IGNORECASE)
+# 问题中的字面量：日期、引号中的字符串、数字
+_QUESTION_LITERAL = re.compile(
+    r"(?P<date>\d{4}-\d{1,2}-\d{1,2})"
+    r"|[\"“'‘「](?P<string>[^\"”'’」]+)[\"”'’」]"
+    r"|(?P<number>\d+(?:\.\d+)?)"
+)
+# 问题中的相对日期，"今天订单总额" 和 "昨天订单总额" 的向量几乎相同，但答案不同
+_RELATIVE_DATE = re.compile(
+    r"大前天|前天|昨天|昨日|今天|今日|明天|"
+    r"(?:上上|上个?|下个?|这个?|本)(?:周|星期|礼拜|月|季度)|"
+    r"前年|去年|今年|明年|最近\d*(?:天|日|周|个月|月|年)"
+)
+
+
+def normalize_question(question: str) -> str:
+    """问题归一化：去掉空白和标点，英文转小写"""
+    return _PUNCTUATION.sub("", question).lower()
+
+
+def parameterize(question: str):
+    """
+    把问题中的字面量替换为占位符
+    :return: (问题模板, 字面量列表)，例如 "订单号为123的订单" -> ("订单号为{0}的订单", [123])
+    """
+    values = []
+
+    def replace(match):
+        if match.group("number") is not None:
+            text = match.group("number")
+            values.append(float(text) if "." in text else int(text))
+        else:
+            values.append(match.group("date") or match.group("string"))
+        return "{%d}" % (len(values) - 1)
+
+    return _QUESTION_LITERAL.sub(replace, question), values
+
+
+def question_literals(question: str):
+    """问题中的字面量和相对日期，语义匹配时两个问题的字面量必须相同"""
+    return parameterize(question)[1], _RELATIVE_DATE.findall(question)
+
+
+def extract_tables(sql: str):
+    """从 SQL 中提取 FROM / JOIN 后面的表名"""
+    return {(schema_table or table) for table, schema_table in _TABLE.findall(sql)}
+
+
+def extract_sql(messages):
+    """从代理的消息中提取 sql_db_query 工具执行过的 SQL"""
+    return [
+        call["args"].get("query", "")
+        for msg in messages
+        for call in (getattr(msg, "tool_calls", None) or [])
+        if call["name"] == "sql_db_query"
+    ]
+
+
+def is_answered(messages):
+    """
+    代理是否成功回答：最后一条消息是没有工具调用的非空回答，并且最后一次 sql_db_query 没有报错。
+    失败的回答（"未找到有效回答"、SQL 报错后的说明）不能缓存，否则 ttl 内相同的问题都会得到这个错误
+    """
+    if not messages:
+        return False
+    last = messages[-1]
+    if not isinstance(last, AIMessage) or last.tool_calls or not str(last.content).strip():
+        return False
+    calls = {
+        call["id"]
+        for msg in messages
+        for call in (getattr(msg, "tool_calls", None) or [])
+        if call["name"] == "sql_db_query"
+    }
+    results = [msg for msg in messages if isinstance(msg, ToolMessage) and msg.tool_call_id in calls]
+    return bool(results) and not str(results[-1].content).startswith("Error")
+
+
+class AnswerCache:
+    """
+    /agent/server 的答案缓存，分两级：
+
+    - 精确匹配：归一化后的问题文本作为键，进程内 LRU + Redis
+    - 语义匹配：问题向量与已缓存问题的余弦相似度超过 threshold，并且两个问题中的字面量和相对日期
+      （数字、日期、引号中的字符串、"今天"、"上个月" 等）完全相同时命中
+    每条缓存记录 SQL 涉及的表及其版本号（来自 SchemaCatalog），
+    表数据或结构变化、或者调用 invalidate_table 后缓存失效。
+    """
+
+    def __init__(self, redis_client=None, catalog=None, maxsize=1024, ttl=600, threshold=0.95,
+                 semantic=True):
+        self.redis = redis_client
+        self.catalog = catalog
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.semantic = semantic
+        self._entries = OrderedDict()  # 键 -> 缓存记录
+        self._vectors = OrderedDict()  # 键 -> 问题向量
+        self._lock = threading.Lock()
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+
+    def get(self, question: str):
+        """
+        查询缓存，命中时返回缓存记录 {"question", "answer", "tables", ...}，否则返回 None
+        """
+        key = self._key(question)
+        entry = self._get_entry(key)
+        if entry is not None:
+            self._count("exact")
+            return entry
+
+        if self.semantic:
+            entry = self._get_semantic(question)
+            if entry is not None:
+                self._count("semantic")
+                return entry
+
+        self._count(None)
+        return None
+
+    def set(self, question: str, answer: str, tables):
+        """
+        写入缓存，只应写入成功的回答（见 is_answered）
+        :param question: 用户问题
+        :param answer: 代理的回答，为空时不缓存
+        :param tables: 生成的 SQL 涉及的表
+        """
+        if not answer or not str(answer).strip():
+            return
+        key = self._key(question)
+        tables = sorted(tables)
+        entry = {
+            "question": question,
+            "answer": answer,
+            "tables": tables,
+            "versions": self._table_versions(tables),
+            "expire_at": time.time() + self.ttl
+        }
+        vector = self._embed(question) if self.semantic else None
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            if vector is not None:
+                self._vectors[key] = vector
+            while len(self._entries) > self.maxsize:
+                old_key, _ = self._entries.popitem(last=False)
+                self._vectors.pop(old_key, None)
+
+        if self.redis is not None:
+            try:
+                pipeline = self.redis.pipeline()
+                pipeline.set(f"answer_cache:{key}", json.dumps(entry, ensure_ascii=False), ex=self.ttl)
+                for table in tables:
+                    pipeline.sadd(f"answer_cache:table:{table}", key)
+                    pipeline.expire(f"answer_cache:table:{table}", self.ttl)
+                pipeline.execute()
+            except redis.RedisError as e:
+                print("写入答案缓存失败:", e)
+
+    def invalidate_table(self, table: str):
+        """删除所有涉及指定表的缓存"""
+        with self._lock:
+            keys = [k for k, v in self._entries.items() if table in v["tables"]]
+            for k in keys:
+                self._entries.pop(k, None)
+                self._vectors.pop(k, None)
+
+        if self.redis is not None:
+            try:
+                keys = self.redis.smembers(f"answer_cache:table:{table}")
+                pipeline = self.redis.pipeline()
+                for k in keys:
+                    pipeline.delete(f"answer_cache:{k.decode() if isinstance(k, bytes) else k}")
+                pipeline.delete(f"answer_cache:table:{table}")
+                pipeline.execute()
+            except redis.RedisError as e:
+                print("清除答案缓存失败:", e)
+
+    def stats(self):
+        """返回命中和未命中次数"""
+        with self._lock:
+            hits, misses, size = dict(self.hits), self.misses, len(self._entries)
+        total = hits["exact"] + hits["semantic"] + misses
+        return {
+            "size": size,
+            "hits_exact": hits["exact"],
+            "hits_semantic": hits["semantic"],
+            "misses": misses,
+            "hit_rate": round((total - misses) / total, 4) if total else 0.0
+        }
+
+    def _count(self, kind):
+        """在锁内更新命中（kind 为 exact / semantic）或未命中（kind 为 None）次数，请求在多个线程中并发执行"""
+        with self._lock:
+            if kind is None:
+                self.misses += 1
+            else:
+                self.hits[kind] += 1
+
+    def _key(self, question):
+        return hashlib.sha1(normalize_question(question).encode("utf-8")).hexdigest()
+
+    def _get_entry(self, key):
+        # 1. 进程内 LRU
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        # 2. Redis
+        if entry is None and self.redis is not None:
+            try:
+                data = self.redis.get(f"answer_cache:{key}")
+            except redis.RedisError as e:
+                print("读取答案缓存失败:", e)
+                data = None
+            if data:
+                entry = json.loads(data)
+                with self._lock:
+                    self._entries[key] = entry
+                    while len(self._entries) > self.maxsize:
+                        old_key, _ = self._entries.popitem(last=False)
+                        self._vectors.pop(old_key, None)
+
+        if entry is None:
+            return None
+        if not self._is_fresh(entry):
+            with self._lock:
+                self._entries.pop(key, None)
+                self._vectors.pop(key, None)
+            if self.redis is not None:
+                try:
+                    self.redis.delete(f"answer_cache:{key}")
+                except redis.RedisError as e:
+                    print("清除答案缓存失败:", e)
+            return None
+        return entry
+
+    def _get_semantic(self, question):
+        with self._lock:
+            keys = list(self._vectors)
+            vectors = list(self._vectors.values())
+        if not keys:
+            return None
+
+        vector = self._embed(question)
+        if vector is None:
+            return None
+
+        # bge 的余弦相似度集中在很窄的区间内，只差一个日期或数字的问题也会超过阈值，
+        # 按相似度从高到低找第一个字面量相同的问题
+        scores = np.stack(vectors) @ vector
+        literals = question_literals(question)
+        for i in np.argsort(-scores):
+            if scores[i] < self.threshold:
+                break
+            entry = self._get_entry(keys[i])
+            if entry is not None and question_literals(entry["question"]) == literals:
+                return entry
+        return None
+
+    def _is_fresh(self, entry):
+        """缓存未过期，且涉及的表版本没有变化"""
+        if entry["expire_at"] < time.time():
+            return False
+        return self._table_versions(entry["tables"]) == entry["versions"]
+
+    def _table_versions(self, tables):
+        if self.catalog is None:
+            return {}
+        try:
+            return self.catalog.table_versions(tables)
+        except Exception as e:
+            print("读取表版本失败:", e)
+            return {}
+
+    def _embed(self, question):
+        return embed_query(normalize_question(question))
+
+
+answer_cache = Lazy("answer_cache", lambda: AnswerCache(redis_client, agent_tools.catalog))
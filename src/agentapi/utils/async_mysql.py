@@ -0,0 +1,150 @@
+import asyncio
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any
+
+import aiomysql
+from fastapi import HTTPException
+from langchain_community.tools.sql_database.tool import QuerySQLDatabaseTool
+from langchain_community.utilities.sql_database import truncate_word
+from pydantic import Field
+
+from src.agentapi.utils.pool_metrics import register_pool
+
+
+class AsyncMySQLPool:
+    """
+    基于 aiomysql 的异步连接池，接口与 MySQLPool 一致（get_conn / execute_query / execute_update），
+    等待连接时不占用线程，可以直接在 async 接口中使用。
+
+    - minsize / maxsize: 连接池的最小、最大连接数
+    - acquire_timeout: 获取连接的超时时间（秒），超时返回 503
+    - recycle: 连接使用超过该时间（秒）后重新建立，避免被 MySQL 的 wait_timeout 断开
+    - ping_interval: 连接空闲超过该时间（秒）时，取出前先 ping 一次，断开则自动重连；为 0 时每次都 ping
+    - name: 连接池指标中的名称
+    """
+
+    def __init__(self, host='127.0.0.1', port=3306, user='root', password='root', database='agent',
+                 charset='utf8', minsize=2, maxsize=20, acquire_timeout=5, recycle=3600, ping_interval=30,
+                 name="mysql_async"):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.database = database
+        self.charset = charset
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.acquire_timeout = acquire_timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+        self._pool = None
+        self._lock = asyncio.Lock()
+        self._seen = weakref.WeakSet()  # 借出过的连接，用于统计新建的连接数
+        self.metrics = register_pool(name, self.status)
+
+    async def get_pool(self):
+        """连接池在第一次使用时创建，必须在事件循环中调用"""
+        if self._pool is None:
+            async with self._lock:
+                if self._pool is None:
+                    self._pool = await aiomysql.create_pool(
+                        minsize=self.minsize,
+                        maxsize=self.maxsize,
+                        pool_recycle=self.recycle,
+                        host=self.host,
+                        port=self.port,
+                        user=self.user,
+                        password=self.password,
+                        db=self.database,
+                        charset=self.charset,
+                        autocommit=True  # 自动提交事务
+                    )
+        return self._pool
+
+    @asynccontextmanager
+    async def get_conn(self):
+        """获取数据库连接，用完后自动归还连接池"""
+        pool = await self.get_pool()
+        start = time.perf_counter()
+        try:
+            conn = await asyncio.wait_for(pool.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.metrics.timeout()
+            raise HTTPException(status_code=503, detail="数据库连接繁忙，请稍后重试")
+        finally:
+            self.metrics.observe_wait(time.perf_counter() - start)
+        if conn not in self._seen:
+            # 第一次借出的连接是新建的（包括 recycle 后重建的）
+            self._seen.add(conn)
+            self.metrics.connected()
+        try:
+            # 空闲较久的连接可能已被服务端断开，ping 失败时 aiomysql 会重新连接
+            if time.monotonic() - getattr(conn, "_last_used", 0.0) >= self.ping_interval:
+                await conn.ping(reconnect=True)
+            yield conn
+        finally:
+            conn._last_used = time.monotonic()
+            pool.release(conn)
+
+    async def execute_query(self, sql, args=None, cursor_class=None):
+        """执行查询操作，cursor_class 为 aiomysql.DictCursor 时以字典形式返回"""
+        cursor_classes = (cursor_class,) if cursor_class else ()
+        async with self.get_conn() as conn:
+            async with conn.cursor(*cursor_classes) as cursor:
+                await cursor.execute(sql, args)
+                return await cursor.fetchall()
+
+    async def execute_update(self, sql, args=None):
+        """执行更新操作"""
+        async with self.get_conn() as conn:
+            async with conn.cursor() as cursor:
+                try:
+                    rows = await cursor.execute(sql, args)
+                    await conn.commit()
+                    return rows
+                except Exception:
+                    await conn.rollback()
+                    raise
+
+    def status(self):
+        """当前连接数、使用中和空闲的连接数"""
+        if self._pool is None:
+            return {"size": 0, "in_use": 0, "idle": 0, "max_size": self.maxsize}
+        size = self._pool.size
+        return {
+            "size": size,
+            "in_use": size - self._pool.freesize,
+            "idle": self._pool.freesize,
+            "max_size": self._pool.maxsize,
+            "closes": max(self.metrics.connects - size, 0)
+        }
+
+    async def close(self):
+        """关闭连接池"""
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+
+
+class AsyncQuerySQLDatabaseTool(QuerySQLDatabaseTool):
+    """
+    sql_db_query 的异步版本：代理通过 ainvoke 调用时使用异步连接池执行查询，不占用线程
+    返回格式与 SQLDatabase.run_no_throw 一致；同步调用时仍使用 SQLDatabase
+    """
+    pool: Any = Field(exclude=True)
+
+    async def _arun(self, query: str, run_manager=None) -> str:
+        try:
+            rows = await self.pool.execute_query(query)
+        except Exception as e:
+            return f"Error: {e}"
+        if not rows:
+            return ""
+        max_length = self.db._max_string_length
+        return str([tuple(truncate_word(c, length=max_length) for c in row) for row in rows])
+
+
+async_mysql_pool = AsyncMySQLPool()
@@ -0,0 +1,113 @@
+import time
+
+from src.agentapi.utils.dbtool import mysql_pool
+from src.agentapi.utils.redis_tool import redis_client
+
+# 验证码有效期（秒）
+CAPTCHA_TTL = 300
+
+# 验证码存储方式：redis（默认）或 mysql（Redis 不可用时切换到原来的 captchas 表）
+CAPTCHA_BACKEND = "redis"
+
+
+class RedisCaptchaStore:
+    """
+    使用 Redis 保存验证码：依靠键的过期时间自动清理，校验时 GETDEL 原子地取出并删除，保证只能使用一次
+    创建和校验都只需要一次往返
+    """
+
+    # 生成自增 ID 并保存验证码，在一次往返内完成
+    _CREATE_SCRIPT = """
+    local id = redis.call('INCR', KEYS[1])
+    redis.call('SET', ARGV[1] .. id, ARGV[2], 'EX', ARGV[3])
+    return id
+    """
+
+    def __init__(self, redis_client, ttl=CAPTCHA_TTL, prefix="captcha:"):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.prefix = prefix
+        self._create = self.redis.register_script(self._CREATE_SCRIPT)
+
+    def create(self, code: str) -> int:
+        """保存验证码，返回验证码 ID"""
+        return int(self._create(keys=[f"{self.prefix}id"], args=[self.prefix, code, self.ttl]))
+
+    def consume(self, captcha_id: int, code: str) -> bool:
+        """校验验证码，无论是否正确都会删除，防止暴力猜测"""
+        stored = self.redis.getdel(f"{self.prefix}{captcha_id}")
+        if stored is None:
+            return False
+        if isinstance(stored, bytes):
+            stored = stored.decode("utf-8")
+        # 与原来 captchas 表的 utf8_general_ci 排序规则一致，不区分大小写
+        return stored.upper() == code.upper()
+
+
+class MySQLCaptchaStore:
+    """
+    使用 MySQL 的 captchas 表保存验证码
+    校验和标记已使用合并为一条 UPDATE；过期的记录每隔 purge_interval 秒分批删除
+    """
+
+    def __init__(self, pool, ttl=CAPTCHA_TTL, purge_interval=60, purge_batch=1000):
+        self.pool = pool
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self.purge_batch = purge_batch
+        self._purged_at = 0.0
+
+    def create(self, code: str) -> int:
+        """保存验证码，返回验证码 ID"""
+        self._purge_if_due()
+        with self.pool.get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "INSERT INTO captchas (code) VALUES (%s)",
+                    (code,)
+                )
+                captcha_id = cursor.lastrowid
+                conn.commit()
+        return captcha_id
+
+    def consume(self, captcha_id: int, code: str) -> bool:
+        """校验验证码并标记为已使用，受影响的行数为 1 表示验证码有效"""
+        rows = self.pool.execute_update(
+            """UPDATE captchas SET used = TRUE
+            WHERE id = %s
+            AND code = %s
+            AND used = FALSE
+            AND created_at >= NOW() - INTERVAL %s SECOND""",
+            (captcha_id, code, self.ttl)
+        )
+        return rows == 1
+
+    def purge_expired(self):
+        """分批删除过期的验证码，每批最多 purge_batch 条，避免长时间锁表"""
+        total = 0
+        while True:
+            rows = self.pool.execute_update(
+                "DELETE FROM captchas WHERE created_at < NOW() - INTERVAL %s SECOND LIMIT %s",
+                (self.ttl, self.purge_batch)
+            )
+            total += rows
+            if rows < self.purge_batch:
+                return total
+
+    def _purge_if_due(self):
+        if time.time() - self._purged_at < self.purge_interval:
+            return
+        self._purged_at = time.time()
+        try:
+            self.purge_expired()
+        except Exception as e:
+            print("清理过期验证码失败:", e)
+
+
+def create_captcha_store(backend=CAPTCHA_BACKEND):
+    if backend == "mysql":
+        return MySQLCaptchaStore(mysql_pool)
+    return RedisCaptchaStore(redis_client)
+
+
+captcha_store = create_captcha_store()
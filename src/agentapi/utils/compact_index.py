@@ -0,0 +1,354 @@
+"""
+RAG 索引的压缩向量存储：第一阶段用 int8 / float16 向量召回候选，第二阶段用全精度向量精确重排
+
+- 召回向量按 mode 压缩保存：int8（每个向量一个缩放系数，约为 float32 的 1/4）或 float16（1/2），
+  可以用小模型（SMALL_EMBEDDING_MODEL，512 维）重新编码作为召回向量，进一步减小索引
+- 全精度向量（主模型的 float32 向量，取自 Chroma）保存为 .npy 并以内存映射方式打开，
+  只读取候选行做重排，不占用常驻内存
+- 与 Chroma 的向量存储一样提供 similarity_search，可以作为 HybridRetriever 的 vector_store；
+  导入完成后（RagIndex.mark_synced）在后台线程中重建，重建完成前继续使用旧的索引
+
+在项目根目录运行以构建：
+python -m src.agentapi.utils.compact_index [--mode int8|float16] [--small-model]
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from langchain_core.documents import Document
+
+from src.agentapi.utils.embedding import SMALL_EMBEDDING_MODEL, get_embedding_service
+from src.agentapi.utils.rag_index import RagIndex, rag_index
+
+# 为 None 时 RAG 检索直接使用 Chroma，否则使用对应模式的压缩索引
+COMPACT_MODE = None
+# 为 True 时用 SMALL_EMBEDDING_MODEL 编码召回向量
+COMPACT_SMALL_MODEL = False
+
+MODES = ("int8", "float16", "float32")
+
+# 版本目录名：v + 构建时间（纳秒），构建中的目录带 .tmp 后缀
+_VERSION_DIR = re.compile(r"^v(\d+)(\.tmp)?$")
+
+
+class QuantizedVectors:
+    """
+    压缩保存的归一化向量
+
+    int8 时每行 v 保存为 round(v / s) 和 s = max|v| / 127，点积为 (int8 行 · q) * s
+    """
+
+    def __init__(self, data, scales=None):
+        self.data = data
+        self.scales = scales
+
+    @classmethod
+    def quantize(cls, vectors, mode):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if mode == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1
+            data = np.round(vectors / scales[:, None]).astype(np.int8)
+            return cls(data, scales.astype(np.float32))
+        if mode == "float16":
+            return cls(vectors.astype(np.float16))
+        return cls(vectors)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def scores(self, query, block_size=4096):
+        """与 query 的点积；分块转换为 float32，临时内存不超过 block_size 行"""
+        query = np.asarray(query, dtype=np.float32)
+        result = np.empty(len(self.data), dtype=np.float32)
+        for start in range(0, len(self.data), block_size):
+            block = self.data[start:start + block_size].astype(np.float32)
+            result[start:start + block_size] = block @ query
+        if self.scales is not None:
+            result *= self.scales
+        return result
+
+    def save(self, path):
+        if self.scales is None:
+            np.savez(path, data=self.data)
+        else:
+            np.savez(path, data=self.data, scales=self.scales)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(f["data"], f["scales"] if "scales" in f else None)
+
+
+def top_k(scores, k):
+    """分数最高的 k 个下标，按分数从高到低"""
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+class CompactIndex:
+    """
+    保存在 directory 下的压缩索引：meta.json、docs.json、recall.npz（召回向量）、full.npy（全精度向量）
+
+    - candidates: 第一阶段召回的候选数
+    - rerank: 为 False 时不做全精度重排，直接返回召回的结果
+    """
+
+    def __init__(self, directory, candidates=50, rerank=True):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(os.path.join(directory, "docs.json"), "r", encoding="utf-8") as f:
+            docs = json.load(f)
+        self.documents = [Document(page_content=text, metadata=metadata)
+                          for text, metadata in zip(docs["texts"], docs["metadatas"])]
+        self.recall = QuantizedVectors.load(os.path.join(directory, "recall.npz"))
+        self.full = np.load(os.path.join(directory, "full.npy"), mmap_mode="r")
+        self.recall_service = get_embedding_service(self.meta["recall_model"])
+        self.full_service = get_embedding_service(self.meta["model"])
+        self.candidates = candidates
+        self.rerank = rerank
+
+    @classmethod
+    def build(cls, index: RagIndex, directory, mode="int8", recall_model=None, synced_version=None):
+        """
+        从 RagIndex 的 Chroma 索引构建
+        :param recall_model: 召回向量使用的模型，为 None 时使用主模型的向量
+        """
+        if mode not in MODES:
+            raise ValueError(f"不支持的压缩模式: {mode}")
+        data = index.open().get(include=["documents", "metadatas", "embeddings"])
+        full_service = get_embedding_service()
+        full = np.asarray(data["embeddings"], dtype=np.float32).reshape(len(data["documents"]), -1)
+        recall_vectors = full
+        if recall_model is not None and recall_model != full_service.model_name:
+            recall_vectors = get_embedding_service(recall_model).embed_documents(data["documents"])
+            if recall_vectors is None:
+                raise RuntimeError("召回模型不可用")
+
+        cls.write(directory, full, recall_vectors, mode, data["ids"], data["documents"], data["metadatas"], {
+            "model": full_service.model_name,
+            "recall_model": recall_model or full_service.model_name,
+            "synced_version": synced_version
+        })
+
+    @staticmethod
+    def write(directory, full, recall_vectors, mode, ids, texts, metadatas, meta):
+        """保存索引文件；先写到临时目录再替换，中途失败时不影响正在使用的索引"""
+        tmp_dir = directory + ".tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        np.save(os.path.join(tmp_dir, "full.npy"), np.asarray(full, dtype=np.float32))
+        QuantizedVectors.quantize(recall_vectors, mode).save(os.path.join(tmp_dir, "recall.npz"))
+        with open(os.path.join(tmp_dir, "docs.json"), "w", encoding="utf-8") as f:
+            json.dump({"ids": ids, "texts": texts, "metadatas": metadatas}, f, ensure_ascii=False)
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({**meta, "mode": mode, "count": len(texts), "built_at": time.time()}, f, ensure_ascii=False, indent=2)
+        if os.path.exists(directory):
+            old_dir = directory + ".old"
+            os.replace(directory, old_dir)
+            os.replace(tmp_dir, directory)
+            for name in os.listdir(old_dir):
+                os.remove(os.path.join(old_dir, name))
+            os.rmdir(old_dir)
+        else:
+            os.replace(tmp_dir, directory)
+
+    def search(self, query, k=3):
+        """返回 [(片段, 分数)]，分数为余弦相似度"""
+        if not self.documents:
+            return []
+        recall_query = self.recall_service.embed_query(query)
+        full_query = recall_query
+        if self.rerank and self.full_service is not self.recall_service:
+            full_query = self.full_service.embed_query(query)
+        if recall_query is None or full_query is None:
+            return []
+        return [(self.documents[i], score) for i, score in self.search_by_vector(recall_query, full_query, k)]
+
+    def search_by_vector(self, recall_query, full_query, k=3):
+        """用已编码的问题检索，返回 [(片段序号, 分数)]"""
+        scores = self.recall.scores(recall_query)
+        candidates = top_k(scores, self.candidates if self.rerank else k)
+        if not self.rerank:
+            return [(int(i), float(scores[i])) for i in candidates]
+        # 内存映射按行读取，下标排序后读取更连续
+        candidates = np.sort(candidates)
+        exact = np.asarray(self.full[candidates], dtype=np.float32) @ np.asarray(full_query, dtype=np.float32)
+        return [(int(candidates[i]), float(exact[i])) for i in np.argsort(-exact)[:k]]
+
+    def similarity_search(self, query, k=4):
+        return [doc for doc, _ in self.search(query, k)]
+
+    def size(self):
+        """索引文件大小和召回向量占用的内存（字节）"""
+        files = {name: os.path.getsize(os.path.join(self.directory, name)) for name in os.listdir(self.directory)}
+        return {"files": files, "recall_bytes": self.recall.nbytes}
+
+
+@contextmanager
+def _file_lock(path):
+    """进程间互斥的文件锁，进程退出时由系统释放（Windows 使用 msvcrt，其他平台使用 fcntl）"""
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            while True:
+                f.seek(0)
+                try:
+                    # LK_LOCK 最多等待约 10 秒，超时后继续等待
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class CompactStore:
+    """
+    RagIndex 对应的压缩索引
+
+    每次构建写到 directory 下新的版本目录，current.json 指向正在使用的版本：替换时不需要移动
+    其他线程正在内存映射的文件（Windows 上无法替换），旧版本在切换后删除，删除失败时下次构建后再删。
+    多个进程（uvicorn worker）共用一个目录：构建、切换和删除旧版本都在文件锁（build.lock）内进行，
+    只删除比 current.json 指向的版本更旧的目录；其他进程读取时版本目录已被删除，则重新加载或构建。
+    还没有构建过时第一次检索同步构建；之后导入完成（synced_version 变化）时在后台线程中重建，
+    重建完成前继续使用旧的索引。也可以用命令行构建（见模块说明）
+    """
+
+    def __init__(self, index: RagIndex = rag_index, mode="int8", small_model=False, **kwargs):
+        self.index = index
+        self.mode = mode
+        self.recall_model = SMALL_EMBEDDING_MODEL if small_model else None
+        self.directory = os.path.join(index.persist_dir, f"compact_{mode}{'_small' if small_model else ''}")
+        self.pointer_path = os.path.join(self.directory, "current.json")
+        self.lock_path = os.path.join(self.directory, "build.lock")
+        self.kwargs = kwargs
+        self._compact = None
+        self._rebuilding = False
+        self._lock = threading.Lock()
+
+    def get(self) -> CompactIndex:
+        compact = self._compact
+        if compact is None:
+            with self._lock:
+                if self._compact is None:
+                    self._compact = self._load() or self.rebuild()
+            return self._compact
+
+        latest = self.index.synced_version()
+        if compact.meta["synced_version"] != (list(latest) if latest else None):
+            self._rebuild_in_background()
+        return compact
+
+    def rebuild(self, force=False) -> CompactIndex:
+        """
+        构建新的版本并切换过去，返回新的索引
+        :param force: 为 False 时，如果等锁期间其他进程已经构建了当前导入版本的索引，直接使用它
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with _file_lock(self.lock_path):
+            version = self.index.synced_version()
+            version = list(version) if version else None
+            if not force:
+                compact = self._load()
+                if compact is not None and compact.meta["synced_version"] == version:
+                    self._compact = compact
+                    return compact
+
+            name = f"v{time.time_ns()}"
+            CompactIndex.build(self.index, os.path.join(self.directory, name), self.mode, self.recall_model, version)
+            tmp_path = self.pointer_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": name}, f)
+            os.replace(tmp_path, self.pointer_path)
+            self._compact = compact = self._load()
+            self._remove_old_versions(name)
+        return compact
+
+    def _rebuild_in_background(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild, name="compact-index-rebuild", daemon=True).start()
+
+    def _rebuild(self):
+        try:
+            self.rebuild()
+        except Exception as e:
+            print("重建压缩索引失败:", e)
+        finally:
+            self._rebuilding = False
+
+    def _load(self):
+        """加载 current.json 指向的版本；还没有构建过，或者版本目录已经不存在时返回 None"""
+        try:
+            with open(self.pointer_path, "r", encoding="utf-8") as f:
+                name = json.load(f)["version"]
+        except FileNotFoundError:
+            return None
+        try:
+            return CompactIndex(os.path.join(self.directory, name), **self.kwargs)
+        except FileNotFoundError as e:
+            print("压缩索引的版本目录不存在，重新构建:", e)
+            return None
+
+    def _remove_old_versions(self, current):
+        """删除比 current 更旧的版本目录（包括中断的构建留下的 .tmp 目录），需要在文件锁内调用"""
+        current_ns = int(_VERSION_DIR.match(current).group(1))
+        for name in os.listdir(self.directory):
+            match = _VERSION_DIR.match(name)
+            if match is None or int(match.group(1)) >= current_ns:
+                continue
+            try:
+                shutil.rmtree(os.path.join(self.directory, name))
+            except OSError:
+                # 旧版本的文件还被内存映射（Windows），下次构建后再删除
+                pass
+
+    def similarity_search(self, query, k=4):
+        return self.get().similarity_search(query, k)
+
+
+def dense_store(index: RagIndex = rag_index):
+    """RAG 的向量检索：COMPACT_MODE 为 None 时使用 Chroma，否则使用压缩索引"""
+    if COMPACT_MODE is None:
+        return index.open()
+    return CompactStore(index, COMPACT_MODE, COMPACT_SMALL_MODEL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="构建 RAG 的压缩向量索引")
+    parser.add_argument("--mode", choices=MODES, default="int8", help="召回向量的存储精度")
+    parser.add_argument("--small-model", action="store_true", help="用小模型编码召回向量")
+    args = parser.parse_args()
+
+    store = CompactStore(rag_index, args.mode, args.small_model)
+    start = time.perf_counter()
+    compact = store.rebuild(force=True)
+    size = compact.size()
+    print(f"{compact.meta['count']} 个片段，召回向量 {size['recall_bytes'] / 2 ** 20:.1f} MB，"
+          f"索引文件 {sum(size['files'].values()) / 2 ** 20:.1f} MB，耗时 {time.perf_counter() - start:.1f} 秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,22 @@
+import time
+
 import mysql.connector
 from mysql.connector import Error
 from langchain_community.agent_toolkits import SQLDatabaseToolkit
+from langchain_community.tools.sql_database.tool import InfoSQLDatabaseTool, ListSQLDatabaseTool, QuerySQLDatabaseTool
 from langchain_community.utilities import SQLDatabase
 from langgraph.prebuilt import chat_agent_executor
-from langchain_deepseek import ChatDeepSeek
 import pymysql
 from dbutils.pooled_db import PooledDB
+from fastapi import HTTPException
+
+from src.agentapi.utils.async_mysql import AsyncMySQLPool, AsyncQuerySQLDatabaseTool
+from src.agentapi.utils.lifecycle import Lazy
+from src.agentapi.utils.llm_gateway import llm_gateway
+from src.agentapi.utils.pool_metrics import AdaptiveSizer, PoolGate, instrument_engine, register_pool
+from src.agentapi.utils.redis_tool import redis_client
+from src.agentapi.utils.schema_catalog import SchemaCatalog, CachedListSQLDatabaseTool, CachedInfoSQLDatabaseTool
+from src.agentapi.utils.table_selector import TableSelector
 
 
 class MysqlTool:
@@ -17,9 +28,7 @@ class MysqlTool:
         self.port = 3306
         self.conn = None
         self.cursor = None
-
-        # 初始化连接
-        self.connect()
+        # 不在创建时连接，第一次查询时才建立连接，导入模块时数据库不可用也不会出错
 
     def connect(self):
         """建立 MySQL 数据库连接"""
@@ -41,7 +50,12 @@ class MysqlTool:
 
     def execute_query(self, query: str):
         """执行 SQL 查询并返回结果"""
+        if self.conn is None or not self.conn.is_connected():
+            self.connect()
+        if self.conn is None:
+            return None
         try:
+            self.cursor = self.conn.cursor(dictionary=True)
             self.cursor.execute(query)
             result = self.cursor.fetchall()
             return result
@@ -79,10 +93,26 @@ mysqltool = MysqlTool()
 # 通用性代码添加到 dbtool.py
 class AgentTools:
     def __init__(self):
-        self.model = ChatDeepSeek(model="deepseek-chat", max_tokens=200)
+        self.model = llm_gateway.chat_model("agent")  # 共用 LLM 网关的连接池、限流和重试
         self.db = SQLDatabase.from_uri(self.get_url())
+        instrument_engine(self.db._engine, "agent_sql")
         self.toolkit = SQLDatabaseToolkit(db=self.db, llm=self.model)
-        self.tools = self.toolkit.get_tools()
+        # 表结构目录：缓存表名、DDL 和示例数据，减少代理查看表和模式时的数据库查询
+        self.catalog = SchemaCatalog(self.db, redis_client)
+        # 代理执行 SQL 使用的异步连接池，ainvoke 调用 sql_db_query 时不占用线程
+        self.query_pool = AsyncMySQLPool(
+            host=mysqltool.host,
+            port=mysqltool.port,
+            user=mysqltool.user,
+            password=mysqltool.password,
+            database=mysqltool.database,
+            charset='utf8mb4',
+            name="agent_async"
+        )
+        self.tools = self.get_tools()
+        # 选表：根据问题挑选最相关的几张表，只把这些表的结构放进提示词
+        self.selector = TableSelector(self.catalog, top_k=4)
+        self.table_selection = True
         self.system_prompt = """
         您是一个被设计用来与SQL数据库交互的代理。
         给定一个输入问题，创建一个语法正确的SQL语句并执行，然后查看查询结果并返回答案。
@@ -95,31 +125,154 @@ class AgentTools:
         不要跳过这一步。
         然后查询最相关的表的模式。
         """
+        # 表结构目录已缓存时使用的提示词，直接给出表结构，跳过查看表和模式的步骤
+        self.warm_system_prompt = """
+        您是一个被设计用来与SQL数据库交互的代理。
+        给定一个输入问题，创建一个语法正确的SQL语句并执行，然后查看查询结果并返回答案。
+        除非用户指定了他们想要获得的示例的具体数量，否则始终将SQL查询限制为最多10个结果。
+        你可以按相关列对结果进行排序，以返回MySQL数据库中最匹配的数据。
+        您可以使用与数据库交互的工具。在执行查询之前，你必须仔细检查。如果在执行查询时出现错误，请重写查询SQL并重试。
+        不要对数据库做任何DML语句(插入，更新，删除，删除等)。
+
+        数据库中的表结构和示例数据如下，不需要再查看数据库中的表和表的模式，直接编写SQL查询：
+        {schema}
+        """
+        # 选表后使用的提示词，只包含与问题相关的表结构
+        self.selected_system_prompt = """
+        您是一个被设计用来与SQL数据库交互的代理。
+        给定一个输入问题，创建一个语法正确的SQL语句并执行，然后查看查询结果并返回答案。
+        除非用户指定了他们想要获得的示例的具体数量，否则始终将SQL查询限制为最多10个结果。
+        你可以按相关列对结果进行排序，以返回MySQL数据库中最匹配的数据。
+        您可以使用与数据库交互的工具。在执行查询之前，你必须仔细检查。如果在执行查询时出现错误，请重写查询SQL并重试。
+        不要对数据库做任何DML语句(插入，更新，删除，删除等)。
+
+        与问题最相关的表结构和示例数据如下，直接根据这些表编写SQL查询：
+        {schema}
+
+        数据库中的全部表名：{tables}
+        只有在上面的表不足以回答问题时，才查询其他表的模式。
+        """
         self.agent_executor = chat_agent_executor.create_tool_calling_executor(
             self.model,
             self.tools,
         )
+        # 选表模式下不需要列出所有表的工具，表名已经在提示词中
+        self.selected_executor = chat_agent_executor.create_tool_calling_executor(
+            self.model,
+            [t for t in self.tools if not isinstance(t, ListSQLDatabaseTool)],
+        )
 
     def get_url(self):
         return mysqltool.get_url()
 
-agent_tools = AgentTools()
+    def get_tools(self):
+        """用表结构目录的缓存版本替换 sql_db_list_tables 和 sql_db_schema，sql_db_query 使用异步连接池"""
+        tools = []
+        for t in self.toolkit.get_tools():
+            if isinstance(t, ListSQLDatabaseTool):
+                t = CachedListSQLDatabaseTool(db=self.db, catalog=self.catalog)
+            elif isinstance(t, InfoSQLDatabaseTool):
+                t = CachedInfoSQLDatabaseTool(db=self.db, catalog=self.catalog)
+            elif isinstance(t, QuerySQLDatabaseTool):
+                t = AsyncQuerySQLDatabaseTool(db=self.db, pool=self.query_pool)
+            tools.append(t)
+        return tools
+
+    def prepare(self, question=None):
+        """
+        返回本次问题使用的代理执行器和提示词
+        - 开启选表时，只把相关表的结构放进提示词，并去掉列出所有表的工具
+        - 表结构目录已缓存时，提示词中包含全部表结构
+        - 否则使用默认提示词，由代理自己查看表和模式
+        """
+        try:
+            if question and self.table_selection:
+                tables = self.selector.select(question)
+                if tables:
+                    return self.selected_executor, self.selected_system_prompt.format(
+                        schema=self.catalog.get_table_info(tables),
+                        tables=", ".join(self.catalog.list_tables())
+                    )
+            if self.catalog.is_warm():
+                return self.agent_executor, self.warm_system_prompt.format(schema=self.catalog.warm_up())
+        except Exception as e:
+            print("表结构目录不可用:", e)
+        return self.agent_executor, self.system_prompt
+
+# 延迟创建：第一次使用或应用启动预热时才连接数据库、反射表结构
+agent_tools = Lazy("agent_tools", AgentTools)
+
+
+
+class _CountingCreator:
+    """包装 pymysql，统计 PooledDB 新建的连接数（包括连接断开后的自动重连）"""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.dbapi = pymysql
+        self.threadsafety = pymysql.threadsafety
+
+    def connect(self, *args, **kwargs):
+        conn = pymysql.connect(*args, **kwargs)
+        self.metrics.connected()
+        return conn
+
+
+class _GatedConnection:
+    """连接池借出的连接，关闭时同时归还并发名额"""
+
+    def __init__(self, conn, gate):
+        self._conn = conn
+        self._gate = gate
+        self._closed = False
 
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            try:
+                self._conn.close()
+            finally:
+                self._gate.release()
+
+    def __del__(self):
+        if "_closed" in self.__dict__:
+            self.close()
 
 
 class MySQLPool(object):
-    def __init__(self):
+    """
+    - size: 同时借出的连接数上限
+    - acquire_timeout: 获取连接的超时时间（秒），超时返回 503
+    - adaptive: 为 True 时根据获取连接的等待时间在 [min_size, max_size] 之间自动调整 size
+    """
+
+    def __init__(self, size=5, min_size=2, max_size=20, acquire_timeout=10, adaptive=False):
         self.host = '127.0.0.1'
         self.port = 3306
         self.user = 'root'
         self.password = 'root'
         self.database = 'agent'
         self.charset = 'utf8'
+        self.acquire_timeout = acquire_timeout
+
+        # 连接池指标：获取连接的等待时间、超时次数和连接数
+        self.metrics = register_pool("mysql", self.status)
+        self.gate = PoolGate(size)
+        self.sizer = AdaptiveSizer(self.gate, self.metrics, min_size, max_size) if adaptive else None
 
         # 创建连接池
         self.pool = PooledDB(
-            creator=pymysql,  # 使用PyMySQL驱动
-            maxconnections=5,  # 连接池最大连接数
+            creator=_CountingCreator(self.metrics),  # 使用PyMySQL驱动
+            maxconnections=max_size if adaptive else size,  # 连接池最大连接数，实际借出的数量由 gate 限制
             mincached=2,  # 初始化时创建的连接数
             blocking=True,  # 连接数不足时阻塞等待
             host=self.host,
@@ -133,7 +286,33 @@ class MySQLPool(object):
 
     def get_conn(self):
         """获取数据库连接"""
-        return self.pool.connection()
+        start = time.perf_counter()
+        if not self.gate.acquire(self.acquire_timeout):
+            self.metrics.timeout()
+            self.metrics.observe_wait(time.perf_counter() - start)
+            raise HTTPException(status_code=503, detail="数据库连接繁忙，请稍后重试")
+        try:
+            conn = self.pool.connection()
+        except Exception:
+            self.gate.release()
+            raise
+        self.metrics.observe_wait(time.perf_counter() - start)
+        if self.sizer is not None:
+            self.sizer.maybe_adjust()
+        return _GatedConnection(conn, self.gate)
+
+    def status(self):
+        """当前连接数、使用中和空闲的连接数"""
+        idle = len(self.pool._idle_cache)
+        size = idle + self.gate.in_use
+        return {
+            "size": size,
+            "in_use": self.gate.in_use,
+            "idle": idle,
+            "max_size": self.gate.limit,
+            # 断开重连时旧连接被丢弃，关闭的连接数 = 新建数 - 当前连接数
+            "closes": max(self.metrics.connects - size, 0)
+        }
 
     def close(self):
         """关闭连接池"""
@@ -166,7 +345,7 @@ class MySQLPool(object):
             cursor.close()
             conn.close()
 
-mysql_pool = MySQLPool()
+mysql_pool = Lazy("mysql_pool", MySQLPool)
 
 # 使用示例
 if __name__ == '__main__':
@@ -0,0 +1,404 @@
+import hashlib
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# 本地的 bge-large-zh 模型路径，与 RAG 模板使用同一个模型
+EMBEDDING_MODEL = "D:/D/document/donotdelete/models/bge-large-zh/bge-large-zh-v1.5"
+
+# 小模型（bge-small-zh，512 维），可用于压缩索引的第一阶段召回（见 compact_index.py）
+SMALL_EMBEDDING_MODEL = "D:/D/document/donotdelete/models/bge-small-zh/bge-small-zh-v1.5"
+
+# 推理后端："torch"、"onnx" 或 "openvino"，后两者需要安装 optimum[onnxruntime] / optimum[openvino]，加载失败时退回 torch
+EMBEDDING_BACKEND = "torch"
+
+# onnx / openvino 后端使用的模型文件（相对模型目录），例如 export_quantized_onnx 导出的 "onnx/model_qint8_avx2.onnx"，
+# 为 None 时使用默认的文件（没有时由 sentence-transformers 自动导出）
+EMBEDDING_MODEL_FILE = None
+
+# 本地数据目录（向量磁盘缓存等），可用环境变量 AGENTAPI_DATA_DIR 指定，默认为 ~/.cache/agentapi
+DATA_DIR = os.environ.get("AGENTAPI_DATA_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "agentapi")
+
+# 向量的磁盘缓存（SQLite），文本内容不变时不重新编码；为 None 时只使用内存缓存
+EMBEDDING_CACHE_PATH = os.path.join(DATA_DIR, "embedding_cache.sqlite3")
+
+# 模型加载失败后，间隔多少秒再重新尝试加载
+EMBEDDING_RETRY_INTERVAL = 60
+
+_models = {}
+_loaded = {}  # (模型, 请求的后端, 请求的模型文件) -> (实际加载的后端, 实际加载的模型文件)
+_retry_at = {}  # 加载失败的模型 -> 下一次可以重新加载的时间（time.monotonic）
+_model_lock = threading.Lock()
+
+
+def _model_config(model_name=None, backend=None, model_file=None):
+    """补全默认值：模型默认为 EMBEDDING_MODEL，后端默认为 EMBEDDING_BACKEND，主模型默认使用 EMBEDDING_MODEL_FILE"""
+    model_name = model_name or EMBEDDING_MODEL
+    backend = backend or EMBEDDING_BACKEND
+    if model_file is None and model_name == EMBEDDING_MODEL:
+        model_file = EMBEDDING_MODEL_FILE
+    return model_name, backend, model_file
+
+
+def get_embedding_model(model_name=None, backend=None, model_file=None):
+    """
+    返回进程内共享的 SentenceTransformer 模型，每个模型第一次调用时加载，默认为 EMBEDDING_MODEL
+    模型加载失败时返回 None，调用方应退化为不使用向量的逻辑；EMBEDDING_RETRY_INTERVAL 秒后再次调用时重新加载
+    """
+    key = _model_config(model_name, backend, model_file)
+    model = _models.get(key)
+    if model is None:
+        with _model_lock:
+            model = _models.get(key)
+            if model is None and time.monotonic() >= _retry_at.get(key, 0):
+                model, backend, model_file = _load_model(*key)
+                if model:
+                    _loaded[key] = (backend, model_file)
+                    _models[key] = model
+                    _retry_at.pop(key, None)
+                else:
+                    _retry_at[key] = time.monotonic() + EMBEDDING_RETRY_INTERVAL
+    return model or None
+
+
+def _load_model(model_name, backend, model_file):
+    """:return: (模型, 实际使用的后端, 实际使用的模型文件)，加载失败时模型为 False"""
+    try:
+        from sentence_transformers import SentenceTransformer
+        kwargs = {}
+        if backend != "torch":
+            kwargs["backend"] = backend
+            if model_file:
+                kwargs["model_kwargs"] = {"file_name": model_file}
+        return SentenceTransformer(model_name, device="cpu", **kwargs), backend, model_file
+    except Exception as e:
+        print("向量模型加载失败:", e)
+        if backend != "torch":
+            print("退回 torch 后端")
+            return _load_model(model_name, "torch", None)
+        return False, backend, model_file
+
+
+def embedding_model_key(model_name=None, backend=None, model_file=None):
+    """
+    向量缓存键的前缀，由实际加载的模型、后端和模型文件组成：
+    torch 后端只用模型名（与已有的缓存兼容），onnx / openvino 加上后端和模型文件，
+    例如默认的 ONNX 文件和 int8 量化的 ONNX 文件、退回 torch 后的向量都不会共用缓存。
+    模型还没有加载（或加载失败）时按请求的配置生成，不会触发加载，只查缓存的请求不需要模型
+    """
+    key = _model_config(model_name, backend, model_file)
+    model_name = key[0]
+    backend, model_file = _loaded.get(key, key[1:])
+    if backend == "torch":
+        return model_name
+    return f"{model_name}#{backend}" + (f"#{model_file}" if model_file else "")
+
+
+def is_embedding_model_loaded():
+    """默认的向量模型是否已经加载"""
+    return bool(_models.get(_model_config()))
+
+
+def export_quantized_onnx(model_name=EMBEDDING_MODEL, config="avx2"):
+    """
+    把模型导出为动态 int8 量化的 ONNX 文件，保存在模型目录的 onnx/ 下
+    :param config: 量化配置，与 CPU 指令集对应："arm64"、"avx2"、"avx512" 或 "avx512_vnni"
+    :return: EMBEDDING_MODEL_FILE 应该设置的文件名
+    """
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+    model = SentenceTransformer(model_name, device="cpu", backend="onnx")
+    export_dynamic_quantized_onnx_model(model, config, model_name)
+    return f"onnx/model_qint8_{config}.onnx"
+
+
+class _DiskCache:
+    """SQLite 保存的向量缓存，键为文本内容的哈希"""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        result = {}
+        with self._lock:
+            # SQLite 的参数个数有上限，分批查询
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                result.update({key: np.frombuffer(vector, dtype=np.float32) for key, vector in rows})
+        return result
+
+    def set_many(self, items):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, vector.astype(np.float32).tobytes()) for key, vector in items]
+            )
+            self._conn.commit()
+
+
+class EmbeddingService:
+    """
+    进程内共享的向量编码服务（每个模型一个，见 get_embedding_service）：
+
+    - 模型只加载一次（get_embedding_model），model_name / backend / model_file 为 None 时使用默认配置（见 _model_config）
+    - 同时到达的 embed_query 在 batch_window 秒内合并为一次前向计算，最多 max_batch 条
+    - 按文本内容的哈希缓存向量：内存 LRU（cache_size 条）+ 磁盘缓存，相同的文本不会重复编码
+    - 记录编码吞吐量（条/秒）、批大小和缓存命中情况
+    """
+
+    def __init__(self, model_name=None, backend=None, cache_size=10000, cache_path=EMBEDDING_CACHE_PATH,
+                 batch_window=0.005, max_batch=64, encode_batch_size=32, model_file=None):
+        self.model_name, self.backend, self.model_file = _model_config(model_name, backend, model_file)
+        self._model_key = None
+        self.cache_size = cache_size
+        self.cache_path = cache_path
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.encode_batch_size = encode_batch_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._disk = None
+        self._disk_checked = False
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.encoded = 0  # 实际编码的文本数
+        self.encode_seconds = 0.0
+        self.batches = 0
+        self.max_batch_seen = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+
+    @property
+    def model_key(self):
+        """
+        缓存键包含实际加载的模型、后端和模型文件，不同模型的向量可以共用一个磁盘缓存；
+        模型加载之前使用请求的配置，加载之后固定为实际的配置（后端可能已经退回 torch）
+        """
+        if self._model_key is not None:
+            return self._model_key
+        key = embedding_model_key(self.model_name, self.backend, self.model_file)
+        if (self.model_name, self.backend, self.model_file) in _loaded:
+            self._model_key = key
+        return key
+
+    def _key(self, text):
+        return hashlib.sha1(f"{self.model_key}\0{text}".encode("utf-8")).hexdigest()
+
+    def _disk_cache(self):
+        if not self._disk_checked:
+            self._disk_checked = True
+            if self.cache_path:
+                try:
+                    self._disk = _DiskCache(self.cache_path)
+                except Exception as e:
+                    print("向量磁盘缓存不可用:", e)
+        return self._disk
+
+    def _lookup(self, keys):
+        """从内存和磁盘缓存中查找，返回 {键: 向量}"""
+        found = {}
+        with self._cache_lock:
+            for key in keys:
+                vector = self._cache.get(key)
+                if vector is not None:
+                    self._cache.move_to_end(key)
+                    found[key] = vector
+        missing = [key for key in keys if key not in found]
+        disk = self._disk_cache()
+        disk_found = disk.get_many(missing) if disk is not None and missing else {}
+        if disk_found:
+            self._remember(disk_found.items())
+        found.update(disk_found)
+        with self._stats_lock:
+            self.memory_hits += len(found) - len(disk_found)
+            self.disk_hits += len(disk_found)
+        return found
+
+    def _remember(self, items):
+        with self._cache_lock:
+            for key, vector in items:
+                self._cache[key] = vector
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _encode(self, texts):
+        """编码并写入缓存，模型不可用时返回 None"""
+        model = get_embedding_model(self.model_name, self.backend, self.model_file)
+        if model is None:
+            return None
+        start = time.perf_counter()
+        vectors = np.asarray(
+            model.encode(texts, batch_size=self.encode_batch_size, normalize_embeddings=True),
+            dtype=np.float32
+        )
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            self.encoded += len(texts)
+            self.encode_seconds += elapsed
+            self.batches += 1
+            self.max_batch_seen = max(self.max_batch_seen, len(texts))
+
+        items = [(self._key(text), vector) for text, vector in zip(texts, vectors)]
+        self._remember(items)
+        disk = self._disk_cache()
+        if disk is not None:
+            try:
+                disk.set_many(items)
+            except Exception as e:
+                print("写入向量磁盘缓存失败:", e)
+        return vectors
+
+    def embed_documents(self, texts):
+        """
+        批量编码，已缓存的文本不重新编码
+        :return: 形状为 (len(texts), dim) 的 numpy 数组，模型不可用时返回 None
+        """
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        keys = [self._key(text) for text in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+        missing = list(dict.fromkeys(text for text, key in zip(texts, keys) if key not in found))
+        if missing:
+            vectors = self._encode(missing)
+            if vectors is None:
+                return None
+            # 编码时才加载模型，加载后缓存键可能变化（后端退回 torch），按编码前的键取回
+            key_of = dict(zip(texts, keys))
+            found.update({key_of[text]: vector for text, vector in zip(missing, vectors)})
+        return np.stack([found[key] for key in keys])
+
+    def embed_query(self, text):
+        """
+        编码一条查询，与同时到达的其他查询合并为一次前向计算
+        :return: 一维 numpy 数组，模型不可用时返回 None
+        """
+        return self.submit(text).result()
+
+    def submit(self, text) -> Future:
+        """提交一条查询，返回 concurrent.futures.Future，异步代码可以用 asyncio.wrap_future 等待"""
+        future = Future()
+        key = self._key(text)
+        found = self._lookup([key])
+        if key in found:
+            future.set_result(found[key])
+            return future
+        self._ensure_worker()
+        self._queue.put((text, future))
+        return future
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._worker_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                vectors = self._encode(texts)
+                by_text = {} if vectors is None else dict(zip(texts, vectors))
+                for text, future in batch:
+                    future.set_result(by_text.get(text))
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def clear(self):
+        """清空内存中的向量缓存（磁盘缓存不变）"""
+        with self._cache_lock:
+            self._cache.clear()
+
+    def stats(self):
+        """编码吞吐量、批大小和缓存命中统计"""
+        with self._stats_lock:
+            return {
+                "encoded": self.encoded,
+                "texts_per_sec": round(self.encoded / self.encode_seconds, 1) if self.encode_seconds else 0.0,
+                "batches": self.batches,
+                "avg_batch_size": round(self.encoded / self.batches, 2) if self.batches else 0.0,
+                "max_batch_size": self.max_batch_seen,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "memory_cache_size": len(self._cache)
+            }
+
+
+class ServiceEmbeddings(Embeddings):
+    """LangChain 的 Embeddings 接口，使用共享的向量编码服务（例如给 Chroma 使用）"""
+
+    def __init__(self, service=None):
+        self.service = service or embedding_service
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.service.embed_documents(texts)
+        if vectors is None:
+            raise RuntimeError("向量模型不可用")
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self.service.embed_query(text)
+        if vector is None:
+            raise RuntimeError("向量模型不可用")
+        return vector.tolist()
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_embedding_service(model_name=None):
+    """返回模型对应的共享编码服务，默认为 EMBEDDING_MODEL"""
+    model_name = model_name or EMBEDDING_MODEL
+    if model_name not in _services:
+        with _services_lock:
+            if model_name not in _services:
+                _services[model_name] = EmbeddingService(model_name)
+    return _services[model_name]
+
+
+embedding_service = get_embedding_service()
+
+
+def embed_texts(texts):
+    """
+    将文本编码为归一化后的向量，可直接用点积计算余弦相似度
+    :param texts: 文本列表
+    :return: 形状为 (len(texts), dim) 的 numpy 数组，模型不可用时返回 None
+    """
+    return embedding_service.embed_documents(texts)
+
+
+def embed_query(text):
+    """编码一条查询（与并发的其他查询合并编码），模型不可用时返回 None"""
+    return embedding_service.embed_query(text)
@@ -0,0 +1,203 @@
+"""
+RAG 的混合检索：BM25 倒排索引 + 向量检索，用倒数排名融合（RRF）合并结果
+
+- 中文按单字和相邻两字（bigram）切分，英文和数字按整词切分，不依赖分词库
+- 问菜名、套餐名这类短关键词问题时，BM25 的第一条结果覆盖了问题中几乎所有的词、并且明显领先第二条，
+  直接返回 BM25 的结果，不做向量检索（精确匹配快速路径）
+- 倒排索引从 Chroma 中的片段构建，导入完成后（RagIndex.mark_synced）在后台线程中重建，重建完成前继续使用旧的索引
+"""
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Callable, List
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import Field
+
+from src.agentapi.utils.compact_index import dense_store
+from src.agentapi.utils.rag_index import RagIndex, rag_index
+
+_TOKEN_RE = re.compile(r"[\u4e00-\u9fff]+|[a-z0-9]+(?:\.[0-9]+)?")
+
+# 问题中常见的疑问词和虚词，不参与检索
+QUERY_STOP_WORDS = ["多少钱", "多少", "什么", "哪些", "哪个", "怎么", "如何", "有没有", "是不是", "是否", "请问", "一下",
+                    "的", "了", "吗", "呢", "吧", "啊"]
+
+
+def tokenize(text):
+    """切分为检索词：中文的单字和两字组合，英文和数字的整词"""
+    tokens = []
+    for run in _TOKEN_RE.findall(text.lower()):
+        if run[0].isascii():
+            tokens.append(run)
+        else:
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def tokenize_query(query):
+    for word in QUERY_STOP_WORDS:
+        query = query.replace(word, " ")
+    return tokenize(query)
+
+
+def doc_key(doc: Document):
+    """片段的唯一标识，用于合并两路检索的结果"""
+    return doc.metadata.get("source"), doc.page_content
+
+
+class BM25Index:
+    """
+    内存中的 BM25 倒排索引
+
+    search 返回 [(片段, 分数, 覆盖率)]，覆盖率为片段中出现的检索词的 idf 之和占问题全部检索词 idf 之和的比例
+    """
+
+    def __init__(self, documents: List[Document], k1=1.5, b=0.75):
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)  # 检索词 -> [(片段序号, 词频)]
+        self.lengths = []
+        for i, doc in enumerate(documents):
+            counts = Counter(tokenize(doc.page_content))
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings[term].append((i, tf))
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+
+    @classmethod
+    def from_store(cls, store, **kwargs):
+        """从 Chroma 中的全部片段构建"""
+        data = store.get(include=["documents", "metadatas"])
+        documents = [Document(page_content=text, metadata=metadata or {})
+                     for text, metadata in zip(data["documents"], data["metadatas"])]
+        return cls(documents, **kwargs)
+
+    def idf(self, term):
+        n = len(self.documents)
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query, k=10):
+        terms = set(tokenize_query(query))
+        if not terms or not self.documents:
+            return []
+        scores = defaultdict(float)
+        matched = defaultdict(float)
+        total_idf = 0.0
+        avg_length = self.avg_length or 1.0  # 所有片段都为空时平均长度为 0
+        for term in terms:
+            idf = self.idf(term)
+            total_idf += idf
+            for i, tf in self.postings.get(term, ()):
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[i] / avg_length)
+                scores[i] += idf * tf * (self.k1 + 1) / (tf + norm)
+                matched[i] += idf
+        top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.documents[i], score, matched[i] / total_idf) for i, score in top]
+
+
+class ManifestLexicalIndex:
+    """
+    RagIndex 对应的 BM25 索引
+
+    第一次检索时构建；之后导入完成（synced_version 变化）时在后台线程中重建，
+    重建完成前继续使用旧的索引，检索不等待重建，导入过程中也不会反复重建
+    """
+
+    def __init__(self, index: RagIndex):
+        self.index = index
+        self._current = (None, None)  # (BM25 索引, 构建时的导入版本)，整体替换
+        self._rebuilding = False
+        self._lock = threading.Lock()
+
+    def get(self) -> BM25Index:
+        bm25, version = self._current
+        if bm25 is None:
+            with self._lock:
+                bm25, version = self._current
+                if bm25 is None:
+                    version = self.index.synced_version()
+                    bm25 = BM25Index.from_store(self.index.open())
+                    self._current = (bm25, version)
+            return bm25
+
+        latest = self.index.synced_version()
+        if latest != version:
+            self._rebuild_in_background(latest)
+        return bm25
+
+    def _rebuild_in_background(self, version):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild, args=(version,), name="bm25-rebuild", daemon=True).start()
+
+    def _rebuild(self, version):
+        try:
+            self._current = (BM25Index.from_store(self.index.open()), version)
+        except Exception as e:
+            print("重建 BM25 索引失败:", e)
+        finally:
+            self._rebuilding = False
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    BM25 + 向量的混合检索器
+
+    - k: 返回的片段数
+    - fetch_k: 每一路检索取回的候选数
+    - rrf_k: RRF 的平滑常数，融合分数为 Σ 1 / (rrf_k + 排名)
+    - exact_coverage / exact_margin: BM25 第一条结果的覆盖率不低于 exact_coverage、
+      分数不低于第二条的 exact_margin 倍时，直接返回 BM25 的结果
+    """
+
+    vector_store: Any
+    lexical_source: Callable[[], BM25Index]
+    k: int = 3
+    fetch_k: int = 20
+    rrf_k: int = 60
+    exact_coverage: float = 0.8
+    exact_margin: float = 1.2
+    stats: dict = Field(default_factory=lambda: {"fast_path": 0, "hybrid": 0})
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        lexical = self.lexical_source().search(query, self.fetch_k)
+        if self._confident(lexical):
+            self.stats["fast_path"] += 1
+            return [doc for doc, _, _ in lexical[:self.k]]
+
+        self.stats["hybrid"] += 1
+        dense = self.vector_store.similarity_search(query, k=self.fetch_k)
+        return self.fuse([[doc for doc, _, _ in lexical], dense])[:self.k]
+
+    def _confident(self, lexical):
+        if not lexical or lexical[0][2] < self.exact_coverage:
+            return False
+        return len(lexical) == 1 or lexical[0][1] >= self.exact_margin * lexical[1][1]
+
+    def fuse(self, ranked_lists):
+        """倒数排名融合：每个片段的分数为它在各路结果中 1 / (rrf_k + 排名) 之和"""
+        scores = defaultdict(float)
+        docs = {}
+        for ranked in ranked_lists:
+            for rank, doc in enumerate(ranked, start=1):
+                key = doc_key(doc)
+                scores[key] += 1 / (self.rrf_k + rank)
+                docs.setdefault(key, doc)
+        return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+
+def hybrid_retriever(index: RagIndex = rag_index, k=3, **kwargs):
+    """RagIndex 的混合检索器；索引还没有构建过时先导入一次，向量检索按 COMPACT_MODE 使用 Chroma 或压缩索引"""
+    if not os.path.exists(index.manifest_path):
+        index.sync()
+    return HybridRetriever(vector_store=dense_store(index), lexical_source=ManifestLexicalIndex(index).get, k=k, **kwargs)
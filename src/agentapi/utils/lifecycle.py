@@ -0,0 +1,146 @@
+import asyncio
+import threading
+import time
+
+
+class Lazy:
+    """
+    延迟创建的单例：第一次访问属性时才调用 factory 创建对象，之后直接转发到该对象。
+    导入模块时不连接数据库或加载模型，数据库不可用也不影响导入；创建失败时下次访问会重试。
+
+    - name: 就绪检查中显示的子系统名称
+    - factory: 创建对象的函数
+    自身的方法都以下划线开头，避免遮住被代理对象的同名方法（例如 AnswerCache.get）
+    """
+
+    def __init__(self, name, factory):
+        self._name = name
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+        self._state = "pending"  # pending / warming / ready / failed
+        self._error = None
+        self._seconds = None
+        _subsystems[name] = self
+
+    def _resolve(self):
+        """返回创建好的对象，还没有创建时在当前线程中创建"""
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._state = "warming"
+                    start = time.perf_counter()
+                    try:
+                        instance = self._factory()
+                    except Exception as e:
+                        self._state = "failed"
+                        self._error = str(e)
+                        raise
+                    finally:
+                        self._seconds = round(time.perf_counter() - start, 3)
+                    self._instance = instance
+                    self._state = "ready"
+                    self._error = None
+        return self._instance
+
+    def _status(self):
+        return {"state": self._state, "seconds": self._seconds, "error": self._error}
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+
+def is_created(lazy):
+    """延迟创建的对象是否已经创建，用于关闭时跳过没有创建过的资源"""
+    return lazy._instance is not None
+
+
+# 所有延迟创建的子系统，按名称索引
+_subsystems = {}
+
+# 其他需要在启动时预热的子系统：名称 -> (预热函数, 是否就绪的检查函数, 是否可选)
+_warmers = {}
+_warm_status = {}
+
+
+def register_warmer(name, warm, is_ready, optional=False):
+    """
+    注册一个需要在启动时预热、但不是 Lazy 对象的子系统（例如向量模型、验证码池）
+    warm 可以是普通函数（在线程中执行）或异步函数（在事件循环中执行，例如创建异步连接池）。
+    是否就绪以 is_ready 为准：warm 没有抛出异常不代表已经就绪（例如模型加载失败时返回 None）
+    :param optional: 为 True 时只显示状态，不影响整体是否就绪；用于不可用时调用方会降级的子系统（例如向量模型）
+    """
+    _warmers[name] = (warm, is_ready, optional)
+    _warm_status[name] = {"state": "pending", "seconds": None, "error": None, "optional": optional}
+
+
+def _check(is_ready):
+    try:
+        return bool(is_ready())
+    except Exception:
+        return False
+
+
+async def _run_warmer(name):
+    warm, is_ready, _ = _warmers[name]
+    status = _warm_status[name]
+    status["state"] = "warming"
+    start = time.perf_counter()
+    try:
+        if asyncio.iscoroutinefunction(warm):
+            await warm()
+        else:
+            await asyncio.to_thread(warm)
+        if not _check(is_ready):
+            status["state"] = "failed"
+            status["error"] = "预热已完成，但就绪检查没有通过"
+            return
+        status["state"] = "ready"
+        status["error"] = None
+    except Exception as e:
+        status["state"] = "failed"
+        status["error"] = str(e)
+    finally:
+        status["seconds"] = round(time.perf_counter() - start, 3)
+
+
+def _warm_lazy(lazy):
+    try:
+        lazy._resolve()
+    except Exception as e:
+        print(f"{lazy._name} 初始化失败:", e)
+
+
+async def warm_up(names=None):
+    """
+    并发预热所有子系统（每个子系统在单独的线程中创建），返回总耗时（秒）
+    :param names: 只预热这些子系统，不传时预热全部
+    """
+    start = time.perf_counter()
+    jobs = [
+        asyncio.to_thread(_warm_lazy, lazy) for name, lazy in _subsystems.items()
+        if names is None or name in names
+    ] + [
+        _run_warmer(name) for name in _warmers
+        if names is None or name in names
+    ]
+    await asyncio.gather(*jobs)
+    return time.perf_counter() - start
+
+
+def readiness():
+    """
+    各子系统的就绪状态
+    :return: (必需的子系统是否全部就绪, {子系统: {"state": ..., "seconds": 初始化耗时, "error": ...}})
+    """
+    subsystems = {name: lazy._status() for name, lazy in _subsystems.items()}
+    for name, (_, is_ready, _) in _warmers.items():
+        status = dict(_warm_status[name])
+        # 以实际状态为准：预热失败后也可能在请求中被加载；预热过、但现在不可用时显示为 warming
+        if _check(is_ready):
+            status["state"] = "ready"
+            status["error"] = None
+        elif status["state"] == "ready":
+            status["state"] = "warming"
+        subsystems[name] = status
+    return all(s["state"] == "ready" for s in subsystems.values() if not s.get("optional")), subsystems
@@ -0,0 +1,512 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+
+import httpx
+from langchain_deepseek import ChatDeepSeek
+
+# 各调用方的限流配置，未列出的调用方使用 default
+# - rate / burst: 令牌桶，每秒发起的请求数和允许的突发请求数
+# - max_in_flight: 同时进行的上游请求数（流式响应读完之前一直占用）
+# - queue_timeout: 排队等待的最长时间（秒），超时按请求超时处理
+# - max_retries: 429 / 503 / 连接失败时的最大重试次数
+# - timeout: 单次上游请求的超时时间（秒）
+LLM_PROFILES = {
+    "default": {"rate": 5, "burst": 10, "max_in_flight": 8, "queue_timeout": 30, "max_retries": 3, "timeout": 60},
+    # SQL 代理：一次问答包含多轮调用，限制并发，避免挤占其他调用方
+    "agent": {"rate": 5, "burst": 10, "max_in_flight": 6, "queue_timeout": 60, "max_retries": 3, "timeout": 60},
+    # 多轮对话和对话摘要
+    "chat": {"rate": 5, "burst": 10, "max_in_flight": 8, "queue_timeout": 30, "max_retries": 3, "timeout": 60},
+    # SQL 计划缓存重放后的答案总结，只调用一次，超时时间较短
+    "summary": {"rate": 5, "burst": 10, "max_in_flight": 4, "queue_timeout": 15, "max_retries": 2, "timeout": 30},
+}
+
+# 需要重试的上游状态码：限流（429）和过载（503）时上游拒绝处理请求，不会计费；
+# 500 / 502 / 504 时请求可能已经被处理，重试会重复计费，直接返回给调用方
+RETRY_STATUS = {429, 503}
+
+
+class TokenBucket:
+    """线程安全的令牌桶，同步和异步调用共用"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """预订一个令牌，返回需要等待的秒数（令牌不足时余额为负，后来的请求依次排后）"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class _Timings:
+    """耗时统计：次数、平均值、最大值和最近若干次的 95 分位"""
+
+    def __init__(self, recent=512):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._recent = deque(maxlen=recent)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+            self._recent.append(seconds)
+
+    def stats(self):
+        with self._lock:
+            recent = sorted(self._recent)
+        p95 = recent[min(int(len(recent) * 0.95), len(recent) - 1)] if recent else 0.0
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            "p95_ms": round(p95 * 1000, 2),
+            "max_ms": round(self.max * 1000, 2)
+        }
+
+
+class _FairSlots:
+    """同步线程和异步协程共用的并发名额，按到达顺序分配
+
+    归还名额时直接交给队首的等待者，后到的调用方（无论同步还是异步）不能插队
+    """
+
+    def __init__(self, limit):
+        self._limit = limit
+        self._free = limit
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, waiter):
+        """有空闲名额且没有人排队时直接拿到名额，否则加入队尾"""
+        with self._lock:
+            if self._free and not self._waiters:
+                self._free -= 1
+                return True
+            self._waiters.append(waiter)
+            return False
+
+    def _withdraw(self, waiter):
+        """放弃排队，返回名额是否已经交给了这个等待者"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def acquire(self, timeout):
+        event = threading.Event()
+        waiter = _Waiter(event.set)
+        if self._try_acquire(waiter):
+            return True
+        if event.wait(timeout):
+            return True
+        return self._withdraw(waiter)
+
+    async def acquire_async(self, timeout):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            if not future.done():
+                future.set_result(None)
+
+        waiter = _Waiter(lambda: loop.call_soon_threadsafe(wake))
+        if self._try_acquire(waiter):
+            return True
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return self._withdraw(waiter)
+        except BaseException:
+            # 被取消时名额可能刚好交过来，要还回去
+            if self._withdraw(waiter):
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                try:
+                    waiter.notify()
+                except RuntimeError:
+                    # 等待者所在的事件循环已经关闭，交给下一个
+                    continue
+                waiter.granted = True
+                return
+            if self._free >= self._limit:
+                raise ValueError("并发名额归还次数超过获取次数")
+            self._free += 1
+
+
+class _Waiter:
+    __slots__ = ("notify", "granted")
+
+    def __init__(self, notify):
+        self.notify = notify
+        self.granted = False
+
+
+class _Profile:
+    """一个调用方的限流器和指标"""
+
+    def __init__(self, name, rate, burst, max_in_flight, queue_timeout, max_retries, timeout,
+                 backoff_base=0.5, backoff_max=20):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.bucket = TokenBucket(rate, burst)
+        # 异步和同步调用共用一个并发名额，两者加起来不超过 max_in_flight，按排队顺序分配
+        self.slots = _FairSlots(max_in_flight)
+        self.in_flight = 0
+        self.waiting = 0
+        self.requests = 0
+        self.retries = 0
+        self.rate_limited = 0  # 上游返回 429 的次数
+        self.server_errors = 0  # 上游返回 5xx 的次数
+        self.failures = 0  # 重试后仍失败的次数
+        self.queue_time = _Timings()  # 排队（令牌桶 + 并发限制）的时间
+        self.latency = _Timings()  # 上游返回响应头的时间
+        self.duration = _Timings()  # 上游请求的总时间（流式响应读完为止）
+        self.lock = threading.Lock()
+
+    def backoff(self, attempt, response=None):
+        """重试前的等待时间：优先使用 Retry-After，否则使用带随机抖动的指数退避"""
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            if retry_after:
+                try:
+                    return min(float(retry_after), self.backoff_max)
+                except ValueError:
+                    pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def add_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def add_failure(self):
+        with self.lock:
+            self.failures += 1
+
+    def record_status(self, status_code):
+        with self.lock:
+            if status_code == 429:
+                self.rate_limited += 1
+            elif status_code >= 500:
+                self.server_errors += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "max_in_flight": self.max_in_flight,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "requests": self.requests,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "server_errors": self.server_errors,
+                "failures": self.failures,
+                "queue_time": self.queue_time.stats(),
+                "latency": self.latency.stats(),
+                "duration": self.duration.stats()
+            }
+
+
+def _should_retry(response=None, error=None):
+    if error is not None:
+        # 只重试还没有把请求发给上游的错误（建立连接失败、等待连接池超时），避免重复计费；
+        # RemoteProtocolError、读超时等可能发生在请求已经发出之后，不重试
+        return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+    return response.status_code in RETRY_STATUS
+
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    """响应体读完或关闭时归还并发名额"""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+class _SyncReleasingStream(httpx.SyncByteStream):
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+
+class _AsyncGatewayTransport(httpx.AsyncBaseTransport):
+    """异步请求：令牌桶限速 + 并发限制 + 429/503 重试，底层共用网关的连接池"""
+
+    def __init__(self, transport, profile):
+        self._transport = transport
+        self._profile = profile
+
+    async def handle_async_request(self, request):
+        profile = self._profile
+        attempt = 0
+        while True:
+            release = await self._acquire()
+            start = time.perf_counter()
+            try:
+                response = await self._transport.handle_async_request(request)
+            except BaseException as e:
+                # 包括请求被取消（客户端断开）的情况，都要归还名额
+                release()
+                if isinstance(e, Exception) and attempt < profile.max_retries and _should_retry(error=e):
+                    attempt += 1
+                    profile.add_retry()
+                    await asyncio.sleep(profile.backoff(attempt))
+                    continue
+                profile.add_failure()
+                raise
+            profile.latency.add(time.perf_counter() - start)
+            profile.record_status(response.status_code)
+
+            if attempt < profile.max_retries and _should_retry(response=response):
+                await response.aclose()
+                release()
+                attempt += 1
+                profile.add_retry()
+                await asyncio.sleep(profile.backoff(attempt, response))
+                continue
+            if response.status_code == 429 or response.status_code >= 500:
+                profile.add_failure()
+
+            def release_with_duration():
+                profile.duration.add(time.perf_counter() - start)
+                release()
+
+            return httpx.Response(
+                status_code=response.status_code,
+                headers=response.headers,
+                stream=_AsyncReleasingStream(response.stream, _once(release_with_duration)),
+                extensions=response.extensions
+            )
+
+    async def _acquire(self):
+        """排队获取令牌和并发名额，返回归还名额的函数"""
+        profile = self._profile
+        start = time.perf_counter()
+        with profile.lock:
+            profile.waiting += 1
+        try:
+            wait = profile.bucket.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            remaining = profile.queue_timeout - (time.perf_counter() - start)
+            if not await profile.slots.acquire_async(max(remaining, 0)):
+                profile.add_failure()
+                raise httpx.PoolTimeout(f"LLM 请求排队超时（{profile.name}）")
+        finally:
+            with profile.lock:
+                profile.waiting -= 1
+        with profile.lock:
+            profile.in_flight += 1
+            profile.requests += 1
+        profile.queue_time.add(time.perf_counter() - start)
+
+        def release():
+            with profile.lock:
+                profile.in_flight -= 1
+            profile.slots.release()
+
+        return _once(release)
+
+    async def aclose(self):
+        # 底层连接池由网关统一关闭
+        pass
+
+
+class _SyncGatewayTransport(httpx.BaseTransport):
+    """同步请求（模板脚本、线程池模式的代理）：与异步版本相同的限流和重试"""
+
+    def __init__(self, transport, profile):
+        self._transport = transport
+        self._profile = profile
+
+    def handle_request(self, request):
+        profile = self._profile
+        attempt = 0
+        while True:
+            release = self._acquire()
+            start = time.perf_counter()
+            try:
+                response = self._transport.handle_request(request)
+            except BaseException as e:
+                # 包括请求被取消（客户端断开）的情况，都要归还名额
+                release()
+                if isinstance(e, Exception) and attempt < profile.max_retries and _should_retry(error=e):
+                    attempt += 1
+                    profile.add_retry()
+                    time.sleep(profile.backoff(attempt))
+                    continue
+                profile.add_failure()
+                raise
+            profile.latency.add(time.perf_counter() - start)
+            profile.record_status(response.status_code)
+
+            if attempt < profile.max_retries and _should_retry(response=response):
+                response.close()
+                release()
+                attempt += 1
+                profile.add_retry()
+                time.sleep(profile.backoff(attempt, response))
+                continue
+            if response.status_code == 429 or response.status_code >= 500:
+                profile.add_failure()
+
+            def release_with_duration():
+                profile.duration.add(time.perf_counter() - start)
+                release()
+
+            return httpx.Response(
+                status_code=response.status_code,
+                headers=response.headers,
+                stream=_SyncReleasingStream(response.stream, _once(release_with_duration)),
+                extensions=response.extensions
+            )
+
+    def _acquire(self):
+        profile = self._profile
+        start = time.perf_counter()
+        with profile.lock:
+            profile.waiting += 1
+        try:
+            wait = profile.bucket.reserve()
+            if wait > 0:
+                time.sleep(wait)
+            remaining = profile.queue_timeout - (time.perf_counter() - start)
+            if not profile.slots.acquire(timeout=max(remaining, 0)):
+                profile.add_failure()
+                raise httpx.PoolTimeout(f"LLM 请求排队超时（{profile.name}）")
+        finally:
+            with profile.lock:
+                profile.waiting -= 1
+        with profile.lock:
+            profile.in_flight += 1
+            profile.requests += 1
+        profile.queue_time.add(time.perf_counter() - start)
+
+        def release():
+            with profile.lock:
+                profile.in_flight -= 1
+            profile.slots.release()
+
+        return _once(release)
+
+    def close(self):
+        pass
+
+
+def _once(fn):
+    """只执行一次的包装，避免重复归还名额"""
+    called = False
+
+    def wrapper():
+        nonlocal called
+        if not called:
+            called = True
+            fn()
+
+    return wrapper
+
+
+class LLMGateway:
+    """
+    所有 DeepSeek 调用共用的网关：
+    - 同步和异步请求各自共用一个保持长连接的连接池
+    - 每个调用方（profile）有独立的令牌桶限速、并发上限和重试策略，配置见 LLM_PROFILES
+    - 429 / 503 时按 Retry-After 或带抖动的指数退避重试，SDK 自身的重试关闭
+    - 记录每个调用方的排队时间、上游延迟和重试次数
+    """
+
+    def __init__(self, profiles=None, max_connections=50, max_keepalive_connections=20, keepalive_expiry=60):
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self._async_transport = httpx.AsyncHTTPTransport(limits=limits)
+        self._sync_transport = httpx.HTTPTransport(limits=limits)
+        self._profiles = {
+            name: _Profile(name, **config) for name, config in (profiles or LLM_PROFILES).items()
+        }
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _profile(self, name):
+        return self._profiles.get(name) or self._profiles["default"]
+
+    def chat_model(self, profile="default", model="deepseek-chat", max_tokens=200, **kwargs) -> ChatDeepSeek:
+        """
+        返回使用网关的 ChatDeepSeek，相同参数的调用方共用同一个对象
+        :param profile: 调用方名称，决定限流和重试配置
+        """
+        key = (profile, model, max_tokens, tuple(sorted(kwargs.items())))
+        with self._lock:
+            chat_model = self._models.get(key)
+            if chat_model is None:
+                p = self._profile(profile)
+                timeout = httpx.Timeout(p.timeout, connect=10)
+                chat_model = self._models[key] = ChatDeepSeek(
+                    model=model,
+                    max_tokens=max_tokens,
+                    max_retries=0,  # 由网关负责重试
+                    timeout=p.timeout,
+                    http_client=httpx.Client(transport=_SyncGatewayTransport(self._sync_transport, p), timeout=timeout),
+                    http_async_client=httpx.AsyncClient(
+                        transport=_AsyncGatewayTransport(self._async_transport, p), timeout=timeout
+                    ),
+                    **kwargs
+                )
+            return chat_model
+
+    def stats(self):
+        """每个调用方的排队时间、上游延迟、重试和失败次数"""
+        return {name: p.stats() for name, p in self._profiles.items()}
+
+    async def aclose(self):
+        """关闭连接池"""
+        await self._async_transport.aclose()
+        self._sync_transport.close()
+
+
+llm_gateway = LLMGateway()
@@ -1,28 +1,96 @@
-from passlib.context import CryptContext
 import random
+import threading
+from collections import deque
 from PIL import Image, ImageDraw, ImageFont
 from io import BytesIO
 
-# 密码哈希配置
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from src.agentapi.utils.password_hasher import pwd_context
 
+# 同步的密码哈希函数，会阻塞当前线程；请求处理中请使用 password_hasher，在进程池中计算
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
     return pwd_context.hash(password)
 
-# 验证码生成
-def generate_captcha():
+
+def _load_font():
+    """字体只在启动时加载一次"""
+    try:
+        return ImageFont.truetype("arial.ttf", 24)
+    except IOError:
+        return ImageFont.load_default()
+
+_font = _load_font()
+
+
+def render_captcha():
+    """生成验证码，返回 (验证码文本, PNG 图片字节)"""
     code = ''.join(random.choices('ABCDEFGHJKLMNPQRSTUVWXYZ23456789', k=4))
     image = Image.new('RGB', (120, 40), color=(255, 255, 255))
     draw = ImageDraw.Draw(image)
-    try:
-        font = ImageFont.truetype("arial.ttf", 24)
-    except IOError:
-        font = ImageFont.load_default()
-    draw.text((10, 10), code, font=font, fill=(0, 0, 0))
+    draw.text((10, 10), code, font=_font, fill=(0, 0, 0))
     buffer = BytesIO()
     image.save(buffer, format="PNG")
-    buffer.seek(0)
-    return code, buffer
\ No newline at end of file
+    return code, buffer.getvalue()
+
+
+# 验证码生成
+def generate_captcha():
+    code, png = render_captcha()
+    buffer = BytesIO(png)
+    return code, buffer
+
+
+class CaptchaPool:
+    """
+    预先生成验证码图片的池子，请求时直接取出，不在请求路径上绘图和编码 PNG
+
+    - 后台线程保持池中有 size 个验证码，数量低于 low_water 时开始补充
+    - 取出是 O(1) 的；池子为空时（例如刚启动）退化为现场生成
+    """
+
+    def __init__(self, size=200, low_water=50):
+        self.size = size
+        self.low_water = low_water
+        self._items = deque()
+        self._refill = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """启动后台补充线程"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="captcha-pool", daemon=True)
+                self._thread.start()
+                self._refill.set()
+
+    def get(self):
+        """取出一个验证码，返回 (验证码文本, PNG 图片字节)"""
+        if self._thread is None:
+            self.start()
+        try:
+            item = self._items.popleft()
+        except IndexError:
+            item = render_captcha()
+        if len(self._items) < self.low_water:
+            self._refill.set()
+        return item
+
+    def is_running(self):
+        """后台补充线程是否在运行"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while True:
+            self._refill.wait()
+            self._refill.clear()
+            while len(self._items) < self.size:
+                self._items.append(render_captcha())
+
+    def __len__(self):
+        return len(self._items)
+
+
+captcha_pool = CaptchaPool()
@@ -0,0 +1,62 @@
+import json
+import struct
+import zlib
+
+# 对话消息在 Redis 中的紧凑编码（第 1 版）：
+#   1 字节版本号 + 1 字节标志位 + 8 字节时间戳（double，大端）+ 消息内容（UTF-8，可能经过 zlib 压缩）
+# 标志位：低 2 位为消息类型，第 3 位表示内容经过 zlib 压缩
+# 旧版本的 JSON 字符串以 "{" 开头，与版本号不冲突，读取时自动识别
+VERSION = 1
+_HEADER = struct.Struct(">BBd")
+_TYPES = ["human", "ai", "system"]
+_TYPE_MASK = 0b011
+_ZLIB = 0b100
+
+# 超过该长度（字节）的消息尝试压缩，压缩后更短时才使用压缩结果
+COMPRESS_THRESHOLD = 512
+
+
+def encode_message(message_type: str, content: str, timestamp: float, compress_threshold=COMPRESS_THRESHOLD) -> bytes:
+    """
+    把一条消息编码为紧凑的二进制格式
+    :param message_type: 消息类型，human / ai / system
+    :param content: 消息内容
+    :param timestamp: 时间戳（秒）
+    :param compress_threshold: 超过该长度的内容尝试 zlib 压缩，为 None 时不压缩
+    """
+    flags = _TYPES.index(message_type)
+    body = content.encode("utf-8")
+    if compress_threshold is not None and len(body) > compress_threshold:
+        compressed = zlib.compress(body)
+        if len(compressed) < len(body):
+            body = compressed
+            flags |= _ZLIB
+    return _HEADER.pack(VERSION, flags, timestamp) + body
+
+
+def decode_message(data):
+    """
+    解码一条消息，兼容旧版本的 JSON 格式
+    :return: {"type": 消息类型, "content": 消息内容, "timestamp": 时间戳}
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if data[:1] == b"{":
+        return json.loads(data)
+
+    version, flags, timestamp = _HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f"不支持的消息编码版本: {version}")
+    body = data[_HEADER.size:]
+    if flags & _ZLIB:
+        body = zlib.decompress(body)
+    return {
+        "type": _TYPES[flags & _TYPE_MASK],
+        "content": body.decode("utf-8"),
+        "timestamp": timestamp
+    }
+
+
+def is_legacy(data) -> bool:
+    """是否为旧版本的 JSON 编码"""
+    return data[:1] in (b"{", "{")
@@ -0,0 +1,46 @@
+import time
+
+
+class ResponseHeaderMiddleware:
+    """
+    纯 ASGI 中间件：在 http.response.start 消息中追加固定的响应头和 Server-Timing。
+
+    与 @app.middleware("http")（BaseHTTPMiddleware）不同，不创建额外的任务、不包装响应流，
+    开销只有一次 send 的包装，流式响应（SSE）也能正常逐块发送。
+
+    - headers: 追加到每个响应的响应头，键和值只能是 ASCII（latin-1）
+    - server_timing: 是否添加 Server-Timing 响应头，记录从收到请求到开始发送响应的耗时
+    - timing_name: Server-Timing 中的指标名称
+    - timing_allow_origin: 允许哪些来源的前端通过 Resource Timing API 读取 Server-Timing，为 None 时不添加
+    """
+
+    def __init__(self, app, headers=None, server_timing=True, timing_name="app", timing_allow_origin=None):
+        self.app = app
+        # 响应头只在创建时编码一次
+        self.raw_headers = [
+            (key.lower().encode("latin-1"), value.encode("latin-1"))
+            for key, value in (headers or {}).items()
+        ]
+        if timing_allow_origin:
+            self.raw_headers.append((b"timing-allow-origin", timing_allow_origin.encode("latin-1")))
+        self.server_timing = server_timing
+        self.timing_prefix = f"{timing_name};dur=".encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", ()))
+                headers.extend(self.raw_headers)
+                if self.server_timing:
+                    duration = (time.perf_counter() - start) * 1000
+                    headers.append((b"server-timing", self.timing_prefix + f"{duration:.1f}".encode("latin-1")))
+                message["headers"] = headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
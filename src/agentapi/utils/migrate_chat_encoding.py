@@ -0,0 +1,73 @@
+"""
+把 Redis 中 chat:{session_id} 列表里旧版本的 JSON 消息转换为紧凑的二进制编码
+
+读取时已经兼容两种格式，迁移只是为了节省内存，可以在线执行，也可以分批多次执行：
+python -m src.agentapi.utils.migrate_chat_encoding [--dry-run] [--batch 500]
+"""
+import argparse
+
+import redis
+
+from src.agentapi.utils.message_codec import decode_message, encode_message, is_legacy
+from src.agentapi.utils.redis_tool import redis_client
+
+
+def migrate_session(client, key, dry_run=False, retries=5):
+    """
+    迁移一个会话，使用 WATCH 保证迁移期间有新消息写入时重试，不会丢消息
+    :return: (迁移前字节数, 迁移后字节数)，没有旧格式消息时返回 None
+    """
+    for _ in range(retries):
+        with client.pipeline() as pipeline:
+            try:
+                pipeline.watch(key)
+                messages = pipeline.lrange(key, 0, -1)
+                if not any(is_legacy(m) for m in messages):
+                    return None
+
+                encoded = []
+                for m in messages:
+                    if is_legacy(m):
+                        data = decode_message(m)
+                        m = encode_message(data["type"], data["content"], data.get("timestamp", 0.0))
+                    encoded.append(m)
+                before, after = sum(len(m) for m in messages), sum(len(m) for m in encoded)
+                if dry_run:
+                    return before, after
+
+                ttl = pipeline.ttl(key)
+                pipeline.multi()
+                pipeline.delete(key)
+                pipeline.rpush(key, *encoded)
+                if ttl > 0:
+                    pipeline.expire(key, ttl)
+                pipeline.execute()
+                return before, after
+            except redis.WatchError:
+                continue
+    print(f"{key} 迁移期间持续有写入，已跳过")
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="迁移 Redis 中对话消息的编码格式")
+    parser.add_argument("--dry-run", action="store_true", help="只统计，不写入")
+    parser.add_argument("--batch", type=int, default=500, help="每次 SCAN 的键数量")
+    args = parser.parse_args()
+
+    sessions = 0
+    before_total = after_total = 0
+    for key in redis_client.scan_iter(match="chat:*", count=args.batch, _type="list"):
+        result = migrate_session(redis_client, key, dry_run=args.dry_run)
+        if result is None:
+            continue
+        sessions += 1
+        before_total += result[0]
+        after_total += result[1]
+
+    print(f"{'预计' if args.dry_run else '已'}迁移 {sessions} 个会话，"
+          f"消息大小 {before_total} -> {after_total} 字节")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+# bcrypt 的成本参数：每加 1，哈希耗时翻倍
+# 调整后旧的哈希仍然可以验证，用户下次登录成功时自动按新的成本重新哈希
+BCRYPT_ROUNDS = 12
+
+# 密码哈希配置：成本不等于 BCRYPT_ROUNDS 的哈希（无论更高还是更低）都视为需要更新
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
+
+
+# 以下两个函数在子进程中执行，必须定义在模块顶层才能被 pickle
+def _hash(password):
+    return pwd_context.hash(password), time.time()
+
+
+def _verify_and_update(password, hashed_password):
+    try:
+        return pwd_context.verify_and_update(password, hashed_password), time.time()
+    except ValueError:
+        # 数据库中的哈希格式不正确，按密码错误处理
+        return (False, None), time.time()
+
+
+class _Timer:
+    """累计耗时的简单统计：次数、总耗时、最大耗时"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def stats(self):
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 2)
+        }
+
+
+class PasswordHasher:
+    """
+    在专用进程池中执行 bcrypt 哈希和验证，不占用事件循环和 AnyIO 默认线程池。
+
+    - workers: 进程数，同时最多有 workers 个哈希在计算
+    - max_queue: 排队等待的请求上限，超过后直接返回 503
+    - timeout: 单次哈希的超时时间（秒），包含排队时间，超时返回 504
+    """
+
+    def __init__(self, workers=None, max_queue=64, timeout=10):
+        self.workers = workers or max(1, (os.cpu_count() or 2) // 2)
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(self.workers)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0  # 已接收的请求数（排队 + 执行中）
+        self._running = 0  # 正在计算的请求数
+        self._rejected = 0
+        self._timeouts = 0
+        self._rehashed = 0
+        self._queue_wait = _Timer()  # 从提交到子进程开始计算的时间
+        self._run_time = _Timer()  # 子进程开始计算到拿到结果的时间
+
+    def _get_executor(self):
+        # 进程池在第一次使用时才创建，导入模块时不启动子进程
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def admit(self):
+        """准入控制：排队已满时快速失败（503）"""
+        if self._pending >= self.workers + self.max_queue:
+            self._rejected += 1
+            raise HTTPException(status_code=503, detail="登录人数过多，请稍后重试")
+
+    async def _submit(self, fn, *args):
+        self.admit()
+        loop = asyncio.get_running_loop()
+        submitted = time.time()
+        deadline = loop.time() + self.timeout
+        self._pending += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self._pending -= 1
+            self._timeouts += 1
+            raise HTTPException(status_code=504, detail="密码校验排队超时")
+        except BaseException:
+            self._pending -= 1
+            raise
+
+        self._running += 1
+        try:
+            future = loop.run_in_executor(self._get_executor(), fn, *args)
+            result, started = await asyncio.wait_for(future, max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            # 子进程中的计算无法中断，只能放弃等待结果
+            self._timeouts += 1
+            raise HTTPException(status_code=504, detail="密码校验超时")
+        finally:
+            self._running -= 1
+            self._pending -= 1
+            self._semaphore.release()
+
+        self._queue_wait.add(max(started - submitted, 0.0))
+        self._run_time.add(max(time.time() - started, 0.0))
+        return result
+
+    async def hash(self, password):
+        """计算密码哈希"""
+        return await self._submit(_hash, password)
+
+    async def verify_and_update(self, password, hashed_password):
+        """
+        验证密码，成本参数变化时顺便计算新的哈希
+        :return: (是否正确, 新的哈希)，不需要更新时新的哈希为 None
+        """
+        valid, new_hash = await self._submit(_verify_and_update, password, hashed_password)
+        if new_hash:
+            self._rehashed += 1
+        return valid, new_hash
+
+    def stats(self):
+        """返回进程池的排队和耗时统计"""
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "rounds": BCRYPT_ROUNDS,
+            "running": self._running,
+            "waiting": self._pending - self._running,
+            "rejected": self._rejected,
+            "timeouts": self._timeouts,
+            "rehashed": self._rehashed,
+            "queue_wait": self._queue_wait.stats(),
+            "run_time": self._run_time.stats()
+        }
+
+    def close(self):
+        """关闭进程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher()
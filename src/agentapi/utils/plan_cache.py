@@ -0,0 +1,267 @@
+import hashlib
+import json
+import re
+import string
+import threading
+from collections import Counter
+
+import redis
+from langchain_core.messages import SystemMessage, HumanMessage, ToolMessage
+
+from src.agentapi.utils.answer_cache import normalize_question, extract_tables, parameterize
+from src.agentapi.utils.dbtool import agent_tools
+from src.agentapi.utils.lifecycle import Lazy
+from src.agentapi.utils.llm_gateway import llm_gateway
+from src.agentapi.utils.redis_tool import redis_client
+
+# SQL 中的字面量：单引号字符串、数字（不匹配标识符中的数字，例如 t1）
+_SQL_LITERAL = re.compile(r"'((?:[^'\\]|\\.)*)'|(?<![\w.])(\d+(?:\.\d+)?)(?![\w.])")
+# 参数化后的 SQL 中的绑定参数
+_BOUND_PARAM = re.compile(r"(?<!\\):p(\d+)(?!\d)")
+# 参数化后的 SQL 中仍然写死的日期，例如问题是 "今天"、"2024年3月"，代理直接把日期写进了 SQL
+_SQL_DATE = re.compile(r"'\d{4}-\d{1,2}(?:-\d{1,2})?")
+
+
+def parameterize_sql(sql: str, values):
+    """
+    把 SQL 中与问题字面量相同的值替换为绑定参数 :p0、:p1 ...
+    其他冒号会被转义，避免被 SQLAlchemy 当作绑定参数
+    """
+    def replace(match):
+        literal = match.group(1) if match.group(1) is not None else match.group(2)
+        for i, value in enumerate(values):
+            if literal == str(value):
+                return f":p{i}"
+        return match.group(0).replace(":", "\\:")
+
+    parts = []
+    last = 0
+    for match in _SQL_LITERAL.finditer(sql):
+        parts.append(sql[last:match.start()].replace(":", "\\:"))
+        parts.append(replace(match))
+        last = match.end()
+    parts.append(sql[last:].replace(":", "\\:"))
+    return "".join(parts)
+
+
+def unbound_literals(sql: str, values):
+    """问题中没有绑定为参数的字面量（parameterize_sql 之后的 SQL 中没有对应的 :pN）"""
+    bound = {int(i) for i in _BOUND_PARAM.findall(sql)}
+    return [value for i, value in enumerate(values) if i not in bound]
+
+
+def repeated_params(sql: str):
+    """
+    绑定了不止一次的参数序号：问题中的一个值与 SQL 中的多个字面量相同，无法确定哪一个来自问题。
+    例如 "价格超过10元的菜" 生成 price > 10 LIMIT 10，两个 10 都会变成 :p0
+    """
+    counts = Counter(int(i) for i in _BOUND_PARAM.findall(sql))
+    return sorted(i for i, n in counts.items() if n > 1)
+
+
+def is_replayable(sql: str, values):
+    """
+    参数化后的 SQL 能否用其他参数重放：问题中的字面量都恰好绑定为一个参数，并且 SQL 中没有写死的日期。
+    否则同一个问题模板换一个值（"2023年5月"、明天再问 "今天"）会重放旧的 SQL，
+    或者把碰巧相同的其他字面量（LIMIT 10、status = 1）也换掉，返回错误的数据
+    """
+    return not unbound_literals(sql, values) and not repeated_params(sql) and not _SQL_DATE.search(sql)
+
+
+def validate_answer_template(answer_template: str, literal_count: int):
+    """
+    检查答案模板只使用 {result} 和 {p0} ~ {p(literal_count-1)}，不允许属性和下标访问
+    :raises ValueError: 模板格式错误或使用了其他占位符
+    """
+    allowed = {"result"} | {f"p{i}" for i in range(literal_count)}
+    for _, field, _, _ in string.Formatter().parse(answer_template):
+        if field is not None and field not in allowed:
+            raise ValueError(f"答案模板中的占位符 {{{field}}} 无效，只能使用 {', '.join(sorted(allowed))}")
+
+
+def extract_final_sql(messages):
+    """返回代理最后一条执行成功的 sql_db_query 语句"""
+    calls = {}
+    final_sql = None
+    for msg in messages:
+        for call in (getattr(msg, "tool_calls", None) or []):
+            if call["name"] == "sql_db_query":
+                calls[call["id"]] = call["args"].get("query", "")
+        if isinstance(msg, ToolMessage) and msg.tool_call_id in calls:
+            if not str(msg.content).startswith("Error"):
+                final_sql = calls[msg.tool_call_id]
+    return final_sql
+
+
+class PlanCache:
+    """
+    NL-to-SQL 计划缓存：按参数化后的问题保存代理生成的 SQL。
+
+    同一类问题再次出现时，直接用新的参数重新执行缓存的 SQL（走 SQLDatabase 的连接池），
+    拿到最新数据后只调用一次 LLM 总结答案；配置了答案模板时完全不调用 LLM。
+    计划记录 SQL 涉及的表的结构版本，表结构变化后计划失效。
+    """
+
+    def __init__(self, db, model, redis_client=None, catalog=None, ttl=7 * 86400):
+        self.db = db
+        self.model = model
+        self.redis = redis_client
+        self.catalog = catalog
+        self.ttl = ttl
+        self._plans = {}  # 键 -> 计划
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0  # 不能参数化重放、没有保存的计划数
+
+    def capture(self, question: str, messages):
+        """从代理的消息中提取最终执行的 SQL，按参数化后的问题保存"""
+        sql = extract_final_sql(messages)
+        if not sql:
+            return None
+
+        template, values = parameterize(question)
+        sql_template = parameterize_sql(sql, values)
+        if not is_replayable(sql_template, values):
+            self.skipped += 1
+            return None
+
+        tables = sorted(extract_tables(sql))
+        plan = {
+            "question": template,
+            "sql": sql_template,
+            "tables": tables,
+            "versions": self._ddl_versions(tables),
+            "answer_template": None
+        }
+        key = self._key(template)
+        old = self._get_plan(key)
+        if old is not None:
+            plan["answer_template"] = old.get("answer_template")
+        self._save(key, plan)
+        return plan
+
+    def set_answer_template(self, question: str, answer_template: str):
+        """
+        为一类问题配置答案模板，命中后不再调用 LLM
+        模板中可以使用 {result}（查询结果）以及 {p0}、{p1} ...（问题中的字面量）
+        :raises ValueError: 模板中有其他占位符
+        """
+        template, values = parameterize(question)
+        validate_answer_template(answer_template, len(values))
+        key = self._key(template)
+        plan = self._get_plan(key)
+        if plan is None:
+            return False
+        plan["answer_template"] = answer_template
+        self._save(key, plan)
+        return True
+
+    def replay(self, question: str):
+        """
+        用缓存的 SQL 回答问题
+        :return: {"sql", "result", "answer"}，answer 为 None 时需要调用 summarize；未命中返回 None
+        """
+        template, values = parameterize(question)
+        key = self._key(template)
+        plan = self._get_plan(key)
+        if plan is None or plan["versions"] != self._ddl_versions(plan["tables"]):
+            self.misses += 1
+            return None
+        if not is_replayable(plan["sql"], values):
+            # 之前的版本保存的、写死了字面量的计划
+            self.invalidate(question)
+            self.misses += 1
+            return None
+
+        params = {f"p{i}": value for i, value in enumerate(values)}
+        try:
+            result = self.db.run(plan["sql"], parameters=params)
+        except Exception as e:
+            # SQL 已经不适用（参数个数不同、表结构变化等），删除计划，交给代理重新生成
+            print("重放缓存的 SQL 失败:", e)
+            self.invalidate(question)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        answer = None
+        if plan.get("answer_template"):
+            try:
+                answer = plan["answer_template"].format(result=result, **params)
+            except (KeyError, IndexError, ValueError, AttributeError) as e:
+                # 模板与问题不匹配（例如旧版本保存的模板），退回调用 LLM 总结
+                print("套用答案模板失败:", e)
+        return {"sql": plan["sql"], "result": result, "answer": answer}
+
+    async def summarize(self, question: str, sql: str, result: str):
+        """只调用一次 LLM，根据查询结果回答问题"""
+        resp = await self.model.ainvoke(self._summary_messages(question, sql, result))
+        return resp.content
+
+    async def astream_summary(self, question: str, sql: str, result: str):
+        """summarize 的流式版本，逐个返回模型输出的片段"""
+        async for chunk in self.model.astream(self._summary_messages(question, sql, result)):
+            if chunk.content:
+                yield chunk.content
+
+    def _summary_messages(self, question, sql, result):
+        return [
+            SystemMessage(content="您是一个数据分析助手。根据给出的SQL语句和查询结果，用简洁的中文回答用户的问题。"),
+            HumanMessage(content=f"问题：{question}\nSQL：{sql}\n查询结果：{result}")
+        ]
+
+    def invalidate(self, question: str):
+        """删除一类问题的计划"""
+        key = self._key(parameterize(question)[0])
+        with self._lock:
+            self._plans.pop(key, None)
+        if self.redis is not None:
+            try:
+                self.redis.delete(f"plan_cache:{key}")
+            except redis.RedisError as e:
+                print("清除 SQL 计划缓存失败:", e)
+
+    def stats(self):
+        """返回命中、未命中和没有保存的计划数"""
+        return {"size": len(self._plans), "hits": self.hits, "misses": self.misses, "skipped": self.skipped}
+
+    def _key(self, template):
+        return hashlib.sha1(normalize_question(template).encode("utf-8")).hexdigest()
+
+    def _get_plan(self, key):
+        plan = self._plans.get(key)
+        if plan is None and self.redis is not None:
+            try:
+                data = self.redis.get(f"plan_cache:{key}")
+            except redis.RedisError as e:
+                print("读取 SQL 计划缓存失败:", e)
+                data = None
+            if data:
+                plan = json.loads(data)
+                with self._lock:
+                    self._plans[key] = plan
+        return plan
+
+    def _save(self, key, plan):
+        with self._lock:
+            self._plans[key] = plan
+        if self.redis is not None:
+            try:
+                self.redis.set(f"plan_cache:{key}", json.dumps(plan, ensure_ascii=False), ex=self.ttl)
+            except redis.RedisError as e:
+                print("写入 SQL 计划缓存失败:", e)
+
+    def _ddl_versions(self, tables):
+        if self.catalog is None:
+            return {}
+        try:
+            return self.catalog.table_ddl_versions(tables)
+        except Exception as e:
+            print("读取表结构版本失败:", e)
+            return {}
+
+
+plan_cache = Lazy("plan_cache", lambda: PlanCache(
+    agent_tools.db, llm_gateway.chat_model("summary"), redis_client, agent_tools.catalog
+))
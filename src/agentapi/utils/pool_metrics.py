@@ -0,0 +1,254 @@
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import event, exc
+
+# 获取连接等待时间直方图的分桶上界（秒）
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class PoolMetrics:
+    """
+    一个连接池的运行指标：获取连接的等待时间直方图、超时次数、新建和关闭的连接数（连接抖动），
+    以及由 status 回调提供的当前连接数、使用中和空闲的连接数
+    """
+
+    def __init__(self, name, status=None, recent=256):
+        self.name = name
+        self.status = status
+        self.bucket_counts = [0] * len(WAIT_BUCKETS)
+        self.wait_count = 0
+        self.wait_sum = 0.0
+        self.timeouts = 0
+        self.connects = 0
+        self.closes = 0
+        self._recent = deque(maxlen=recent)  # 最近的等待时间，用于自适应调整
+        self._lock = threading.Lock()
+
+    def observe_wait(self, seconds):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_sum += seconds
+            for i, bound in enumerate(WAIT_BUCKETS):
+                if seconds <= bound:
+                    self.bucket_counts[i] += 1
+                    break
+            self._recent.append(seconds)
+
+    def timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def connected(self):
+        with self._lock:
+            self.connects += 1
+
+    def closed(self):
+        with self._lock:
+            self.closes += 1
+
+    def recent_wait(self, quantile=0.95):
+        """最近若干次获取连接的等待时间分位数，没有数据时返回 None"""
+        with self._lock:
+            waits = sorted(self._recent)
+        if not waits:
+            return None
+        return waits[min(int(len(waits) * quantile), len(waits) - 1)]
+
+    def reset_recent(self):
+        with self._lock:
+            self._recent.clear()
+
+    def snapshot(self):
+        status = {}
+        if self.status is not None:
+            try:
+                status = self.status()
+            except Exception as e:
+                print(f"获取连接池 {self.name} 状态失败:", e)
+        with self._lock:
+            cumulative, buckets = 0, {}
+            for bound, count in zip(WAIT_BUCKETS, self.bucket_counts):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            buckets["+Inf"] = self.wait_count
+            # 无法通过事件统计关闭连接数的连接池，由 status 回调根据新建数和当前连接数推算 closes
+            return {
+                "wait_count": self.wait_count,
+                "wait_sum": self.wait_sum,
+                "wait_buckets": buckets,
+                "timeouts": self.timeouts,
+                "connects": self.connects,
+                "closes": self.closes,
+                **status
+            }
+
+
+# 所有注册的连接池指标，按名称索引
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def register_pool(name, status=None):
+    """注册一个连接池，返回它的指标对象；同名连接池重复注册时返回同一个对象并更新 status 回调"""
+    with _registry_lock:
+        metrics = _registry.get(name)
+        if metrics is None:
+            metrics = _registry[name] = PoolMetrics(name, status)
+        elif status is not None:
+            metrics.status = status
+        return metrics
+
+
+def pool_stats():
+    """所有连接池的指标，字典形式"""
+    with _registry_lock:
+        pools = list(_registry.values())
+    return {m.name: m.snapshot() for m in pools}
+
+
+def render_prometheus():
+    """所有连接池的指标，Prometheus 文本格式"""
+    gauges = [
+        ("size", "当前连接数"),
+        ("in_use", "使用中的连接数"),
+        ("idle", "空闲的连接数"),
+        ("max_size", "当前允许的最大连接数"),
+    ]
+    counters = [
+        ("timeouts", "timeouts_total", "获取连接超时次数"),
+        ("connects", "connections_created_total", "新建的连接数"),
+        ("closes", "connections_closed_total", "关闭的连接数"),
+    ]
+    stats = pool_stats()
+    lines = []
+    for key, help_text in gauges:
+        lines.append(f"# HELP agentapi_pool_{key} {help_text}")
+        lines.append(f"# TYPE agentapi_pool_{key} gauge")
+        for name, s in stats.items():
+            if key in s:
+                lines.append(f'agentapi_pool_{key}{{pool="{name}"}} {s[key]}')
+    for key, metric, help_text in counters:
+        lines.append(f"# HELP agentapi_pool_{metric} {help_text}")
+        lines.append(f"# TYPE agentapi_pool_{metric} counter")
+        for name, s in stats.items():
+            lines.append(f'agentapi_pool_{metric}{{pool="{name}"}} {s[key]}')
+    lines.append("# HELP agentapi_pool_checkout_wait_seconds 获取连接的等待时间")
+    lines.append("# TYPE agentapi_pool_checkout_wait_seconds histogram")
+    for name, s in stats.items():
+        for bound, count in s["wait_buckets"].items():
+            lines.append(f'agentapi_pool_checkout_wait_seconds_bucket{{pool="{name}",le="{bound}"}} {count}')
+        lines.append(f'agentapi_pool_checkout_wait_seconds_sum{{pool="{name}"}} {s["wait_sum"]}')
+        lines.append(f'agentapi_pool_checkout_wait_seconds_count{{pool="{name}"}} {s["wait_count"]}')
+    return "\n".join(lines) + "\n"
+
+
+class PoolGate:
+    """
+    限制同时借出的连接数，上限可以在运行时调整（用于自适应连接池大小）
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self.peak = 0  # 上次调整以来的最大使用数
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """获取一个名额，超时返回 False"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.in_use < self.limit, timeout):
+                return False
+            self.in_use += 1
+            self.peak = max(self.peak, self.in_use)
+            return True
+
+    def release(self):
+        with self._cond:
+            self.in_use -= 1
+            self._cond.notify()
+
+    def resize(self, limit):
+        with self._cond:
+            self.limit = limit
+            self._cond.notify_all()
+
+    def reset_peak(self):
+        with self._cond:
+            self.peak = self.in_use
+
+
+class AdaptiveSizer:
+    """
+    根据最近的获取连接等待时间调整连接池大小：
+    - 等待时间的 95 分位超过 target_wait 时加 1，不超过 max_size
+    - 等待时间很短（低于 target_wait 的 1/10）且最大使用数比上限少 2 个以上时减 1，不低于 min_size
+    每隔 interval 秒最多调整一次
+    """
+
+    def __init__(self, gate, metrics, min_size, max_size, target_wait=0.05, interval=10):
+        self.gate = gate
+        self.metrics = metrics
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_wait = target_wait
+        self.interval = interval
+        self._adjusted_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def maybe_adjust(self):
+        now = time.monotonic()
+        if now - self._adjusted_at < self.interval or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._adjusted_at = now
+            wait = self.metrics.recent_wait()
+            if wait is None:
+                return
+            limit = self.gate.limit
+            if wait > self.target_wait and limit < self.max_size:
+                limit += 1
+            elif wait < self.target_wait / 10 and self.gate.peak < limit - 1 and limit > self.min_size:
+                limit -= 1
+            if limit != self.gate.limit:
+                print(f"连接池 {self.metrics.name} 大小调整为 {limit}（等待时间 p95 {wait * 1000:.1f}ms）")
+                self.gate.resize(limit)
+                self.metrics.reset_recent()
+            self.gate.reset_peak()
+        finally:
+            self._lock.release()
+
+
+def instrument_engine(engine, name):
+    """
+    为 SQLAlchemy 引擎的连接池（QueuePool）注册指标：
+    记录 _do_get（从池中取连接，包括等待）的耗时和超时，并通过连接池事件统计新建和关闭的连接
+    """
+    pool = engine.pool
+
+    def status():
+        return {
+            "size": pool.checkedin() + pool.checkedout(),
+            "in_use": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "max_size": pool.size() + max(getattr(pool, "_max_overflow", 0), 0)
+        }
+
+    metrics = register_pool(name, status)
+    do_get = pool._do_get
+
+    def timed_do_get():
+        start = time.perf_counter()
+        try:
+            return do_get()
+        except exc.TimeoutError:
+            metrics.timeout()
+            raise
+        finally:
+            metrics.observe_wait(time.perf_counter() - start)
+
+    pool._do_get = timed_do_get
+    event.listen(pool, "connect", lambda *args: metrics.connected())
+    event.listen(pool, "close", lambda *args: metrics.closed())
+    return metrics
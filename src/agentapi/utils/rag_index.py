@@ -0,0 +1,234 @@
+"""
+RAG 工具使用的持久化向量索引（Chroma，保存在磁盘上）
+
+索引只构建一次，之后每次只处理变化的文档：清单文件记录每个文档的修改时间、大小、内容哈希和对应的向量 ID，
+修改时间和大小都没变的文档直接跳过，内容哈希没变的文档只更新清单，其余文档重新切分、编码并替换旧的向量。
+在项目根目录运行以构建或增量更新索引：
+python -m src.agentapi.utils.rag_index [--rebuild]
+文档较多时使用并行的流水线导入（src/agentapi/utils/rag_ingest.py），两者使用同一份清单：
+python -m src.agentapi.utils.rag_ingest [--rebuild] [--workers N]
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+
+from langchain_community.document_loaders import Docx2txtLoader
+from langchain_community.vectorstores import Chroma
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from src.agentapi.utils.embedding import ServiceEmbeddings
+
+# 文档目录和索引目录
+DOCS_DIR = "D:/D/document/python/程序操作空间/操作读取"
+PERSIST_DIR = "D:/D/document/python/程序操作空间/rag_index"
+COLLECTION_NAME = "restaurant_docs"
+MANIFEST_NAME = "manifest.json"
+# 导入完成的标记文件，检索端（BM25、压缩索引）在它变化后重建
+SYNCED_NAME = "synced.json"
+
+# 文本分割参数，修改后需要 --rebuild
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+SEPARATORS = ["\n\n", "\n", "。", "！", "？"]  # 中文分段优化
+
+
+def file_hash(path, block_size=1 << 20):
+    """文件内容的 sha256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_splitter():
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        separators=SEPARATORS
+    )
+
+
+def chunk_ids(path, digest, count):
+    """片段的向量 ID，由路径、内容哈希和序号组成，重复导入时保持不变"""
+    prefix = f"{hashlib.sha1(path.encode('utf-8')).hexdigest()[:8]}:{digest[:16]}"
+    return [f"{prefix}:{i}" for i in range(count)]
+
+
+class RagIndex:
+    """
+    持久化的向量索引和它的导入清单
+
+    - docs_dir: 文档目录，导入其中所有的 .docx
+    - persist_dir: Chroma 的持久化目录，清单文件也保存在这里
+    - embeddings: LangChain 的 Embeddings 对象，不传时使用共享的向量编码服务（embedding_service）
+    """
+
+    def __init__(self, docs_dir=DOCS_DIR, persist_dir=PERSIST_DIR, collection_name=COLLECTION_NAME, embeddings=None):
+        self.docs_dir = docs_dir
+        self.persist_dir = persist_dir
+        self.collection_name = collection_name
+        self.manifest_path = os.path.join(persist_dir, MANIFEST_NAME)
+        self.synced_path = os.path.join(persist_dir, SYNCED_NAME)
+        self._embeddings = embeddings
+        self._store = None
+        self._lock = threading.Lock()
+        self.splitter = make_splitter()
+
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            # 使用进程内共享的编码服务：与其他模块共用同一个模型和向量缓存，向量已归一化，支持余弦相似度
+            self._embeddings = ServiceEmbeddings()
+        return self._embeddings
+
+    def open(self):
+        """打开磁盘上的索引，每个进程只打开一次"""
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    os.makedirs(self.persist_dir, exist_ok=True)
+                    self._store = Chroma(
+                        collection_name=self.collection_name,
+                        embedding_function=self.embeddings,
+                        persist_directory=self.persist_dir,
+                        collection_metadata={"hnsw:space": "cosine"}
+                    )
+        return self._store
+
+    def reset(self):
+        """清空索引：删除 Chroma 集合后重新打开，返回新的向量存储"""
+        store = self.open()
+        with self._lock:
+            store.delete_collection()
+            self._store = None
+        return self.open()
+
+    def as_retriever(self, k=3):
+        """返回检索器；索引还没有构建过时先导入一次"""
+        if not os.path.exists(self.manifest_path):
+            self.sync()
+        return self.open().as_retriever(search_kwargs={"k": k})
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save_manifest(self, manifest):
+        # 先写临时文件再替换，中途退出不会留下损坏的清单
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def mark_synced(self, stats=None):
+        """
+        记录一次导入已经完成。导入过程中每批写入后都会保存清单，
+        检索端只在导入完成后重建，不会在导入过程中反复重建
+        """
+        tmp_path = self.synced_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"synced_at": time.time(), "stats": stats or {}}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.synced_path)
+
+    def synced_version(self):
+        """最近一次导入完成的版本（标记文件的修改时间和大小），没有完成过导入时为 None"""
+        try:
+            stat = os.stat(self.synced_path)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def list_documents(self):
+        paths = []
+        for root, _, files in os.walk(self.docs_dir):
+            for name in files:
+                if name.lower().endswith(".docx") and not name.startswith("~$"):  # 跳过 Word 的临时文件
+                    paths.append(os.path.normpath(os.path.join(root, name)))
+        return sorted(paths)
+
+    def split_file(self, path, digest):
+        """切分一个文档，返回 (片段列表, 向量 ID 列表)"""
+        docs = Docx2txtLoader(path).load()
+        chunks = self.splitter.split_documents(docs)
+        for chunk in chunks:
+            chunk.metadata["source"] = path
+            chunk.metadata["sha256"] = digest
+        return chunks, chunk_ids(path, digest, len(chunks))
+
+    def sync(self, rebuild=False):
+        """
+        增量更新索引
+        :param rebuild: 为 True 时清空索引和清单后全部重新导入
+        :return: {"added": 新增文档数, "updated": 更新文档数, "removed": 删除文档数, "unchanged": 未变化文档数, "chunks": 写入的片段数}
+        """
+        store = self.reset() if rebuild else self.open()
+        manifest = {} if rebuild else self.load_manifest()
+
+        stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "chunks": 0}
+        current = set(self.list_documents())
+
+        for path in sorted(set(manifest) - current):
+            if manifest[path]["ids"]:
+                store.delete(ids=manifest[path]["ids"])
+            del manifest[path]
+            stats["removed"] += 1
+
+        for path in sorted(current):
+            stat = os.stat(path)
+            entry = manifest.get(path)
+            if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+                stats["unchanged"] += 1
+                continue
+
+            digest = file_hash(path)
+            if entry and entry["sha256"] == digest:
+                # 只是修改时间变了（例如复制、另存为），内容相同，不重新编码
+                entry.update(mtime=stat.st_mtime, size=stat.st_size)
+                stats["unchanged"] += 1
+                continue
+
+            chunks, ids = self.split_file(path, digest)
+            if entry and entry["ids"]:
+                store.delete(ids=entry["ids"])
+            if chunks:
+                store.add_documents(chunks, ids=ids)
+            manifest[path] = {
+                "mtime": stat.st_mtime,
+                "size": stat.st_size,
+                "sha256": digest,
+                "ids": ids,
+                "indexed_at": time.time()
+            }
+            stats["updated" if entry else "added"] += 1
+            stats["chunks"] += len(chunks)
+            # 每个文档处理完就保存清单，中途失败时已完成的文档不需要重做
+            self.save_manifest(manifest)
+
+        self.save_manifest(manifest)
+        self.mark_synced(stats)
+        return stats
+
+
+rag_index = RagIndex()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="构建或增量更新 RAG 向量索引")
+    parser.add_argument("--rebuild", action="store_true", help="清空索引后全部重新导入")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    stats = rag_index.sync(rebuild=args.rebuild)
+    print(f"新增 {stats['added']}、更新 {stats['updated']}、删除 {stats['removed']}、未变化 {stats['unchanged']} 个文档，"
+          f"写入 {stats['chunks']} 个片段，耗时 {time.perf_counter() - start:.1f} 秒")
+
+
+if __name__ == "__main__":
+    main()
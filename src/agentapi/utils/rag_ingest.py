@@ -0,0 +1,291 @@
+"""
+RAG 文档的并行流式导入：解析 → 切分 → 编码 → 写入
+
+- 解析和切分在进程池中执行（docx 解析受 GIL 限制，多线程用不上多核）
+- 同时在进程池中的文档最多 max_pending 个，解析结果经过容量为 queue_size 的队列交给写入线程；
+  写入跟不上时队列会满，主线程停止提交新文档（背压），内存只与这两个上限有关，与文档总数无关
+- 写入线程把片段攒成 embed_batch_size 个一批，一次编码、一次批量写入 Chroma
+- 文档的全部片段写入后才记入清单（与 RagIndex 共用），中断后重新运行会跳过已完成的文档
+- 结束时输出 文档/秒、片段/秒、编码吞吐量和内存峰值
+
+在项目根目录运行：
+python -m src.agentapi.utils.rag_ingest [--rebuild] [--workers N] [--docs-dir 目录] [--persist-dir 目录]
+"""
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from langchain_community.document_loaders import Docx2txtLoader
+
+from src.agentapi.utils.embedding import embedding_service
+from src.agentapi.utils.rag_index import RagIndex, chunk_ids, file_hash, make_splitter, rag_index
+
+_splitter = None
+
+
+def peak_rss():
+    """当前进程的内存峰值（字节），无法获取时返回 0"""
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        # Windows 提供峰值工作集，其他平台只有当前值
+        return getattr(info, "peak_wset", info.rss)
+    except ImportError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 的单位是 KB，macOS 是字节
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        return 0
+
+
+def _parse(path, known_digest):
+    """
+    在子进程中执行：计算内容哈希并切分文档
+    :return: (路径, 内容哈希, 片段文本, 片段元数据, 向量 ID, 子进程内存峰值)；内容与 known_digest 相同时片段为 None
+    """
+    global _splitter
+    digest = file_hash(path)
+    if digest == known_digest:
+        return path, digest, None, None, None, peak_rss()
+    if _splitter is None:
+        _splitter = make_splitter()
+    chunks = _splitter.split_documents(Docx2txtLoader(path).load())
+    texts = [chunk.page_content for chunk in chunks]
+    metadatas = [{**chunk.metadata, "source": path, "sha256": digest} for chunk in chunks]
+    return path, digest, texts, metadatas, chunk_ids(path, digest, len(chunks)), peak_rss()
+
+
+class IngestPipeline:
+    """
+    并行导入 RagIndex 的文档目录
+
+    - workers: 解析进程数，默认 CPU 核数
+    - max_pending: 同时在进程池中的文档数上限，默认 workers * 2
+    - queue_size: 等待写入的文档数上限
+    - embed_batch_size: 每次编码和写入的片段数
+    """
+
+    def __init__(self, index: RagIndex = rag_index, workers=None, max_pending=None, queue_size=16, embed_batch_size=64):
+        self.index = index
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 2
+        self.queue_size = queue_size
+        self.embed_batch_size = embed_batch_size
+
+    def plan(self, manifest):
+        """
+        对比清单和文档目录
+        :return: (需要解析的 [(路径, 旧的内容哈希)], 已删除的路径, 未变化的文档数)
+        """
+        current = self.index.list_documents()
+        removed = sorted(set(manifest) - set(current))
+        todo = []
+        unchanged = 0
+        for path in current:
+            stat = os.stat(path)
+            entry = manifest.get(path)
+            if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+                unchanged += 1
+            else:
+                todo.append((path, entry["sha256"] if entry else None))
+        return todo, removed, unchanged
+
+    def run(self, rebuild=False):
+        """
+        执行导入
+        :param rebuild: 为 True 时清空索引和清单后全部重新导入
+        :return: 导入统计
+        """
+        start = time.perf_counter()
+        if rebuild:
+            store = self.index.reset()
+            manifest = {}
+            self.index.save_manifest(manifest)
+        else:
+            store = self.index.open()
+            manifest = self.index.load_manifest()
+
+        todo, removed, unchanged = self.plan(manifest)
+        stats = {"documents": len(todo) + unchanged, "added": 0, "updated": 0, "removed": 0, "unchanged": unchanged,
+                 "failed": 0, "chunks": 0, "batches": 0, "worker_peak_rss": 0}
+
+        for path in removed:
+            if manifest[path]["ids"]:
+                store.delete(ids=manifest[path]["ids"])
+            del manifest[path]
+            stats["removed"] += 1
+        if removed:
+            self.index.save_manifest(manifest)
+
+        writer = _Writer(self.index, store, manifest, stats, self.embed_batch_size, self.queue_size)
+        writer.start()
+        try:
+            self._parse_all(todo, writer, stats)
+        finally:
+            writer.finish()
+        self.index.mark_synced(stats)
+
+        elapsed = time.perf_counter() - start
+        processed = stats["added"] + stats["updated"] + stats["unchanged"] - unchanged
+        stats.update(
+            seconds=round(elapsed, 2),
+            docs_per_sec=round(processed / elapsed, 2) if elapsed else 0.0,
+            chunks_per_sec=round(stats["chunks"] / elapsed, 2) if elapsed else 0.0,
+            peak_rss=peak_rss(),
+            embedding=embedding_service.stats()
+        )
+        return stats
+
+    def _parse_all(self, todo, writer, stats):
+        if not todo:
+            return
+        remaining = iter(todo)
+        pending = set()
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(todo))) as pool:
+            while True:
+                # 进程池中的文档不超过 max_pending 个；写入队列满时 writer.put 阻塞，这里也不再提交
+                while len(pending) < self.max_pending:
+                    item = next(remaining, None)
+                    if item is None:
+                        break
+                    pending.add(pool.submit(_parse, *item))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        # 失败的文档不记入清单，下次运行时重试
+                        print("解析文档失败:", e)
+                        stats["failed"] += 1
+                        continue
+                    stats["worker_peak_rss"] = max(stats["worker_peak_rss"], result[-1])
+                    writer.put(result[:-1])
+
+
+class _Writer(threading.Thread):
+    """写入线程：攒批编码并批量写入，文档的全部片段写入后更新清单"""
+
+    _DONE = object()
+
+    def __init__(self, index, store, manifest, stats, batch_size, queue_size):
+        super().__init__(name="rag-ingest-writer", daemon=True)
+        self.index = index
+        self.store = store
+        self.manifest = manifest
+        self.stats = stats
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self._texts, self._metadatas, self._ids = [], [], []
+        self._open = {}  # 路径 -> [清单条目, 还没有写入的片段数]
+
+    def put(self, item):
+        while True:
+            if self.error is not None:
+                raise RuntimeError("写入向量索引失败") from self.error
+            try:
+                self.queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def finish(self):
+        """等待队列中的文档全部写入"""
+        # 与 put 一样带超时轮询：队列满时写入线程出错退出，不会一直阻塞
+        while self.error is None and self.is_alive():
+            try:
+                self.queue.put(self._DONE, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        self.join()
+        if self.error is not None:
+            raise RuntimeError("写入向量索引失败") from self.error
+
+    def run(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is self._DONE:
+                    break
+                self._add(*item)
+            self._flush()
+            self.index.save_manifest(self.manifest)
+        except Exception as e:
+            self.error = e
+
+    def _add(self, path, digest, texts, metadatas, ids):
+        stat = os.stat(path)
+        old = self.manifest.get(path)
+        if texts is None:
+            # 只是修改时间变了，内容相同，不重新编码
+            old.update(mtime=stat.st_mtime, size=stat.st_size)
+            self.stats["unchanged"] += 1
+            return
+
+        if old and old["ids"]:
+            self.store.delete(ids=old["ids"])
+        entry = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": digest, "ids": ids, "indexed_at": time.time()}
+        self.stats["updated" if old else "added"] += 1
+        if not texts:
+            self.manifest[path] = entry
+            return
+        self._open[path] = [entry, len(texts)]
+        self._texts.extend(texts)
+        self._metadatas.extend(metadatas)
+        self._ids.extend(ids)
+        while len(self._texts) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._texts:
+            return
+        n = self.batch_size
+        texts, metadatas, ids = self._texts[:n], self._metadatas[:n], self._ids[:n]
+        del self._texts[:n], self._metadatas[:n], self._ids[:n]
+        # add_texts 一次编码整批片段，并用一次 upsert 写入
+        self.store.add_texts(texts, metadatas=metadatas, ids=ids)
+        self.stats["chunks"] += len(texts)
+        self.stats["batches"] += 1
+
+        for metadata in metadatas:
+            state = self._open[metadata["source"]]
+            state[1] -= 1
+            if state[1] == 0:
+                self.manifest[metadata["source"]] = state[0]
+                del self._open[metadata["source"]]
+        # 每批写入后保存清单，中断时最多重做未写完的文档
+        self.index.save_manifest(self.manifest)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并行导入 RAG 文档")
+    parser.add_argument("--rebuild", action="store_true", help="清空索引后全部重新导入")
+    parser.add_argument("--workers", type=int, default=None, help="解析进程数，默认 CPU 核数")
+    parser.add_argument("--batch-size", type=int, default=64, help="每次编码和写入的片段数")
+    parser.add_argument("--docs-dir", default=None, help="文档目录")
+    parser.add_argument("--persist-dir", default=None, help="索引目录")
+    args = parser.parse_args()
+
+    index = rag_index
+    if args.docs_dir or args.persist_dir:
+        index = RagIndex(docs_dir=args.docs_dir or rag_index.docs_dir, persist_dir=args.persist_dir or rag_index.persist_dir)
+    stats = IngestPipeline(index, workers=args.workers, embed_batch_size=args.batch_size).run(rebuild=args.rebuild)
+    print(f"新增 {stats['added']}、更新 {stats['updated']}、删除 {stats['removed']}、未变化 {stats['unchanged']}、"
+          f"失败 {stats['failed']} 个文档，写入 {stats['chunks']} 个片段（{stats['batches']} 批），耗时 {stats['seconds']} 秒")
+    print(f"{stats['docs_per_sec']} 文档/秒，{stats['chunks_per_sec']} 片段/秒，"
+          f"编码 {stats['embedding']['texts_per_sec']} 条/秒")
+    print(f"内存峰值：主进程 {stats['peak_rss'] / 2 ** 20:.0f} MB，解析进程 {stats['worker_peak_rss'] / 2 ** 20:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,47 @@
+import asyncio
+import re
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from threading import Lock
+
 from langchain.memory import ConversationBufferMemory
 from redis import Redis
-import json
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from time import time
-from langchain.schema import HumanMessage, AIMessage
-from pydantic import  Field
+from langchain.schema import HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import get_buffer_string
+from pydantic import  Field, PrivateAttr
 import redis
+import redis.asyncio
+from redis.asyncio import Redis as AsyncRedis
 from langchain.chains import ConversationChain
-from langchain_deepseek import ChatDeepSeek
 
-class RedisConversationMemory(ConversationBufferMemory):
-    redis: Redis = Field(...)  # 必填字段
+from src.agentapi.utils.llm_gateway import llm_gateway
+from src.agentapi.utils.message_codec import encode_message, decode_message
+
+_CJK = re.compile(r"[\u4e00-\u9fff\u3000-\u303f\uff00-\uffef]")
+
+
+def count_tokens(text: str) -> int:
+    """估算文本的 token 数：中文字符和标点按 1 个 token，其他字符按 4 个字符 1 个 token"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class BaseRedisConversationMemory(ConversationBufferMemory):
+    """
+    保存在 Redis 中的对话记忆的公共部分：字段、键名、token 预算、消息编解码。
+    读写 Redis 的部分由 RedisConversationMemory（同步）和 AsyncRedisConversationMemory（异步）分别实现
+    """
+    redis: Any = Field(...)  # 必填字段
     session_id: str = Field(...)  # 必填字段
     max_history: int = Field(default=10)  # 可选字段，默认值为 10
+    seq: int = Field(default=0)  # 已同步到的对话序号，每保存一轮加一，用于多个 worker 之间的一致性检查
+    token_budget: Optional[int] = Field(default=None)  # 历史对话的 token 预算，为空时按 max_history 轮数保留
+    summary: str = Field(default="")  # 超出预算的早期对话的滚动摘要
 
-    def __init__(self, redis_client: Redis, session_id: str, max_history=10, *args, **kwargs):
+    def __init__(self, redis_client, session_id: str, max_history=10, *args, **kwargs):
         # 将 redis_client 和 session_id 传递给 Pydantic 父类
         super().__init__(
             redis=redis_client,
@@ -23,62 +50,469 @@ class RedisConversationMemory(ConversationBufferMemory):
             *args,
             **kwargs
         )
+
+    @property
+    def key(self):
+        return f"chat:{self.session_id}"
+
+    @property
+    def seq_key(self):
+        return f"chat:{self.session_id}:seq"
+
+    @property
+    def summary_key(self):
+        return f"chat:{self.session_id}:summary"
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """开启 token 预算时，只返回预算内最近的消息，更早的对话用摘要代替"""
+        if not self.token_budget:
+            return super().load_memory_variables(inputs)
+        messages = self.budgeted_messages()
+        if not self.return_messages:
+            messages = get_buffer_string(messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)
+        return {self.memory_key: messages}
+
+    async def aload_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        return self.load_memory_variables(inputs)
+
+    def budgeted_messages(self):
+        """摘要加上不超过 token 预算的最近消息，至少保留最近一条"""
+        messages = self.chat_memory.messages
+        kept = messages[len(messages) - self._fitting_count():]
+        if self.summary:
+            kept = [SystemMessage(content=f"之前对话的摘要：{self.summary}")] + kept
+        return kept
+
+    def _fitting_count(self):
+        """从最新的消息往前数，能放进 token 预算的消息条数"""
+        used = count_tokens(self.summary)
+        count = 0
+        for msg in reversed(self.chat_memory.messages):
+            used += count_tokens(msg.content)
+            if used > self.token_budget and count > 0:
+                break
+            count += 1
+        return count
+
+    def _replace_history(self, stored_messages, seq, summary=None):
+        self.chat_memory.clear()
+        for msg in stored_messages[::-1]:  # Redis 列表是反向存储
+            self.chat_memory.add_message(self._decode(msg))
+        self.seq = int(seq or 0)
+        if summary is not None:
+            self.summary = summary.decode("utf-8") if isinstance(summary, bytes) else summary
+
+    def _trim(self):
+        """内存中也只保留最近 max_history 轮，与 Redis 中的列表保持一致"""
+        messages = self.chat_memory.messages
+        if len(messages) > self.max_history * 2:
+            del messages[:len(messages) - self.max_history * 2]
+
+    @staticmethod
+    def _encode_turn(inputs, outputs):
+        """使用紧凑的二进制格式编码一轮对话"""
+        now = time()
+        return (
+            encode_message('human', inputs['input'], now),
+            encode_message('ai', outputs['response'], now)
+        )
+
+    @staticmethod
+    def _decode(msg):
+        # 同时兼容旧版本的 JSON 编码
+        message_data = decode_message(msg)
+        return (
+            HumanMessage(content=message_data['content']) if message_data['type'] == 'human'
+            else AIMessage(content=message_data['content'])
+        )
+
+
+class RedisConversationMemory(BaseRedisConversationMemory):
+    redis: Redis = Field(...)
+
+    def __init__(self, redis_client: Redis, session_id: str, max_history=10, *args, **kwargs):
+        super().__init__(redis_client, session_id, max_history, *args, **kwargs)
         self._load_initial_history()
 
     def _load_initial_history(self):
-        # 从 Redis 加载历史对话，获取列表中所有元素
-        stored_messages = self.redis.lrange(f"chat:{self.session_id}", 0, -1)
-        for msg in stored_messages[::-1]:  # Redis 列表是反向存储
-            message_data = json.loads(msg)
-            self.chat_memory.add_message(
-                HumanMessage(content=message_data['content']) if message_data['type'] == 'human'
-                else AIMessage(content=message_data['content'])
-            )
+        # 从 Redis 加载历史对话，获取列表中所有元素，同一个事务里读取序号和摘要
+        pipeline = self.redis.pipeline()
+        pipeline.lrange(self.key, 0, -1)
+        pipeline.get(self.seq_key)
+        pipeline.get(self.summary_key)
+        stored_messages, seq, summary = pipeline.execute()
+        self._replace_history(stored_messages, seq, summary)
+
+    def sync(self):
+        """
+        与 Redis 同步：只读取序号，其他 worker 写入了新的对话时只加载新增的部分
+        """
+        remote_seq = int(self.redis.get(self.seq_key) or 0)
+        new_turns = remote_seq - self.seq
+        if new_turns == 0:
+            return
+        if self.seq < 0 or new_turns < 0 or new_turns > self.max_history:
+            # 保存时发生过冲突、序号回退（键过期）或落后太多，重新加载全部历史
+            self._load_initial_history()
+            return
+
+        pipeline = self.redis.pipeline()
+        pipeline.lrange(self.key, 0, new_turns * 2 - 1)
+        pipeline.get(self.seq_key)
+        stored_messages, seq = pipeline.execute()
+        for msg in stored_messages[::-1]:
+            self.chat_memory.add_message(self._decode(msg))
+        self._trim()
+        self.seq = int(seq or 0)
 
     def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
         """保存上下文到内存和 Redis"""
         super().save_context(inputs, outputs)
+        self._trim()
 
         # 序列化消息
-        user_msg = json.dumps({
-            'type': 'human',
-            'content': inputs['input'],
-            'timestamp': time()
-        })
-        ai_msg = json.dumps({
-            'type': 'ai',
-            'content': outputs['response'],
-            'timestamp': time()
-        })
-
-        # 使用 Pipeline 批量操作
+        user_msg, ai_msg = self._encode_turn(inputs, outputs)
+
+        # 使用 Pipeline 批量操作，只写入本轮新增的两条消息
         pipeline = self.redis.pipeline()
         # 将消息添加到列表的开头，先添加 user_msg，再添加 ai_msg，Redis 列表是反向存储
-        pipeline.lpush(f"chat:{self.session_id}", user_msg, ai_msg)
-        pipeline.ltrim(f"chat:{self.session_id}", 0, self.max_history * 2 - 1)  # 将列表截断为指定的索引范围，保留最近 N 轮
-        pipeline.expire(f"chat:{self.session_id}", 86400)  # 24 小时过期
-        pipeline.execute()
+        pipeline.lpush(self.key, user_msg, ai_msg)
+        pipeline.ltrim(self.key, 0, self.max_history * 2 - 1)  # 将列表截断为指定的索引范围，保留最近 N 轮
+        pipeline.expire(self.key, 86400)  # 24 小时过期
+        pipeline.incr(self.seq_key)
+        pipeline.expire(self.seq_key, 86400)
+        seq = pipeline.execute()[3]
+
+        if seq == self.seq + 1:
+            self.seq = seq
+        else:
+            # 期间有其他 worker 写入，内存中的历史已经不完整，下次使用前重新加载
+            self.seq = -1
+
+
+# 保存一轮对话：追加、截断、更新序号；序号与内存中的不一致（其他 worker 写入过或压缩过历史）时
+# 同时返回最新的列表和摘要。在 Redis 中一次执行，一轮对话只需一次往返
+# KEYS: 对话列表、序号、摘要；ARGV: 用户消息、AI 消息、保留的消息条数、过期时间（秒）、内存中的序号
+_SAVE_TURN_SCRIPT = """
+redis.call('LPUSH', KEYS[1], ARGV[1], ARGV[2])
+redis.call('LTRIM', KEYS[1], 0, tonumber(ARGV[3]) - 1)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+local seq = redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+if seq == tonumber(ARGV[5]) + 1 then
+    return {seq}
+end
+return {seq, redis.call('LRANGE', KEYS[1], 0, -1), redis.call('GET', KEYS[3]) or ''}
+"""
+
+# 压缩历史：摘要没有被其他 worker 更新过时，核对列表尾部仍然是已压缩的消息（生成摘要期间
+# 轮数上限可能已经截掉了其中最早的几条），删除这些消息、写入新摘要并增加序号；返回删除的条数，0 表示放弃
+# KEYS: 对话列表、序号、摘要；ARGV: 新摘要、旧摘要、过期时间（秒）、序号增量、已压缩的消息（从新到旧）
+_COMPACT_SCRIPT = """
+if (redis.call('GET', KEYS[3]) or '') ~= ARGV[2] then
+    return 0
+end
+local n = #ARGV - 4
+for j = n, 1, -1 do
+    local tail = redis.call('LRANGE', KEYS[1], -j, -1)
+    local same = #tail == j
+    for i = 1, j do
+        if not same then
+            break
+        end
+        same = tail[i] == ARGV[4 + i]
+    end
+    if same then
+        redis.call('LTRIM', KEYS[1], 0, -j - 1)
+        redis.call('SET', KEYS[3], ARGV[1], 'EX', ARGV[3])
+        redis.call('INCRBY', KEYS[2], ARGV[4])
+        return j
+    end
+end
+return 0
+"""
+
+
+class AsyncRedisConversationMemory(BaseRedisConversationMemory):
+    """
+    基于 redis.asyncio 的对话记忆，不阻塞事件循环
+
+    - 通过 create 创建（加载历史需要 await）
+    - 复用前调用 arefresh 读取 Redis 中的序号（一次 GET），其他 worker 写入过时增量加载，
+      本轮的提示词包含所有 worker 写入的历史
+    - asave_context 用一个 Lua 脚本完成追加、截断、更新序号，序号不一致时（arefresh 之后又有其他 worker 写入）
+      同时读回最新的历史和摘要
+    - 只实现了异步接口（aload_memory_variables / asave_context），同步的 save_context
+      是 ConversationBufferMemory 的实现，只更新内存，不写入 Redis
+    """
+    redis: AsyncRedis = Field(...)
+    _compacting: bool = PrivateAttr(default=False)  # 是否有正在执行的摘要任务
+    _save_script: Any = PrivateAttr(default=None)
+    _compact_script: Any = PrivateAttr(default=None)
+
+    def __init__(self, redis_client: AsyncRedis, session_id: str, max_history=10, *args, **kwargs):
+        super().__init__(redis_client, session_id, max_history, *args, **kwargs)
+        # 脚本按 SHA1 执行，Redis 中没有时自动加载
+        self._save_script = redis_client.register_script(_SAVE_TURN_SCRIPT)
+        self._compact_script = redis_client.register_script(_COMPACT_SCRIPT)
 
+    @classmethod
+    async def create(cls, redis_client: AsyncRedis, session_id: str, max_history=10, **kwargs):
+        memory = cls(redis_client, session_id, max_history, **kwargs)
+        await memory.aload()
+        return memory
 
+    async def aload(self):
+        """从 Redis 加载历史对话，同一个事务里读取序号和摘要"""
+        async with self.redis.pipeline() as pipeline:
+            pipeline.lrange(self.key, 0, -1)
+            pipeline.get(self.seq_key)
+            pipeline.get(self.summary_key)
+            stored_messages, seq, summary = await pipeline.execute()
+        self._replace_history(stored_messages, seq, summary)
 
+    async def arefresh(self):
+        """
+        与 Redis 同步（sync 的异步版本）：只读取序号，其他 worker 写入了新的对话时只加载新增的部分
+        """
+        remote_seq = int(await self.redis.get(self.seq_key) or 0)
+        new_turns = remote_seq - self.seq
+        if new_turns == 0:
+            return
+        if self.seq < 0 or new_turns < 0 or new_turns > self.max_history:
+            # 序号回退（键过期）、落后太多或其他 worker 压缩过历史，重新加载全部历史和摘要
+            await self.aload()
+            return
 
-redis_client = redis.Redis(
-    host='192.168.46.130',  # Redis服务器IP地址
-    port=6379,              # Redis服务器端口号
-    password='123321'       # Redis访问密码
+        async with self.redis.pipeline() as pipeline:
+            pipeline.lrange(self.key, 0, new_turns * 2 - 1)
+            pipeline.get(self.seq_key)
+            stored_messages, seq = await pipeline.execute()
+        if int(seq or 0) != remote_seq:
+            # 两次读取之间又有写入，直接重新加载
+            await self.aload()
+            return
+        for msg in stored_messages[::-1]:
+            self.chat_memory.add_message(self._decode(msg))
+        self._trim()
+        self.seq = remote_seq
+
+    async def asave_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        """保存上下文到内存和 Redis，其他 worker 写入过时用读回的历史替换内存中的历史"""
+        await super().asave_context(inputs, outputs)
+        self._trim()
+
+        user_msg, ai_msg = self._encode_turn(inputs, outputs)
+        result = await self._save_script(
+            keys=[self.key, self.seq_key, self.summary_key],
+            args=[user_msg, ai_msg, self.max_history * 2, 86400, self.seq]
+        )
+        if len(result) > 1:
+            self._replace_history(result[1], result[0], result[2])
+        else:
+            self.seq = result[0]
+
+        # 超出 token 预算或接近轮数上限时，在后台把早期对话压缩为摘要，不增加本次响应的耗时
+        if self.token_budget and not self._compacting and (
+            self._fitting_count() < len(self.chat_memory.messages)
+            or len(self.chat_memory.messages) >= (self.max_history - 1) * 2
+        ):
+            self._compacting = True
+            task = asyncio.create_task(self._acompact())
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+
+    async def _acompact(self):
+        """
+        把超出预算的早期消息和已有摘要一起压缩为新的摘要，并从 Redis 列表中删除这些消息
+
+        压缩的消息和摘要从 Redis 读取；写回时由脚本按内容核对列表尾部，生成摘要期间列表被截断过时
+        只删除仍然存在的已压缩消息，摘要被其他 worker 更新过时放弃本次压缩。
+        不修改正在使用的对象，序号增加后下一次保存时读回压缩后的历史
+        """
+        try:
+            messages = self.chat_memory.messages
+            # 至少压缩最早的一半，避免只因轮数上限触发时没有可压缩的消息
+            count = max(len(messages) - self._fitting_count(), len(messages) // 2)
+            count -= count % 2  # 按轮（一问一答）压缩
+            if count <= 0:
+                return
+
+            # 最早的消息在列表尾部
+            async with self.redis.pipeline() as pipeline:
+                pipeline.lrange(self.key, -count, -1)
+                pipeline.get(self.summary_key)
+                stored_messages, old_summary = await pipeline.execute()
+            if not stored_messages:
+                return
+            old_summary = old_summary.decode("utf-8") if isinstance(old_summary, bytes) else (old_summary or "")
+            old_messages = [self._decode(msg) for msg in stored_messages[::-1]]
+
+            resp = await chat_model.ainvoke([
+                SystemMessage(content="请把下面的对话压缩为简洁的中文摘要，保留用户的身份、偏好和关键事实，不超过200字。"),
+                HumanMessage(content=(
+                    f"已有摘要：{old_summary or '无'}\n\n新的对话：\n"
+                    + get_buffer_string(old_messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)
+                ))
+            ])
+
+            # 序号增加超过 max_history，其他 worker 和本对象下一次保存时都会读回全部历史和摘要
+            trimmed = await self._compact_script(
+                keys=[self.key, self.seq_key, self.summary_key],
+                args=[resp.content, old_summary, 86400, self.max_history + 1, *stored_messages]
+            )
+            if not trimmed:
+                print("对话历史在生成摘要期间发生了变化，放弃本次压缩")
+        except Exception as e:
+            print("压缩对话历史失败:", e)
+        finally:
+            self._compacting = False
+
+
+# 后台摘要任务的引用，避免任务在执行完之前被垃圾回收
+_background_tasks = set()
+
+# Redis 连接配置，同步和异步客户端共用
+REDIS_CONFIG = {
+    'host': '192.168.46.130',  # Redis服务器IP地址
+    'port': 6379,              # Redis服务器端口号
+    'password': '123321',      # Redis访问密码
+    'max_connections': 50,     # 连接池大小，连接用完时等待 pool_timeout 秒
+    'socket_timeout': 5,       # 读写超时（秒）
+    'socket_connect_timeout': 2,  # 建立连接超时（秒）
+    'health_check_interval': 30,  # 连接空闲超过 30 秒时，使用前先 PING 检查
+    'retry_on_timeout': True,
+}
+
+redis_client = redis.Redis(connection_pool=redis.BlockingConnectionPool(timeout=5, **REDIS_CONFIG))
+
+async_redis_client = redis.asyncio.Redis(
+    connection_pool=redis.asyncio.BlockingConnectionPool(timeout=5, **REDIS_CONFIG)
 )
 
-def get_conversation_chain(session_id: str):
-    memory = RedisConversationMemory(
-        redis_client=redis_client,
-        session_id=session_id,
-        max_history=5  # 保留最近 5 轮对话
-    )
+# 所有会话共享的模型客户端，通过 LLM 网关复用 HTTP 连接池并统一限流和重试
+chat_model = llm_gateway.chat_model("chat")
+
+
+class SessionStore:
+    """
+    按会话缓存对话链（包含 RedisConversationMemory），避免每次请求都重新创建并全量加载历史
+
+    - 最多缓存 maxsize 个会话，超出时淘汰最久未使用的会话
+    - 超过 idle_timeout 秒未使用的会话会被淘汰
+    - 复用前只读取 Redis 中的序号，其他 worker 写入过时才增量加载
+    """
+
+    def __init__(self, redis_client: Redis, maxsize=1024, idle_timeout=1800, max_history=5, token_budget=None):
+        self.redis = redis_client
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.max_history = max_history
+        self.token_budget = token_budget
+        self._sessions = OrderedDict()  # session_id -> (对话链, 最后使用时间)
+        self._lock = Lock()
 
-    return ConversationChain(
-        llm=ChatDeepSeek(model="deepseek-chat", max_tokens=200),
-        memory=memory,
-        verbose=True
-    )
+    def get(self, session_id: str):
+        with self._lock:
+            self._evict()
+            item = self._sessions.pop(session_id, None)
+
+        if item is None:
+            chain = ConversationChain(
+                llm=chat_model,
+                memory=RedisConversationMemory(
+                    redis_client=self.redis,
+                    session_id=session_id,
+                    max_history=self.max_history,
+                    token_budget=self.token_budget
+                ),
+                verbose=True
+            )
+        else:
+            chain = item[0]
+            chain.memory.sync()
+
+        with self._lock:
+            self._sessions[session_id] = (chain, time())
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+        return chain
+
+    def _evict(self):
+        """淘汰空闲超时的会话，OrderedDict 按最后使用时间排序，从头部开始检查即可"""
+        now = time()
+        while self._sessions:
+            session_id, (_, last_used) = next(iter(self._sessions.items()))
+            if now - last_used < self.idle_timeout:
+                break
+            self._sessions.popitem(last=False)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class AsyncSessionStore(SessionStore):
+    """
+    SessionStore 的 asyncio 版本，会话记忆使用 AsyncRedisConversationMemory
+
+    - 通过 session 独占使用一个会话：同一个会话的请求在本进程内依次执行，不会同时修改同一个记忆对象
+    - 复用前读取 Redis 中的序号，其他 worker 写入过时先加载，再生成本轮的回答
+    """
+
+    def __init__(self, redis_client: AsyncRedis, maxsize=1024, idle_timeout=1800, max_history=5, token_budget=None):
+        super().__init__(redis_client, maxsize, idle_timeout, max_history, token_budget)
+        # session_id -> asyncio.Lock，没有请求持有或等待时自动回收
+        self._session_locks = weakref.WeakValueDictionary()
+
+    @asynccontextmanager
+    async def session(self, session_id: str):
+        """
+        独占使用一个会话的对话链，退出时释放
+        用法：async with async_session_store.session(session_id) as chain: ...
+        """
+        with self._lock:
+            lock = self._session_locks.get(session_id)
+            if lock is None:
+                lock = self._session_locks[session_id] = asyncio.Lock()
+        async with lock:
+            yield await self.get(session_id)
+
+    async def get(self, session_id: str):
+        with self._lock:
+            self._evict()
+            item = self._sessions.pop(session_id, None)
+
+        if item is None:
+            chain = ConversationChain(
+                llm=chat_model,
+                memory=await AsyncRedisConversationMemory.create(
+                    redis_client=self.redis,
+                    session_id=session_id,
+                    max_history=self.max_history,
+                    token_budget=self.token_budget
+                ),
+                verbose=True
+            )
+        else:
+            chain = item[0]
+            await chain.memory.arefresh()
+
+        with self._lock:
+            self._sessions[session_id] = (chain, time())
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+        return chain
+
+
+session_store = SessionStore(redis_client, max_history=5)  # 保留最近 5 轮对话
+# 按 token 预算保留历史，超出预算的早期对话压缩为摘要，max_history 只作为轮数上限
+async_session_store = AsyncSessionStore(async_redis_client, max_history=20, token_budget=1000)
+
+
+def get_conversation_chain(session_id: str):
+    return session_store.get(session_id)
 
 
+def async_conversation_chain(session_id: str):
+    """独占使用一个会话的对话链：async with async_conversation_chain(session_id) as chain: ..."""
+    return async_session_store.session(session_id)
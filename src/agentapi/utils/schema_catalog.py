@@ -0,0 +1,212 @@
+import hashlib
+import json
+import threading
+import time
+from typing import Any
+
+import redis
+from langchain_community.tools.sql_database.tool import InfoSQLDatabaseTool, ListSQLDatabaseTool
+from langchain_community.utilities import SQLDatabase
+from pydantic import Field
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+
+class SchemaCatalog:
+    """
+    SQL 代理的表结构目录：缓存每张表的 DDL 和示例数据（SQLDatabase.get_table_info 的结果）。
+
+    - 一级缓存在进程内存，二级缓存在 Redis，多个 worker 共享
+    - 每张表的版本号由 information_schema 中的 UPDATE_TIME 和列定义的哈希组成，
+      版本变化时只重新生成这张表的缓存
+    - 版本检查最多每 check_interval 秒执行一次
+    - MySQL 8 默认把 information_schema.TABLES 的统计值（包括 UPDATE_TIME）缓存
+      information_schema_stats_expiry 秒（默认 24 小时），表数据变化后版本号不会及时改变，
+      依赖版本号的答案缓存会一直返回旧的答案；因此读取版本号的会话中把它设为 0
+    """
+
+    def __init__(self, db: SQLDatabase, redis_client=None, check_interval=30, ttl=86400):
+        self.db = db
+        self.redis = redis_client
+        self.check_interval = check_interval
+        self.ttl = ttl
+        self.redis_key = f"schema_catalog:{db._engine.url.database}"
+        self._entries = {}  # 表名 -> {"version": 版本号, "info": 表结构文本}
+        self._versions = {}  # 表名 -> 数据库中的最新版本号
+        self._ddl_versions = {}  # 表名 -> 只与表结构有关的版本号，数据变化时不变
+        self._docs = {}  # 表名 -> 表名、列名和注释组成的描述文本，用于选表
+        self._checked_at = 0.0
+        self._stats_expiry = True  # 数据库是否支持 information_schema_stats_expiry（MySQL 8）
+        self._lock = threading.Lock()
+
+    def list_tables(self):
+        """返回可查询的表名，代替 sql_db_list_tables"""
+        return sorted(self.db.get_usable_table_names())
+
+    def get_table_info(self, table_names):
+        """
+        返回指定表的结构和示例数据，代替 sql_db_schema
+        :param table_names: 表名列表
+        :return: 各表的结构文本，用空行分隔
+        """
+        missing = set(table_names) - set(self.db.get_usable_table_names())
+        if missing:
+            return f"Error: table_names {missing} not found in database"
+
+        self._check_versions()
+        return "\n\n".join(self._get_entry(name) for name in table_names)
+
+    def get_table_docs(self):
+        """返回每张可查询表的描述文本（表名、表注释、列名、列注释）"""
+        self._check_versions()
+        usable = self.db.get_usable_table_names()
+        return {name: doc for name, doc in self._docs.items() if name in usable}
+
+    def table_versions(self, table_names):
+        """返回指定表当前的版本号，表数据或结构变化时版本号改变"""
+        self._check_versions()
+        return {name: self._versions.get(name) for name in table_names}
+
+    def table_ddl_versions(self, table_names):
+        """返回指定表当前的结构版本号，只在表结构变化时改变"""
+        self._check_versions()
+        return {name: self._ddl_versions.get(name) for name in table_names}
+
+    def is_warm(self):
+        """所有表的缓存都是最新版本时返回 True"""
+        self._check_versions()
+        return all(
+            name in self._entries and self._entries[name]["version"] == self._versions.get(name)
+            for name in self.db.get_usable_table_names()
+        )
+
+    def warm_up(self):
+        """预先加载所有表的缓存"""
+        return self.get_table_info(self.list_tables())
+
+    def invalidate(self, table_name=None):
+        """清除指定表（不传时清除全部）的缓存"""
+        with self._lock:
+            if table_name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(table_name, None)
+            self._checked_at = 0.0
+        try:
+            if self.redis is not None:
+                if table_name is None:
+                    self.redis.delete(self.redis_key)
+                else:
+                    self.redis.hdel(self.redis_key, table_name)
+        except redis.RedisError as e:
+            print("表结构缓存清除失败:", e)
+
+    def _get_entry(self, name):
+        version = self._versions.get(name)
+
+        # 1. 进程内缓存
+        entry = self._entries.get(name)
+        if entry and entry["version"] == version:
+            return entry["info"]
+
+        # 2. Redis 缓存
+        entry = self._load_from_redis(name)
+        if entry and entry["version"] == version:
+            with self._lock:
+                self._entries[name] = entry
+            return entry["info"]
+
+        # 3. 查询数据库重新生成
+        entry = {"version": version, "info": self.db.get_table_info([name])}
+        with self._lock:
+            self._entries[name] = entry
+        self._save_to_redis(name, entry)
+        return entry["info"]
+
+    def _check_versions(self):
+        """从 information_schema 读取各表的版本号，一次查询覆盖所有表"""
+        if time.time() - self._checked_at < self.check_interval:
+            return
+
+        with self.db._engine.connect() as conn:
+            self._disable_stats_cache(conn)
+            tables = conn.execute(text(
+                "SELECT TABLE_NAME, CREATE_TIME, UPDATE_TIME, TABLE_COMMENT FROM information_schema.TABLES "
+                "WHERE TABLE_SCHEMA = DATABASE()"
+            )).fetchall()
+            columns = conn.execute(text(
+                "SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_KEY, COLUMN_COMMENT "
+                "FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() "
+                "ORDER BY TABLE_NAME, ORDINAL_POSITION"
+            )).fetchall()
+
+        # 列定义的哈希，表结构变化（增删改列、注释）时改变
+        ddl = {}
+        column_docs = {}
+        for row in columns:
+            ddl.setdefault(row[0], []).append("|".join(str(v) for v in row[1:]))
+            column_docs.setdefault(row[0], []).append(f"{row[1]} {row[5] or ''}".strip())
+
+        versions = {}
+        ddl_versions = {}
+        docs = {}
+        for name, create_time, update_time, comment in tables:
+            ddl_hash = hashlib.md5("\n".join(ddl.get(name, [])).encode("utf-8")).hexdigest()
+            versions[name] = f"{create_time}|{update_time}|{ddl_hash}"
+            ddl_versions[name] = f"{create_time}|{ddl_hash}"
+            docs[name] = " ".join([name, comment or ""] + column_docs.get(name, []))
+
+        with self._lock:
+            self._versions = versions
+            self._ddl_versions = ddl_versions
+            self._docs = docs
+            self._checked_at = time.time()
+
+    def _disable_stats_cache(self, conn):
+        """在本会话中关闭 information_schema 统计值的缓存，让 UPDATE_TIME 反映最新的写入"""
+        if not self._stats_expiry:
+            return
+        try:
+            conn.execute(text("SET SESSION information_schema_stats_expiry = 0"))
+        except DBAPIError as e:
+            # MySQL 5.7 / MariaDB 没有这个变量，UPDATE_TIME 本来就不缓存
+            print("无法关闭 information_schema 统计缓存:", e)
+            conn.rollback()
+            self._stats_expiry = False
+
+    def _load_from_redis(self, name):
+        if self.redis is None:
+            return None
+        try:
+            data = self.redis.hget(self.redis_key, name)
+            return json.loads(data) if data else None
+        except redis.RedisError as e:
+            print("读取表结构缓存失败:", e)
+            return None
+
+    def _save_to_redis(self, name, entry):
+        if self.redis is None:
+            return
+        try:
+            pipeline = self.redis.pipeline()
+            pipeline.hset(self.redis_key, name, json.dumps(entry, ensure_ascii=False))
+            pipeline.expire(self.redis_key, self.ttl)
+            pipeline.execute()
+        except redis.RedisError as e:
+            print("写入表结构缓存失败:", e)
+
+
+class CachedListSQLDatabaseTool(ListSQLDatabaseTool):
+    """使用表结构目录回答 sql_db_list_tables"""
+    catalog: Any = Field(exclude=True)
+
+    def _run(self, tool_input: str = "", run_manager=None) -> str:
+        return ", ".join(self.catalog.list_tables())
+
+
+class CachedInfoSQLDatabaseTool(InfoSQLDatabaseTool):
+    """使用表结构目录回答 sql_db_schema"""
+    catalog: Any = Field(exclude=True)
+
+    def _run(self, table_names: str, run_manager=None) -> str:
+        return self.catalog.get_table_info([t.strip() for t in table_names.split(",")])
@@ -0,0 +1,205 @@
+import asyncio
+import hashlib
+import uuid
+
+import orjson
+from fastapi import HTTPException
+
+from src.agentapi.utils.answer_cache import normalize_question
+from src.agentapi.utils.redis_tool import async_redis_client
+
+# 为 True 时通过 Redis 锁和发布/订阅在多个 worker 之间合并相同的请求，否则只在进程内合并
+CROSS_WORKER = False
+
+
+def flight_key(question: str, target: str) -> str:
+    """合并请求的键：规范化后的问题 + 查询的数据库"""
+    return hashlib.sha1(f"{target}|{normalize_question(question)}".encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    合并同时进行的相同请求：同一个键只执行一次，其他请求等待并共享结果（或异常）。
+
+    - 进程内：用字典记录正在执行的任务，重复的请求直接等待该任务
+    - 跨 worker（redis_client 不为 None 时）：抢到 Redis 锁的 worker 执行，
+      执行完成后把结果写入 Redis 并通过发布/订阅通知其他 worker；
+      等待超过 wait_timeout 秒或执行者异常退出（锁过期）时，由等待者自己执行
+    - 结果的键和频道包含执行者的锁令牌（锁的值），每次执行互不相同，
+      等待者不会读到上一次执行还没过期的结果
+    - 执行中的任务与发起请求的连接无关，第一个请求的客户端断开不会影响其他等待者
+    """
+
+    _RELEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, redis_client=None, lock_ttl=180, wait_timeout=150, result_ttl=10, prefix="single_flight:"):
+        self.redis = redis_client
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self.result_ttl = result_ttl
+        self.prefix = prefix
+        self._inflight = {}
+        self.leaders = 0  # 实际执行的次数
+        self.shared = 0  # 在进程内共享结果的次数
+        self.remote_shared = 0  # 共享其他 worker 结果的次数
+
+    async def do(self, key, fn):
+        """
+        执行 fn()，同一个键同时只执行一次
+        :param key: 合并请求的键
+        :param fn: 返回协程的函数，跨 worker 合并时结果必须可以序列化为 JSON
+        :return: fn() 的结果
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self.shared += 1
+        else:
+            task = asyncio.ensure_future(self._run(key, fn))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        # 等待者被取消时不取消执行中的任务
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 所有等待者都已取消时，读取异常避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    async def _run(self, key, fn):
+        if self.redis is None:
+            self.leaders += 1
+            return await fn()
+
+        lock_key = f"{self.prefix}lock:{key}"
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_timeout
+        while True:
+            token = uuid.uuid4().hex
+            try:
+                acquired = await self.redis.set(lock_key, token, nx=True, ex=self.lock_ttl)
+            except Exception as e:
+                print("获取合并请求的锁失败:", e)
+                self.leaders += 1
+                return await fn()
+            if acquired:
+                return await self._lead(fn, lock_key, self._result_key(key, token), token)
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                leader = await self.redis.get(lock_key)
+            except Exception as e:
+                print("读取合并请求的锁失败:", e)
+                break
+            if leader is None:
+                # 锁刚刚释放，重新抢锁
+                continue
+            leader = leader.decode() if isinstance(leader, bytes) else leader
+            found, payload = await self._follow(lock_key, self._result_key(key, leader), leader, remaining)
+            if found:
+                self.remote_shared += 1
+                return self._unpack(payload)
+            if payload == "timeout":
+                break
+            # 锁已经释放但没有拿到结果（执行者异常退出），重新抢锁
+
+        # 等待超时，不再等待其他 worker，自己执行
+        self.leaders += 1
+        return await fn()
+
+    async def _lead(self, fn, lock_key, result_key, token):
+        self.leaders += 1
+        try:
+            try:
+                result = await fn()
+            except HTTPException as e:
+                await self._publish(result_key, {"error": e.detail, "status_code": e.status_code})
+                raise
+            except Exception as e:
+                await self._publish(result_key, {"error": f"处理失败: {str(e)}", "status_code": 500})
+                raise
+            await self._publish(result_key, {"result": result})
+            return result
+        finally:
+            try:
+                await self.redis.eval(self._RELEASE_SCRIPT, 1, lock_key, token)
+            except Exception as e:
+                print("释放合并请求的锁失败:", e)
+
+    async def _publish(self, result_key, payload):
+        """保存结果并通知等待的 worker；结果保留 result_ttl 秒，供订阅前就已完成的等待者读取"""
+        data = orjson.dumps(payload)
+        try:
+            async with self.redis.pipeline(transaction=False) as pipeline:
+                pipeline.set(result_key, data, ex=self.result_ttl)
+                pipeline.publish(result_key, data)
+                await pipeline.execute()
+        except Exception as e:
+            print("发布合并请求的结果失败:", e)
+
+    def _result_key(self, key, token):
+        """一次执行的结果键（同时也是发布结果的频道）"""
+        return f"{self.prefix}result:{key}:{token}"
+
+    async def _follow(self, lock_key, result_key, token, timeout):
+        """
+        等待持有锁令牌 token 的 worker 的结果
+        :return: (True, 结果) 或 (False, "timeout" / "released")
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        pubsub = self.redis.pubsub()
+        try:
+            await pubsub.subscribe(result_key)
+            # 先订阅再读结果，避免在两步之间完成而错过通知
+            data = await self.redis.get(result_key)
+            if data is not None:
+                return True, data
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return False, "timeout"
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=min(remaining, 1.0))
+                if message is not None:
+                    return True, message["data"]
+                # 锁已经释放或被新的执行者持有（执行者异常退出、锁过期）
+                leader = await self.redis.get(lock_key)
+                if (leader.decode() if isinstance(leader, bytes) else leader) != token:
+                    data = await self.redis.get(result_key)
+                    return (True, data) if data is not None else (False, "released")
+        except Exception as e:
+            print("等待合并请求的结果失败:", e)
+            return False, "timeout"
+        finally:
+            try:
+                await pubsub.unsubscribe(result_key)
+                await pubsub.aclose()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _unpack(data):
+        payload = orjson.loads(data)
+        if "error" in payload:
+            raise HTTPException(status_code=payload["status_code"], detail=payload["error"])
+        return payload["result"]
+
+    def stats(self):
+        """返回合并请求的统计"""
+        return {
+            "inflight": len(self._inflight),
+            "leaders": self.leaders,
+            "shared": self.shared,
+            "remote_shared": self.remote_shared
+        }
+
+
+single_flight = SingleFlight(async_redis_client if CROSS_WORKER else None)
@@ -0,0 +1,114 @@
+import math
+import re
+import threading
+
+import numpy as np
+
+from src.agentapi.utils.embedding import embed_texts, embed_query
+
+_CJK = re.compile(r"[\u4e00-\u9fff]+")
+_WORD = re.compile(r"[a-z0-9]+")
+# 问题中常见的疑问词和虚词，分词前替换为空格，不与表描述组成两字词
+STOP_WORDS = ["有没有", "什么", "哪些", "哪个", "多少", "怎么", "如何", "是否", "请问", "一下", "查询", "统计",
+              "的", "了", "吗", "呢", "吧", "啊"]
+
+
+def tokenize(text: str):
+    """
+    分词：去掉 STOP_WORDS 后，中文按单字和相邻两字切分，英文和数字按单词切分（下划线也作为分隔符）
+    """
+    text = text.lower()
+    for word in STOP_WORDS:
+        text = text.replace(word, " ")
+    tokens = set(_WORD.findall(text))
+    for run in _CJK.findall(text):
+        tokens.update(run)
+        tokens.update(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class TableSelector:
+    """
+    根据问题为 SQL 代理预先挑选相关的表，只把这些表的结构放进提示词。
+
+    每张表的描述文本由表名、列名和注释组成（来自 SchemaCatalog.get_table_docs），
+    得分 = lexical_weight * 词法得分 + (1 - lexical_weight) * 向量相似度，两者都归一化到 [0, 1]。
+    向量模型不可用时只使用词法得分。
+
+    单字只参与打分，不决定相关性："是"、"表" 这样的常用字几乎出现在每张表的注释里。
+    只有与问题有共同的两字词或英文单词，或余弦相似度不低于 min_similarity 的表才会被选中，
+    没有表达到要求时返回空列表，由调用方退回包含全部表结构的提示词。
+    """
+
+    def __init__(self, catalog, top_k=4, lexical_weight=0.5, min_similarity=0.6):
+        self.catalog = catalog
+        self.top_k = top_k
+        self.lexical_weight = lexical_weight
+        self.min_similarity = min_similarity
+        # (表描述, 表名列表, 每张表的词, idf, 向量)，重建时整体替换，读取时不需要加锁
+        self._index = ({}, [], {}, {}, None)
+        self._lock = threading.Lock()
+
+    def select(self, question: str, top_k=None):
+        """
+        返回与问题最相关的表名，按得分从高到低排列
+        :param question: 用户问题
+        :param top_k: 返回的表数量，不传时使用默认值
+        """
+        self.refresh()
+        _, names, doc_tokens, idf, vectors = self._index
+        if not names:
+            return []
+
+        lexical, relevant = self._lexical_scores(question, names, doc_tokens, idf)
+        similarity = self._similarity(question, vectors)
+        scores = lexical / lexical.max() if lexical.any() else lexical
+        if similarity is not None:
+            relevant |= similarity >= self.min_similarity
+            # 余弦相似度从 [-1, 1] 映射到 [0, 1]
+            scores = self.lexical_weight * scores + (1 - self.lexical_weight) * (similarity + 1) / 2
+
+        order = [i for i in np.argsort(-scores) if relevant[i]][:top_k or self.top_k]
+        return [names[i] for i in order]
+
+    def refresh(self):
+        """表描述变化时（表结构变化）重建词法索引和向量"""
+        docs = self.catalog.get_table_docs()
+        if docs != self._index[0]:
+            with self._lock:
+                if docs != self._index[0]:
+                    self._index = self._build(docs)
+
+    @staticmethod
+    def _build(docs):
+        names = sorted(docs)
+        doc_tokens = {name: tokenize(docs[name]) for name in names}
+        df = {}
+        for tokens in doc_tokens.values():
+            for t in tokens:
+                df[t] = df.get(t, 0) + 1
+
+        idf = {t: math.log(1 + len(names) / n) for t, n in df.items()}
+        vectors = embed_texts([docs[name] for name in names])
+        return docs, names, doc_tokens, idf, vectors
+
+    @staticmethod
+    def _lexical_scores(question, names, doc_tokens, idf):
+        """
+        :return: (问题与每张表共同的词的 idf 之和（未归一化）, 每张表是否与问题有共同的两字词或英文单词)
+        """
+        q_tokens = tokenize(question)
+        common = [q_tokens & doc_tokens[name] for name in names]
+        scores = np.array([sum(idf[t] for t in tokens) for tokens in common], dtype=np.float32)
+        relevant = np.array([any(len(t) > 1 for t in tokens) for tokens in common], dtype=bool)
+        return scores, relevant
+
+    @staticmethod
+    def _similarity(question, vectors):
+        """问题与每张表的余弦相似度，向量模型不可用时返回 None"""
+        if vectors is None:
+            return None
+        q = embed_query(question)
+        if q is None:
+            return None
+        return vectors @ q
@@ -0,0 +1,4 @@
+import os
+
+# 导入 redis_tool 时会创建 ChatDeepSeek，没有配置 API Key 时无法导入；单元测试不会调用模型
+os.environ.setdefault("DEEPSEEK_API_KEY", "test")
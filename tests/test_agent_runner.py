@@ -0,0 +1,125 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from src.agentapi.utils.agent_runner import AgentRunner
+
+
+class FakeExecutor:
+    """模拟 LangGraph 代理执行器，每次调用耗时 delay 秒"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    async def ainvoke(self, payload):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return {"echo": payload}
+
+    def invoke(self, payload):
+        self.calls += 1
+        time.sleep(self.delay)
+        return {"echo": payload, "sync": True}
+
+
+def test_run_returns_result():
+    runner = AgentRunner(max_concurrency=2, max_queue=2, timeout=5)
+    result = asyncio.run(runner.run(FakeExecutor(), "问题"))
+    assert result == {"echo": "问题"}
+    assert runner.stats() == {"max_concurrency": 2, "max_queue": 2, "running": 0, "waiting": 0}
+
+
+def test_thread_pool_mode_uses_invoke():
+    runner = AgentRunner(max_concurrency=1, max_queue=0, timeout=5, use_thread_pool=True)
+    try:
+        assert asyncio.run(runner.run(FakeExecutor(), "问题")) == {"echo": "问题", "sync": True}
+    finally:
+        runner.close()
+
+
+def test_concurrency_is_bounded():
+    runner = AgentRunner(max_concurrency=2, max_queue=10, timeout=5)
+    peak = 0
+
+    class Tracking(FakeExecutor):
+        async def ainvoke(self, payload):
+            nonlocal peak
+            peak = max(peak, runner.stats()["running"])
+            return await super().ainvoke(payload)
+
+    async def main():
+        executor = Tracking(delay=0.02)
+        await asyncio.gather(*(runner.run(executor, i) for i in range(6)))
+        return executor.calls
+
+    assert asyncio.run(main()) == 6
+    assert peak == 2
+
+
+def test_full_queue_is_rejected_with_503():
+    runner = AgentRunner(max_concurrency=1, max_queue=1, timeout=5)
+
+    async def main():
+        executor = FakeExecutor(delay=0.1)
+        running = [asyncio.ensure_future(runner.run(executor, i)) for i in range(2)]
+        await asyncio.sleep(0.01)
+        assert runner.stats()["running"] == 1 and runner.stats()["waiting"] == 1
+        with pytest.raises(HTTPException) as excinfo:
+            await runner.run(executor, "多出来的请求")
+        await asyncio.gather(*running)
+        return excinfo.value, executor.calls
+
+    error, calls = asyncio.run(main())
+    assert error.status_code == 503
+    # 被拒绝的请求没有调用代理
+    assert calls == 2
+    assert runner.stats()["waiting"] == 0
+
+
+def test_queue_timeout_returns_504():
+    runner = AgentRunner(max_concurrency=1, max_queue=5, timeout=5)
+
+    async def main():
+        first = asyncio.ensure_future(runner.run(FakeExecutor(delay=0.2), 1))
+        await asyncio.sleep(0.01)
+        with pytest.raises(HTTPException) as excinfo:
+            await runner.run(FakeExecutor(), 2, timeout=0.05)
+        await first
+        return excinfo.value
+
+    error = asyncio.run(main())
+    assert (error.status_code, error.detail) == (504, "代理排队超时")
+    assert runner.stats()["running"] == 0 and runner.stats()["waiting"] == 0
+
+
+def test_execution_timeout_returns_504_and_releases_slot():
+    runner = AgentRunner(max_concurrency=1, max_queue=0, timeout=5)
+
+    async def main():
+        with pytest.raises(HTTPException) as excinfo:
+            await runner.run(FakeExecutor(delay=1), "慢查询", timeout=0.05)
+        # 名额已经归还，下一个请求可以立即执行
+        return excinfo.value, await runner.run(FakeExecutor(), "下一个")
+
+    error, result = asyncio.run(main())
+    assert (error.status_code, error.detail) == (504, "代理执行超时")
+    assert result == {"echo": "下一个"}
+    assert runner.stats()["running"] == 0
+
+
+def test_timeout_includes_queue_time():
+    runner = AgentRunner(max_concurrency=1, max_queue=5, timeout=5)
+
+    async def main():
+        first = asyncio.ensure_future(runner.run(FakeExecutor(delay=0.1), 1))
+        await asyncio.sleep(0.01)
+        # 排队约 0.09 秒后只剩约 0.06 秒执行，0.1 秒的调用会超时
+        with pytest.raises(HTTPException) as excinfo:
+            await runner.run(FakeExecutor(delay=0.1), 2, timeout=0.15)
+        await first
+        return excinfo.value
+
+    assert asyncio.run(main()).detail == "代理执行超时"
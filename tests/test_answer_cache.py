@@ -0,0 +1,135 @@
+import threading
+
+import fakeredis
+import numpy as np
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from src.agentapi.utils import answer_cache as answer_cache_module
+from src.agentapi.utils.answer_cache import AnswerCache, extract_tables, is_answered, question_literals
+
+
+class FakeCatalog:
+    def __init__(self):
+        self.versions = {"orders": "v1", "dishes": "v1"}
+
+    def table_versions(self, tables):
+        return {name: self.versions.get(name) for name in tables}
+
+
+@pytest.fixture(autouse=True)
+def same_vector(monkeypatch):
+    # 所有问题的向量都相同，语义匹配只由字面量决定
+    monkeypatch.setattr(answer_cache_module, "embed_query", lambda text: np.array([1, 0], dtype=np.float32))
+
+
+def agent_messages(sql_result="[(100,)]", answer="订单总额为 100 元"):
+    call = {"name": "sql_db_query", "args": {"query": "SELECT SUM(total) FROM orders"}, "id": "call-1"}
+    return [
+        HumanMessage(content="今天订单总额"),
+        AIMessage(content="", tool_calls=[call]),
+        ToolMessage(content=sql_result, tool_call_id="call-1", name="sql_db_query"),
+        AIMessage(content=answer),
+    ]
+
+
+def test_question_literals():
+    assert question_literals("今天订单总额") == ([], ["今天"])
+    assert question_literals("最近7天的订单") == ([7], ["最近7天"])
+    assert question_literals("今天订单总额") != question_literals("昨天订单总额")
+
+
+def test_extract_tables():
+    assert extract_tables("SELECT * FROM orders o JOIN `dishes` d ON o.dish_id = d.id") == {"orders", "dishes"}
+    assert extract_tables("select 1 from shop.orders") == {"orders"}
+
+
+def test_is_answered():
+    assert is_answered(agent_messages())
+    assert not is_answered(agent_messages(sql_result="Error: (1054, \"Unknown column 'x'\")"))
+    assert not is_answered(agent_messages(answer=""))
+    # 没有执行过查询
+    assert not is_answered([HumanMessage(content="你好"), AIMessage(content="你好")])
+    # 达到步数上限时最后一条消息仍然是工具调用
+    assert not is_answered(agent_messages()[:2])
+    assert not is_answered([])
+
+
+def test_exact_hit():
+    cache = AnswerCache(catalog=FakeCatalog(), semantic=False)
+    assert cache.get("今天订单总额？") is None
+    cache.set("今天订单总额", "100 元", {"orders"})
+    assert cache.get("今天 订单总额？")["answer"] == "100 元"
+    assert cache.stats() == {"size": 1, "hits_exact": 1, "hits_semantic": 0, "misses": 1, "hit_rate": 0.5}
+
+
+def test_empty_answer_is_not_cached():
+    cache = AnswerCache(semantic=False)
+    cache.set("今天订单总额", "", {"orders"})
+    cache.set("今天订单总额", "   ", {"orders"})
+    assert cache.get("今天订单总额") is None
+
+
+def test_semantic_hit_requires_same_literals():
+    cache = AnswerCache(catalog=FakeCatalog())
+    cache.set("今天的订单总额是多少", "100 元", {"orders"})
+    assert cache.get("今天订单总额为多少")["answer"] == "100 元"
+    assert cache.get("昨天的订单总额是多少") is None
+    assert cache.get("最近7天的订单总额是多少") is None
+    assert cache.stats()["hits_semantic"] == 1
+
+
+def test_table_version_change_invalidates():
+    catalog = FakeCatalog()
+    cache = AnswerCache(catalog=catalog, semantic=False)
+    cache.set("今天订单总额", "100 元", {"orders"})
+    catalog.versions["dishes"] = "v2"
+    assert cache.get("今天订单总额") is not None
+    catalog.versions["orders"] = "v2"
+    assert cache.get("今天订单总额") is None
+
+
+def test_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache_module.time, "time", lambda: now[0])
+    cache = AnswerCache(ttl=10, semantic=False)
+    cache.set("今天订单总额", "100 元", {"orders"})
+    now[0] += 11
+    assert cache.get("今天订单总额") is None
+
+
+def test_redis_is_shared_and_invalidate_table():
+    redis_client = fakeredis.FakeRedis()
+    AnswerCache(redis_client, semantic=False).set("今天订单总额", "100 元", {"orders"})
+    other = AnswerCache(redis_client, semantic=False)
+    assert other.get("今天订单总额")["answer"] == "100 元"
+
+    other.invalidate_table("orders")
+    assert other.get("今天订单总额") is None
+    assert AnswerCache(redis_client, semantic=False).get("今天订单总额") is None
+
+
+def test_lru_eviction():
+    cache = AnswerCache(maxsize=2, semantic=False)
+    for i in range(3):
+        cache.set(f"问题{i}", f"答案{i}", {"orders"})
+    assert cache.get("问题0") is None
+    assert cache.get("问题2")["answer"] == "答案2"
+
+
+def test_counters_are_thread_safe():
+    cache = AnswerCache(semantic=False)
+    cache.set("今天订单总额", "100 元", {"orders"})
+
+    def worker():
+        for _ in range(500):
+            cache.get("今天订单总额")
+            cache.get("不存在的问题")
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = cache.stats()
+    assert stats["hits_exact"] == 4000 and stats["misses"] == 4000
@@ -0,0 +1,60 @@
+import itertools
+import time
+
+import pytest
+
+from src.agentapi.utils import login_utils
+from src.agentapi.utils.login_utils import CaptchaPool, render_captcha
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def counter(monkeypatch):
+    counter = itertools.count()
+    monkeypatch.setattr(login_utils, "render_captcha", lambda: (f"C{next(counter):03d}", b"png"))
+    return counter
+
+
+def test_render_captcha():
+    code, png = render_captcha()
+    assert len(code) == 4 and code.isalnum()
+    assert png.startswith(b"\x89PNG")
+
+
+def test_pool_fills_in_background(counter):
+    pool = CaptchaPool(size=10, low_water=3)
+    pool.start()
+    wait_for(lambda: len(pool) == 10)
+    assert pool.get() == ("C000", b"png")
+
+
+def test_pool_refills_below_low_water(counter):
+    pool = CaptchaPool(size=10, low_water=3)
+    pool.start()
+    wait_for(lambda: len(pool) == 10)
+    for _ in range(8):
+        pool.get()
+    wait_for(lambda: len(pool) == 10)
+
+
+def test_empty_pool_renders_inline(counter):
+    pool = CaptchaPool(size=0, low_water=0)
+    # 池子始终为空，每次都现场生成
+    assert [pool.get()[0] for _ in range(3)] == ["C000", "C001", "C002"]
+
+
+def test_is_running_does_not_depend_on_pool_size(counter):
+    pool = CaptchaPool(size=1, low_water=0)
+    assert not pool.is_running()
+    pool.start()
+    assert pool.is_running()
+    wait_for(lambda: len(pool) == 1)
+    pool.get()
+    # 池子被取空时仍然可用（现场生成）
+    assert pool.is_running()
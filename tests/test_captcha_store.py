@@ -0,0 +1,145 @@
+import time
+
+import fakeredis
+import pytest
+
+from src.agentapi.utils.captcha_store import MySQLCaptchaStore, RedisCaptchaStore
+
+
+def test_redis_create_and_consume():
+    store = RedisCaptchaStore(fakeredis.FakeRedis(), ttl=60)
+    first, second = store.create("AB12"), store.create("CD34")
+    assert second == first + 1
+    # 不区分大小写，只能使用一次
+    assert store.consume(first, "ab12")
+    assert not store.consume(first, "AB12")
+    assert store.consume(second, "CD34")
+
+
+def test_redis_wrong_code_burns_captcha():
+    store = RedisCaptchaStore(fakeredis.FakeRedis(), ttl=60)
+    captcha_id = store.create("AB12")
+    assert not store.consume(captcha_id, "XXXX")
+    assert not store.consume(captcha_id, "AB12")
+
+
+def test_redis_ttl():
+    client = fakeredis.FakeRedis()
+    store = RedisCaptchaStore(client, ttl=60)
+    captcha_id = store.create("AB12")
+    assert 0 < client.ttl(f"captcha:{captcha_id}") <= 60
+    client.delete(f"captcha:{captcha_id}")  # 过期
+    assert not store.consume(captcha_id, "AB12")
+    assert not store.consume(9999, "AB12")
+
+
+class FakeCursor:
+    def __init__(self, pool):
+        self.pool = pool
+        self.lastrowid = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, args):
+        assert sql.startswith("INSERT INTO captchas")
+        self.lastrowid = self.pool.insert(args[0])
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def cursor(self):
+        return FakeCursor(self.pool)
+
+    def commit(self):
+        pass
+
+
+class FakePool:
+    """模拟 MySQLPool 和 captchas 表：id -> [code, used, created_at]"""
+
+    def __init__(self):
+        self.rows = {}
+        self.deletes = 0
+
+    def insert(self, code):
+        captcha_id = len(self.rows) + 1
+        self.rows[captcha_id] = [code, False, time.time()]
+        return captcha_id
+
+    def get_conn(self):
+        return FakeConnection(self)
+
+    def execute_update(self, sql, args):
+        sql = " ".join(sql.split())
+        if sql.startswith("UPDATE captchas SET used = TRUE"):
+            captcha_id, code, ttl = args
+            row = self.rows.get(captcha_id)
+            # utf8_general_ci 不区分大小写
+            if row and row[0].upper() == code.upper() and not row[1] and row[2] >= time.time() - ttl:
+                row[1] = True
+                return 1
+            return 0
+        if sql.startswith("DELETE FROM captchas"):
+            ttl, limit = args
+            self.deletes += 1
+            expired = [i for i, row in self.rows.items() if row[2] < time.time() - ttl][:limit]
+            for i in expired:
+                del self.rows[i]
+            return len(expired)
+        raise AssertionError(sql)
+
+
+def test_mysql_create_and_consume():
+    store = MySQLCaptchaStore(FakePool(), ttl=60)
+    captcha_id = store.create("AB12")
+    assert not store.consume(captcha_id, "XXXX")
+    assert store.consume(captcha_id, "AB12")
+    assert not store.consume(captcha_id, "AB12")
+
+
+def test_mysql_expired_captcha_is_rejected_and_purged_in_batches():
+    pool = FakePool()
+    store = MySQLCaptchaStore(pool, ttl=60, purge_batch=2)
+    ids = [store.create(f"C{i:03d}") for i in range(5)]
+    for row in pool.rows.values():
+        row[2] -= 120
+    assert not store.consume(ids[0], "C000")
+
+    pool.deletes = 0
+    assert store.purge_expired() == 5
+    # 每批 2 条，最后一批不足 2 条时结束
+    assert pool.deletes == 3
+    assert pool.rows == {}
+
+
+def test_mysql_purge_runs_at_most_once_per_interval():
+    pool = FakePool()
+    store = MySQLCaptchaStore(pool, ttl=60, purge_interval=3600)
+    store.create("AB12")
+    store.create("CD34")
+    assert pool.deletes == 1
+
+
+def test_mysql_purge_failure_does_not_break_create():
+    pool = FakePool()
+
+    def broken(sql, args):
+        raise RuntimeError("连接断开")
+
+    store = MySQLCaptchaStore(pool, ttl=60)
+    pool.execute_update = broken
+    assert store.create("AB12") == 1
+    with pytest.raises(RuntimeError):
+        store.consume(1, "AB12")
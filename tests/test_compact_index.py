@@ -0,0 +1,142 @@
+import os
+import shutil
+import threading
+
+import numpy as np
+import pytest
+
+from src.agentapi.utils.compact_index import CompactStore, QuantizedVectors, top_k
+
+
+def _vectors(n=50, dim=32):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("mode, dtype, tolerance", [("int8", np.int8, 0.02), ("float16", np.float16, 1e-3),
+                                                     ("float32", np.float32, 1e-6)])
+def test_scores_match_float32(mode, dtype, tolerance):
+    vectors = _vectors()
+    quantized = QuantizedVectors.quantize(vectors, mode)
+    assert quantized.data.dtype == dtype
+    query = vectors[3]
+    np.testing.assert_allclose(quantized.scores(query, block_size=7), vectors @ query, atol=tolerance)
+
+
+def test_int8_is_smaller():
+    vectors = _vectors()
+    assert QuantizedVectors.quantize(vectors, "int8").nbytes < vectors.nbytes / 3
+
+
+def test_zero_vector():
+    quantized = QuantizedVectors.quantize(np.zeros((2, 4)), "int8")
+    np.testing.assert_array_equal(quantized.scores(np.ones(4)), [0, 0])
+
+
+def test_save_load(tmp_path):
+    vectors = _vectors()
+    for mode in ("int8", "float16"):
+        path = tmp_path / f"{mode}.npz"
+        QuantizedVectors.quantize(vectors, mode).save(path)
+        loaded = QuantizedVectors.load(path)
+        np.testing.assert_array_equal(loaded.scores(vectors[0]), QuantizedVectors.quantize(vectors, mode).scores(vectors[0]))
+
+
+def test_top_k():
+    scores = np.array([0.1, 0.9, 0.5, 0.7], dtype=np.float32)
+    assert top_k(scores, 2).tolist() == [1, 3]
+    assert top_k(scores, 10).tolist() == [1, 3, 2, 0]
+    assert top_k(scores, 0).tolist() == []
+    assert top_k(np.empty(0, dtype=np.float32), 3).tolist() == []
+
+
+class FakeChroma:
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def get(self, include=None):
+        n = len(self.vectors)
+        return {"ids": [f"id{i}" for i in range(n)], "documents": [f"片段{i}" for i in range(n)],
+                "metadatas": [{"source": f"{i}.docx"} for i in range(n)], "embeddings": self.vectors.tolist()}
+
+
+class FakeIndex:
+    def __init__(self, persist_dir, vectors):
+        self.persist_dir = str(persist_dir)
+        self.store = FakeChroma(vectors)
+        self.version = (1, 10)
+        self.builds = 0
+
+    def open(self):
+        self.builds += 1
+        return self.store
+
+    def synced_version(self):
+        return self.version
+
+
+def _versions(store):
+    return sorted(name for name in os.listdir(store.directory) if name.startswith("v"))
+
+
+def test_rebuild_switches_pointer_and_removes_older_versions(tmp_path):
+    index = FakeIndex(tmp_path, _vectors(10, 8))
+    store = CompactStore(index, "int8")
+    first = store.rebuild()
+    assert first.meta["synced_version"] == [1, 10]
+    assert first.search_by_vector(_vectors(10, 8)[4], _vectors(10, 8)[4], k=1)[0][0] == 4
+
+    # 另一个进程正在构建的更新版本不能删除
+    newer = os.path.join(store.directory, "v99999999999999999999.tmp")
+    os.makedirs(newer)
+    second = store.rebuild(force=True)
+    assert _versions(store) == [os.path.basename(second.directory), os.path.basename(newer)]
+
+
+def test_rebuild_reuses_version_built_by_another_worker(tmp_path):
+    index = FakeIndex(tmp_path, _vectors(10, 8))
+    CompactStore(index, "int8").rebuild()
+    other = CompactStore(index, "int8")
+    # 等锁期间其他 worker 已经构建了相同导入版本的索引，直接使用
+    assert other.rebuild().meta["synced_version"] == [1, 10]
+    assert index.builds == 1
+
+    index.version = (2, 10)
+    assert other.rebuild().meta["synced_version"] == [2, 10]
+    assert index.builds == 2
+
+
+def test_missing_version_dir_falls_back_to_rebuild(tmp_path):
+    index = FakeIndex(tmp_path, _vectors(10, 8))
+    built = CompactStore(index, "int8").rebuild()
+    shutil.rmtree(built.directory)
+
+    store = CompactStore(index, "int8")
+    compact = store.get()
+    assert compact.directory != built.directory
+    assert compact.meta["count"] == 10
+    assert index.builds == 2
+
+
+def test_concurrent_rebuilds_leave_a_loadable_pointer(tmp_path):
+    index = FakeIndex(tmp_path, _vectors(10, 8))
+    stores = [CompactStore(index, "int8") for _ in range(4)]
+    errors = []
+
+    def rebuild(store):
+        try:
+            for _ in range(3):
+                store.rebuild(force=True)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=rebuild, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    # 只剩 current.json 指向的最新版本，每个 worker 都能重新加载
+    current = CompactStore(index, "int8")._load()
+    assert _versions(stores[0]) == [os.path.basename(current.directory)]
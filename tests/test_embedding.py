@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from src.agentapi.utils import embedding
+from src.agentapi.utils.embedding import EmbeddingService
+
+
+class FakeModel:
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=True):
+        self.encoded.extend(texts)
+        return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def loader(monkeypatch):
+    """替换模型加载，记录加载次数；results 依次作为每次加载的结果"""
+    monkeypatch.setattr(embedding, "_models", {})
+    monkeypatch.setattr(embedding, "_loaded", {})
+    monkeypatch.setattr(embedding, "_retry_at", {})
+    calls = []
+    results = []
+
+    def load(model_name, backend, model_file):
+        calls.append((model_name, backend, model_file))
+        return results.pop(0) if results else (FakeModel(), backend, model_file)
+
+    monkeypatch.setattr(embedding, "_load_model", load)
+    load.calls = calls
+    load.results = results
+    return load
+
+
+def test_cache_path_is_under_data_dir():
+    assert embedding.EMBEDDING_CACHE_PATH.startswith(embedding.DATA_DIR)
+    assert not embedding.EMBEDDING_CACHE_PATH.startswith("D:")
+
+
+def test_cache_hit_does_not_load_model(loader, tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    first = EmbeddingService("model", cache_path=path)
+    vectors = first.embed_documents(["你好", "销量"])
+    assert vectors.tolist() == [[2.0, 1.0], [2.0, 1.0]]
+    assert len(loader.calls) == 1
+
+    # 另一个进程（新的模型状态）只查磁盘缓存，不需要加载模型
+    embedding._models.clear()
+    embedding._loaded.clear()
+    second = EmbeddingService("model", cache_path=path)
+    assert second.embed_documents(["销量"]).tolist() == [[2.0, 1.0]]
+    assert second.stats()["disk_hits"] == 1
+    assert len(loader.calls) == 1
+
+
+def test_failed_load_is_retried_after_interval(loader, monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(embedding.time, "monotonic", clock)
+    loader.results.append((False, "torch", None))
+
+    assert embedding.get_embedding_model("model") is None
+    assert embedding.get_embedding_model("model") is None
+    assert len(loader.calls) == 1
+
+    clock.now += embedding.EMBEDDING_RETRY_INTERVAL
+    assert isinstance(embedding.get_embedding_model("model"), FakeModel)
+    assert len(loader.calls) == 2
+
+
+def test_backend_fallback_changes_key_after_load(loader, tmp_path):
+    loader.results.append((FakeModel(), "torch", None))
+    service = EmbeddingService("model", backend="onnx", cache_path=str(tmp_path / "cache.sqlite3"),
+                               model_file="onnx/model.onnx")
+    assert service.model_key == "model#onnx#onnx/model.onnx"
+    # 编码过程中退回 torch，缓存键随之变化，结果仍按原来的顺序返回
+    assert service.embed_documents(["a", "abc"]).tolist() == [[1.0, 1.0], [3.0, 1.0]]
+    assert service.model_key == "model"
@@ -0,0 +1,108 @@
+import threading
+
+from langchain_core.documents import Document
+
+from src.agentapi.utils.hybrid_retriever import (BM25Index, HybridRetriever, ManifestLexicalIndex, tokenize,
+                                                  tokenize_query)
+
+DOCS = [
+    Document(page_content="宫保鸡丁 价格 38 元", metadata={"source": "menu.docx"}),
+    Document(page_content="营业时间 每天 10 点到 22 点", metadata={"source": "info.docx"}),
+    Document(page_content="鱼香肉丝 价格 32 元", metadata={"source": "menu.docx"}),
+]
+
+
+def test_tokenize():
+    assert tokenize("WiFi密码") == ["wifi", "密", "码", "密码"]
+    assert tokenize_query("宫保鸡丁多少钱") == tokenize("宫保鸡丁")
+
+
+def test_bm25_search():
+    results = BM25Index(DOCS).search("宫保鸡丁多少钱")
+    assert results[0][0] is DOCS[0]
+    assert results[0][2] == 1.0
+    assert all(doc is not DOCS[1] for doc, _, _ in results)
+
+
+def test_bm25_empty():
+    assert BM25Index([]).search("宫保鸡丁") == []
+    assert BM25Index(DOCS).search("多少钱") == []
+    # 片段全部为空时平均长度为 0，不能除零
+    assert BM25Index([Document(page_content="")]).search("宫保鸡丁") == []
+
+
+def test_fuse():
+    retriever = HybridRetriever(vector_store=None, lexical_source=lambda: BM25Index(DOCS), rrf_k=60)
+    same_as_first = Document(page_content=DOCS[0].page_content, metadata=dict(DOCS[0].metadata))
+    fused = retriever.fuse([[DOCS[1], DOCS[0]], [same_as_first, DOCS[2]]])
+    # DOCS[0] 在两路中都出现，排在最前；相同来源和内容的片段只保留一个
+    assert fused == [DOCS[0], DOCS[1], DOCS[2]]
+    assert fused[0] is DOCS[0]
+
+
+def test_fast_path():
+    retriever = HybridRetriever(vector_store=None, lexical_source=lambda: BM25Index(DOCS), k=1)
+    assert retriever.invoke("宫保鸡丁") == [DOCS[0]]
+    assert retriever.stats == {"fast_path": 1, "hybrid": 0}
+
+
+class FakeVectorStore:
+    def __init__(self, results):
+        self.results = results
+        self.queries = []
+
+    def similarity_search(self, query, k=4):
+        self.queries.append(query)
+        return self.results[:k]
+
+
+def test_hybrid_path_fuses_lexical_and_dense():
+    # "价格" 同时出现在两道菜中，BM25 没有把握，走向量检索并融合
+    store = FakeVectorStore([DOCS[2], DOCS[1]])
+    retriever = HybridRetriever(vector_store=store, lexical_source=lambda: BM25Index(DOCS), k=2)
+    assert retriever.invoke("价格") == [DOCS[2], DOCS[0]]
+    assert store.queries == ["价格"]
+    assert retriever.stats == {"fast_path": 0, "hybrid": 1}
+
+
+class FakeChroma:
+    def __init__(self, docs):
+        self.docs = docs
+        self.reads = 0
+
+    def get(self, include=None):
+        self.reads += 1
+        return {"documents": [doc.page_content for doc in self.docs],
+                "metadatas": [doc.metadata for doc in self.docs]}
+
+
+class FakeIndex:
+    def __init__(self, store):
+        self.store = store
+        self.version = (1, 10)
+
+    def open(self):
+        return self.store
+
+    def synced_version(self):
+        return self.version
+
+
+def test_lexical_index_rebuilds_in_background_after_sync(monkeypatch):
+    store = FakeChroma(DOCS[:1])
+    index = FakeIndex(store)
+    lexical = ManifestLexicalIndex(index)
+    first = lexical.get()
+    assert lexical.get() is first and store.reads == 1
+
+    threads = []
+    start = threading.Thread.start
+    monkeypatch.setattr(threading.Thread, "start", lambda self: (threads.append(self), start(self)))
+    store.docs = DOCS
+    index.version = (2, 10)
+    # 重建完成前继续返回旧的索引
+    assert lexical.get() is first
+    threads[0].join()
+    rebuilt = lexical.get()
+    assert rebuilt is not first and len(rebuilt.documents) == 3
+    assert lexical.get() is rebuilt and store.reads == 2
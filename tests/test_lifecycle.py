@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+
+from src.agentapi.utils import lifecycle
+from src.agentapi.utils.lifecycle import Lazy, is_created, readiness, register_warmer, warm_up
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    # 每个测试使用独立的子系统注册表，不影响应用模块导入时注册的子系统
+    monkeypatch.setattr(lifecycle, "_subsystems", {})
+    monkeypatch.setattr(lifecycle, "_warmers", {})
+    monkeypatch.setattr(lifecycle, "_warm_status", {})
+
+
+class Service:
+    def __init__(self):
+        self.value = 42
+
+    def get(self):
+        return "service.get"
+
+
+def test_lazy_creates_on_first_use():
+    created = []
+
+    def factory():
+        created.append(1)
+        return Service()
+
+    lazy = Lazy("service", factory)
+    assert not is_created(lazy) and created == []
+    assert lazy._status()["state"] == "pending"
+    # 与被代理对象同名的方法不会被 Lazy 自身的方法遮住
+    assert lazy.get() == "service.get"
+    assert lazy.value == 42
+    assert is_created(lazy) and created == [1]
+    assert lazy._status()["state"] == "ready"
+
+
+def test_lazy_failure_is_retried():
+    attempts = []
+
+    def factory():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError("数据库不可用")
+        return Service()
+
+    lazy = Lazy("db", factory)
+    with pytest.raises(ConnectionError):
+        lazy.value
+    assert lazy._status()["state"] == "failed"
+    assert lazy._status()["error"] == "数据库不可用"
+    assert lazy.value == 42
+    assert lazy._status() == {"state": "ready", "seconds": lazy._status()["seconds"], "error": None}
+
+
+def test_warm_up_and_readiness():
+    lazy = Lazy("db", Service)
+    loaded = []
+
+    async def create_pool():
+        loaded.append("pool")
+
+    register_warmer("pool", create_pool, lambda: "pool" in loaded)
+    register_warmer("model", lambda: loaded.append("model"), lambda: "model" in loaded)
+
+    is_ready, subsystems = readiness()
+    assert not is_ready
+    assert subsystems["db"]["state"] == "pending" and subsystems["pool"]["state"] == "pending"
+
+    asyncio.run(warm_up())
+    assert is_created(lazy)
+    is_ready, subsystems = readiness()
+    assert is_ready
+    assert {name: s["state"] for name, s in subsystems.items()} == {"db": "ready", "pool": "ready", "model": "ready"}
+
+
+def test_warmer_that_does_not_become_ready_fails():
+    register_warmer("model", lambda: None, lambda: False)
+    asyncio.run(warm_up())
+    is_ready, subsystems = readiness()
+    assert not is_ready
+    assert subsystems["model"]["state"] == "failed"
+    assert subsystems["model"]["error"] == "预热已完成，但就绪检查没有通过"
+
+
+def test_warmer_exception_and_later_recovery():
+    state = {"loaded": False}
+
+    def warm():
+        raise OSError("模型文件不存在")
+
+    register_warmer("model", warm, lambda: state["loaded"])
+    asyncio.run(warm_up())
+    assert readiness()[1]["model"]["error"] == "模型文件不存在"
+    # 之后在请求中加载成功，以实际状态为准
+    state["loaded"] = True
+    is_ready, subsystems = readiness()
+    assert is_ready and subsystems["model"]["state"] == "ready"
+
+
+def test_optional_warmer_does_not_gate_readiness():
+    register_warmer("embedding", lambda: None, lambda: False, optional=True)
+    register_warmer("captcha_pool", lambda: None, lambda: True)
+    asyncio.run(warm_up())
+    is_ready, subsystems = readiness()
+    assert is_ready
+    assert subsystems["embedding"]["state"] == "failed" and subsystems["embedding"]["optional"]
+
+
+def test_ready_subsystem_that_stops_is_shown_as_warming():
+    state = {"alive": True}
+    register_warmer("captcha_pool", lambda: None, lambda: state["alive"])
+    asyncio.run(warm_up())
+    state["alive"] = False
+    is_ready, subsystems = readiness()
+    assert not is_ready and subsystems["captcha_pool"]["state"] == "warming"
+
+
+def test_warm_up_only_selected():
+    Lazy("db", Service)
+    register_warmer("model", lambda: None, lambda: True)
+    asyncio.run(warm_up(names={"model"}))
+    assert readiness()[1]["db"]["state"] == "pending"
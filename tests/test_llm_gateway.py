@@ -0,0 +1,170 @@
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+from src.agentapi.utils import llm_gateway
+from src.agentapi.utils.llm_gateway import TokenBucket
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(llm_gateway.time, "monotonic", clock)
+    return clock
+
+
+def test_burst_is_free(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+
+
+def test_waits_queue_up_after_burst(clock):
+    bucket = TokenBucket(rate=2, burst=1)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(0.5)
+    assert bucket.reserve() == pytest.approx(1.0)
+
+
+def test_refills_up_to_burst(clock):
+    bucket = TokenBucket(rate=2, burst=2)
+    bucket.reserve()
+    bucket.reserve()
+    clock.now += 10
+    # 闲置很久也最多攒 burst 个令牌
+    assert [bucket.reserve() for _ in range(2)] == [0.0, 0.0]
+    assert bucket.reserve() == pytest.approx(0.5)
+
+
+def _profile(**kwargs):
+    settings = {"rate": 1000, "burst": 1000, "max_in_flight": 1, "queue_timeout": 5, "max_retries": 2,
+                "timeout": 5, "backoff_base": 0}
+    settings.update(kwargs)
+    return llm_gateway._Profile("test", **settings)
+
+
+def test_slots_are_granted_in_arrival_order():
+    slots = llm_gateway._FairSlots(1)
+    assert slots.acquire(timeout=0)
+    order = []
+
+    async def main():
+        async def waiter(name):
+            assert await slots.acquire_async(timeout=5)
+            order.append(name)
+            slots.release()
+
+        first = asyncio.create_task(waiter("async-1"))
+        await asyncio.sleep(0)
+        # 同步线程在异步协程之后排队，不能插队
+        thread = threading.Thread(target=lambda: (slots.acquire(timeout=5), order.append("sync"), slots.release()))
+        thread.start()
+        while len(slots._waiters) < 2:
+            await asyncio.sleep(0.001)
+        second = asyncio.create_task(waiter("async-2"))
+        await asyncio.sleep(0)
+        slots.release()
+        await asyncio.gather(first, second)
+        await asyncio.to_thread(thread.join)
+
+    asyncio.run(main())
+    assert order == ["async-1", "sync", "async-2"]
+    assert slots._free == 1
+
+
+def test_slot_timeout_and_cancel_leave_no_leak():
+    slots = llm_gateway._FairSlots(1)
+    assert slots.acquire(timeout=0)
+    assert not slots.acquire(timeout=0.01)
+
+    async def main():
+        assert not await slots.acquire_async(timeout=0.01)
+        task = asyncio.create_task(slots.acquire_async(timeout=5))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert not slots._waiters
+    slots.release()
+    assert slots._free == 1
+    with pytest.raises(ValueError):
+        slots.release()
+
+
+def test_async_queue_timeout_raises_pool_timeout():
+    profile = _profile(queue_timeout=0.01, max_retries=0)
+    transport = llm_gateway._AsyncGatewayTransport(httpx.MockTransport(lambda request: httpx.Response(200)), profile)
+    assert profile.slots.acquire(timeout=0)
+
+    async def main():
+        async with httpx.AsyncClient(transport=transport) as client:
+            await client.get("https://llm.test/")
+
+    with pytest.raises(httpx.PoolTimeout):
+        asyncio.run(main())
+    assert profile.stats()["failures"] == 1
+
+
+def _call_sync(statuses, **kwargs):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(statuses[min(len(calls), len(statuses)) - 1])
+
+    profile = _profile(**kwargs)
+    transport = llm_gateway._SyncGatewayTransport(httpx.MockTransport(handler), profile)
+    with httpx.Client(transport=transport) as client:
+        response = client.get("https://llm.test/")
+    return response, calls, profile
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_rejected_requests_are_retried(status):
+    response, calls, profile = _call_sync([status, 200])
+    assert response.status_code == 200
+    assert len(calls) == 2
+    assert profile.stats()["retries"] == 1
+
+
+@pytest.mark.parametrize("status", [500, 502, 504])
+def test_server_errors_are_not_retried(status):
+    # 请求可能已经被上游处理，重试会重复计费
+    response, calls, profile = _call_sync([status, 200])
+    assert response.status_code == status
+    assert len(calls) == 1
+    assert profile.stats()["failures"] == 1
+
+
+def test_async_retry_releases_slot_between_attempts():
+    statuses = [429, 200]
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        return httpx.Response(statuses[len(calls) - 1])
+
+    profile = _profile()
+    transport = llm_gateway._AsyncGatewayTransport(httpx.MockTransport(handler), profile)
+
+    async def main():
+        async with httpx.AsyncClient(transport=transport) as client:
+            response = await client.get("https://llm.test/")
+            await response.aread()
+            return response
+
+    assert asyncio.run(main()).status_code == 200
+    assert len(calls) == 2
+    assert profile.stats()["in_flight"] == 0
+    assert profile.slots._free == 1
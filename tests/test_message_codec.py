@@ -0,0 +1,58 @@
+import json
+
+import fakeredis
+import pytest
+
+from src.agentapi.utils.message_codec import VERSION, decode_message, encode_message, is_legacy
+from src.agentapi.utils.migrate_chat_encoding import migrate_session
+
+
+def test_round_trip():
+    data = encode_message("ai", "你好，world", 1700000000.5)
+    assert not is_legacy(data)
+    assert decode_message(data) == {"type": "ai", "content": "你好，world", "timestamp": 1700000000.5}
+
+
+def test_long_content_is_compressed():
+    content = "今天的订单总额是多少？" * 100
+    data = encode_message("human", content, 1.0, compress_threshold=64)
+    assert len(data) < len(content.encode("utf-8"))
+    assert decode_message(data)["content"] == content
+
+    uncompressed = encode_message("human", content, 1.0, compress_threshold=None)
+    assert len(uncompressed) > len(data)
+    assert decode_message(uncompressed)["content"] == content
+
+
+def test_legacy_json():
+    legacy = json.dumps({"type": "human", "content": "你好", "timestamp": 1.0}, ensure_ascii=False)
+    assert is_legacy(legacy)
+    assert is_legacy(legacy.encode("utf-8"))
+    assert decode_message(legacy) == {"type": "human", "content": "你好", "timestamp": 1.0}
+    assert decode_message(legacy.encode("utf-8"))["content"] == "你好"
+
+
+def test_unsupported_version():
+    data = bytes([VERSION + 1]) + encode_message("system", "x", 0.0)[1:]
+    with pytest.raises(ValueError):
+        decode_message(data)
+
+
+def test_migrate_session_converts_legacy_messages():
+    client = fakeredis.FakeRedis()
+    legacy = json.dumps({"type": "human", "content": "旧消息", "timestamp": 1.0}, ensure_ascii=False)
+    current = encode_message("ai", "新消息", 2.0)
+    client.rpush("chat:s1", current, legacy)
+    client.expire("chat:s1", 100)
+
+    assert migrate_session(client, "chat:s1", dry_run=True)
+    assert is_legacy(client.lindex("chat:s1", 1))
+
+    before, after = migrate_session(client, "chat:s1")
+    assert after < before
+    messages = [decode_message(m) for m in client.lrange("chat:s1", 0, -1)]
+    assert [m["content"] for m in messages] == ["新消息", "旧消息"]
+    assert not any(is_legacy(m) for m in client.lrange("chat:s1", 0, -1))
+    assert 0 < client.ttl("chat:s1") <= 100
+    # 已经迁移过的会话不再处理
+    assert migrate_session(client, "chat:s1") is None
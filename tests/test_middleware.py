@@ -0,0 +1,47 @@
+import asyncio
+
+from src.agentapi.utils.middleware import ResponseHeaderMiddleware
+
+
+async def _app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def _call(middleware, scope):
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def receive():
+        return {"type": "http.request"}
+
+    asyncio.run(middleware(scope, receive, send))
+    return sent
+
+
+def test_adds_headers_and_server_timing():
+    middleware = ResponseHeaderMiddleware(_app, headers={"X-Frame-Options": "DENY"}, timing_name="total",
+                                          timing_allow_origin="*")
+    start, body = _call(middleware, {"type": "http"})
+    headers = dict(start["headers"])
+    assert headers[b"content-type"] == b"text/plain"
+    assert headers[b"x-frame-options"] == b"DENY"
+    assert headers[b"timing-allow-origin"] == b"*"
+    assert headers[b"server-timing"].startswith(b"total;dur=")
+    float(headers[b"server-timing"].split(b"=")[1])
+    assert body == {"type": "http.response.body", "body": b"ok"}
+
+
+def test_server_timing_disabled():
+    start, _ = _call(ResponseHeaderMiddleware(_app, server_timing=False), {"type": "http"})
+    assert start["headers"] == [(b"content-type", b"text/plain")]
+
+
+def test_non_http_passes_through():
+    async def app(scope, receive, send):
+        await send({"type": "websocket.accept"})
+
+    assert _call(ResponseHeaderMiddleware(app, headers={"X-A": "1"}), {"type": "websocket"}) == [
+        {"type": "websocket.accept"}]
@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from src.agentapi.utils.password_hasher import BCRYPT_ROUNDS, PasswordHasher
+
+
+# 在子进程中执行，必须定义在模块顶层
+def _slow(seconds):
+    time.sleep(seconds)
+    return seconds, time.time()
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(workers=1, max_queue=1, timeout=10)
+    yield hasher
+    hasher.close()
+
+
+def test_hash_and_verify(hasher):
+    async def main():
+        hashed = await hasher.hash("secret")
+        return hashed, await hasher.verify_and_update("secret", hashed), await hasher.verify_and_update("wrong", hashed)
+
+    hashed, right, wrong = asyncio.run(main())
+    assert hashed.startswith(f"$2b${BCRYPT_ROUNDS}$")
+    assert right == (True, None)
+    assert wrong == (False, None)
+    stats = hasher.stats()
+    assert stats["run_time"]["count"] == 3 and stats["rehashed"] == 0
+
+
+def test_old_cost_is_rehashed(hasher):
+    old_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("secret")
+    valid, new_hash = asyncio.run(hasher.verify_and_update("secret", old_hash))
+    assert valid
+    assert new_hash.startswith(f"$2b${BCRYPT_ROUNDS}$")
+    assert hasher.stats()["rehashed"] == 1
+
+
+def test_malformed_hash_is_a_wrong_password(hasher):
+    assert asyncio.run(hasher.verify_and_update("secret", "not-a-bcrypt-hash")) == (False, None)
+
+
+def test_full_queue_is_rejected_with_503(hasher):
+    async def main():
+        # 1 个在计算、1 个在排队，第 3 个直接拒绝
+        running = [asyncio.ensure_future(hasher._submit(_slow, 0.3)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(HTTPException) as excinfo:
+            await hasher._submit(_slow, 0)
+        await asyncio.gather(*running)
+        return excinfo.value
+
+    assert asyncio.run(main()).status_code == 503
+    stats = hasher.stats()
+    assert stats["rejected"] == 1 and stats["running"] == 0 and stats["waiting"] == 0
+
+
+def test_timeout_returns_504():
+    hasher = PasswordHasher(workers=1, max_queue=1, timeout=0.2)
+    try:
+        with pytest.raises(HTTPException) as excinfo:
+            asyncio.run(hasher._submit(_slow, 1))
+        assert (excinfo.value.status_code, excinfo.value.detail) == (504, "密码校验超时")
+        assert hasher.stats()["timeouts"] == 1 and hasher.stats()["running"] == 0
+    finally:
+        hasher.close()
@@ -0,0 +1,125 @@
+import fakeredis
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from src.agentapi.utils.answer_cache import parameterize
+from src.agentapi.utils.plan_cache import (PlanCache, is_replayable, parameterize_sql, repeated_params,
+                                           unbound_literals, validate_answer_template)
+
+
+def test_parameterize():
+    assert parameterize("订单号为123的订单") == ("订单号为{0}的订单", [123])
+    assert parameterize("2024-03-01 价格大于9.5的“宫保鸡丁”") == ("{0} 价格大于{1}的{2}", ["2024-03-01", 9.5, "宫保鸡丁"])
+    assert parameterize("今天订单总额") == ("今天订单总额", [])
+
+
+def test_parameterize_sql():
+    sql = "SELECT * FROM orders WHERE id = 123 AND name = '宫保鸡丁' AND t1.price > 9.5"
+    result = parameterize_sql(sql, [123, "宫保鸡丁"])
+    assert result == "SELECT * FROM orders WHERE id = :p0 AND name = :p1 AND t1.price > 9.5"
+    assert unbound_literals(result, [123, "宫保鸡丁"]) == []
+    assert is_replayable(result, [123, "宫保鸡丁"])
+
+
+def test_parameterize_sql_escapes_colons():
+    result = parameterize_sql("SELECT DATE_FORMAT(t, '%H:%i') FROM orders WHERE id = 5", [5])
+    assert result == "SELECT DATE_FORMAT(t, '%H\\:%i') FROM orders WHERE id = :p0"
+
+
+def test_unbound_literal_is_not_replayable():
+    # 问题中的 5 没有出现在 SQL 中，无法绑定为参数，换一个值重放会得到同样的结果
+    values = [5, 2023]
+    result = parameterize_sql("SELECT * FROM orders WHERE YEAR(created_at) = 2023 LIMIT 10", values)
+    assert unbound_literals(result, values) == [5]
+    assert not is_replayable(result, values)
+
+
+def test_hard_coded_date_is_not_replayable():
+    result = parameterize_sql("SELECT SUM(total) FROM orders WHERE day = '2024-03-01'", [])
+    assert not is_replayable(result, [])
+
+
+def test_validate_answer_template():
+    validate_answer_template("订单{p0}的总额为{result}", 1)
+    with pytest.raises(ValueError):
+        validate_answer_template("订单{p1}的总额为{result}", 1)
+    with pytest.raises(ValueError):
+        validate_answer_template("{result.__class__}", 0)
+    with pytest.raises(ValueError):
+        validate_answer_template("{result", 0)
+
+
+def test_limit_collision_is_not_replayable():
+    # "价格超过10元的菜"：LIMIT 10 与问题中的 10 相同，重放 "价格超过50元的菜" 时不能变成 LIMIT 50
+    template, values = parameterize("价格超过10元的菜")
+    sql = parameterize_sql("SELECT name FROM dishes WHERE price > 10 LIMIT 10", values)
+    assert sql == "SELECT name FROM dishes WHERE price > :p0 LIMIT :p0"
+    assert repeated_params(sql) == [0]
+    assert not is_replayable(sql, values)
+
+
+def test_coincidental_collision_is_not_replayable():
+    values = parameterize("1号桌的订单")[1]
+    sql = parameterize_sql("SELECT * FROM orders WHERE table_id = 1 AND status = 1", values)
+    assert not is_replayable(sql, values)
+
+
+class FakeDB:
+    def __init__(self):
+        self.calls = []
+
+    def run(self, sql, parameters=None):
+        self.calls.append((sql, parameters))
+        return "[('宫保鸡丁',)]"
+
+
+def agent_messages(sql):
+    call = {"name": "sql_db_query", "args": {"query": sql}, "id": "call-1"}
+    return [
+        HumanMessage(content="问题"),
+        AIMessage(content="", tool_calls=[call]),
+        ToolMessage(content="[('宫保鸡丁',)]", tool_call_id="call-1"),
+        AIMessage(content="答案"),
+    ]
+
+
+@pytest.mark.parametrize("redis_client", [None, fakeredis.FakeRedis()])
+def test_capture_and_replay(redis_client):
+    db = FakeDB()
+    cache = PlanCache(db, model=None, redis_client=redis_client)
+    plan = cache.capture("价格超过10元的菜", agent_messages("SELECT name FROM dishes WHERE price > 10 LIMIT 20"))
+    assert plan["sql"] == "SELECT name FROM dishes WHERE price > :p0 LIMIT 20"
+
+    # 使用 Redis 时由另一个 worker 重放
+    reader = cache if redis_client is None else PlanCache(db, model=None, redis_client=redis_client)
+    replayed = reader.replay("价格超过50元的菜")
+    assert replayed == {"sql": plan["sql"], "result": "[('宫保鸡丁',)]", "answer": None}
+    assert db.calls == [(plan["sql"], {"p0": 50})]
+
+
+def test_capture_skips_colliding_plan():
+    db = FakeDB()
+    cache = PlanCache(db, model=None)
+    assert cache.capture("价格超过10元的菜", agent_messages("SELECT name FROM dishes WHERE price > 10 LIMIT 10")) is None
+    assert cache.stats()["skipped"] == 1
+    assert cache.replay("价格超过50元的菜") is None
+    assert db.calls == []
+
+
+def test_replay_drops_old_colliding_plan():
+    db = FakeDB()
+    cache = PlanCache(db, model=None)
+    # 之前的版本保存的计划
+    key = cache._key("价格超过{0}元的菜")
+    cache._save(key, {"question": "价格超过{0}元的菜", "sql": "SELECT name FROM dishes WHERE price > :p0 LIMIT :p0",
+                      "tables": ["dishes"], "versions": {}, "answer_template": None})
+    assert cache.replay("价格超过50元的菜") is None
+    assert cache.stats()["size"] == 0
+    assert db.calls == []
+
+
+def test_answer_template():
+    cache = PlanCache(FakeDB(), model=None)
+    cache.capture("订单号为123的订单", agent_messages("SELECT dish FROM orders WHERE id = 123"))
+    assert cache.set_answer_template("订单号为1的订单", "订单{p0}：{result}")
+    assert cache.replay("订单号为456的订单")["answer"] == "订单456：[('宫保鸡丁',)]"
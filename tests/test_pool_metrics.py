@@ -0,0 +1,144 @@
+import threading
+
+import pytest
+from sqlalchemy import create_engine, exc, text
+from sqlalchemy.pool import QueuePool
+
+from src.agentapi.utils import pool_metrics
+from src.agentapi.utils.pool_metrics import (AdaptiveSizer, PoolGate, PoolMetrics, instrument_engine, pool_stats,
+                                             register_pool, render_prometheus)
+
+
+def test_histogram_is_cumulative():
+    metrics = PoolMetrics("histogram")
+    for seconds in (0.0005, 0.003, 0.003, 20):
+        metrics.observe_wait(seconds)
+    snapshot = metrics.snapshot()
+    assert snapshot["wait_count"] == 4
+    assert snapshot["wait_sum"] == pytest.approx(20.0065)
+    assert snapshot["wait_buckets"]["0.001"] == 1
+    assert snapshot["wait_buckets"]["0.005"] == 3
+    assert snapshot["wait_buckets"]["10.0"] == 3
+    assert snapshot["wait_buckets"]["+Inf"] == 4
+
+
+def test_recent_wait_quantile():
+    metrics = PoolMetrics("recent")
+    assert metrics.recent_wait() is None
+    for i in range(100):
+        metrics.observe_wait(i / 1000)
+    assert metrics.recent_wait() == 0.095
+    metrics.reset_recent()
+    assert metrics.recent_wait() is None
+
+
+def test_status_callback_errors_are_ignored():
+    def broken():
+        raise RuntimeError("连接池已关闭")
+
+    assert "size" not in PoolMetrics("broken", broken).snapshot()
+
+
+def test_register_pool_and_prometheus():
+    metrics = register_pool("test_prometheus", lambda: {"size": 3, "in_use": 1, "idle": 2, "max_size": 5})
+    assert register_pool("test_prometheus") is metrics
+    metrics.observe_wait(0.002)
+    metrics.timeout()
+    assert pool_stats()["test_prometheus"]["timeouts"] == 1
+
+    output = render_prometheus()
+    assert 'agentapi_pool_in_use{pool="test_prometheus"} 1' in output
+    assert 'agentapi_pool_timeouts_total{pool="test_prometheus"} 1' in output
+    assert 'agentapi_pool_checkout_wait_seconds_bucket{pool="test_prometheus",le="0.005"} 1' in output
+    assert 'agentapi_pool_checkout_wait_seconds_count{pool="test_prometheus"} 1' in output
+
+
+def test_gate_limits_and_resizes():
+    gate = PoolGate(1)
+    assert gate.acquire(timeout=0)
+    assert not gate.acquire(timeout=0.01)
+
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(gate.acquire(timeout=2)))
+    waiter.start()
+    gate.resize(2)
+    waiter.join()
+    assert acquired == [True]
+    assert gate.in_use == 2 and gate.peak == 2
+
+    gate.release()
+    gate.reset_peak()
+    assert gate.peak == 1
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(pool_metrics.time, "monotonic", clock)
+    return clock
+
+
+def test_sizer_grows_when_waits_are_long(clock):
+    gate, metrics = PoolGate(2), PoolMetrics("grow")
+    sizer = AdaptiveSizer(gate, metrics, min_size=1, max_size=3, target_wait=0.05, interval=10)
+    metrics.observe_wait(0.2)
+    sizer.maybe_adjust()
+    assert gate.limit == 2  # 还没到调整间隔
+
+    clock.now += 10
+    sizer.maybe_adjust()
+    assert gate.limit == 3
+    assert metrics.recent_wait() is None
+
+    metrics.observe_wait(0.2)
+    clock.now += 10
+    sizer.maybe_adjust()
+    assert gate.limit == 3  # 不超过 max_size
+
+
+def test_sizer_shrinks_when_idle(clock):
+    gate, metrics = PoolGate(4), PoolMetrics("shrink")
+    sizer = AdaptiveSizer(gate, metrics, min_size=3, max_size=8, target_wait=0.05, interval=10)
+    for _ in range(2):
+        metrics.observe_wait(0.0001)
+        clock.now += 10
+        sizer.maybe_adjust()
+    assert gate.limit == 3  # 不低于 min_size
+
+
+def test_sizer_keeps_size_while_busy(clock):
+    gate, metrics = PoolGate(4), PoolMetrics("busy")
+    sizer = AdaptiveSizer(gate, metrics, min_size=1, max_size=8, target_wait=0.05, interval=10)
+    for _ in range(3):
+        gate.acquire(timeout=0)
+    metrics.observe_wait(0.0001)
+    clock.now += 10
+    sizer.maybe_adjust()
+    # 最大使用数只比上限少 1 个，不缩小
+    assert gate.limit == 4
+
+
+def test_instrument_engine():
+    engine = create_engine("sqlite://", poolclass=QueuePool, pool_size=1, max_overflow=0, pool_timeout=0.05)
+    metrics = instrument_engine(engine, "test_sqlite")
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        # 唯一的连接已经借出，再借会超时
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+    snapshot = metrics.snapshot()
+    assert snapshot["connects"] == 1
+    assert snapshot["timeouts"] == 1
+    assert snapshot["wait_count"] == 2
+    assert snapshot["in_use"] == 0 and snapshot["idle"] == 1 and snapshot["max_size"] == 1
+
+    engine.dispose()
+    assert metrics.snapshot()["closes"] == 1
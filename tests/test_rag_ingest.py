@@ -0,0 +1,151 @@
+import json
+import os
+
+import docx
+import pytest
+
+from src.agentapi.utils.rag_index import RagIndex, file_hash
+from src.agentapi.utils.rag_ingest import IngestPipeline, _Writer
+
+
+class FakeStore:
+    """代替 Chroma：记录写入和删除的片段"""
+
+    def __init__(self, fail=False):
+        self.docs = {}
+        self.batches = []
+        self.fail = fail
+
+    def add_texts(self, texts, metadatas=None, ids=None):
+        if self.fail:
+            raise RuntimeError("写入失败")
+        self.batches.append(list(ids))
+        self.docs.update(zip(ids, texts))
+
+    def delete(self, ids=None):
+        for id in ids:
+            self.docs.pop(id, None)
+
+
+class FakeIndex(RagIndex):
+    def __init__(self, docs_dir, persist_dir, store=None):
+        super().__init__(docs_dir=str(docs_dir), persist_dir=str(persist_dir))
+        os.makedirs(persist_dir, exist_ok=True)
+        self.store = store or FakeStore()
+
+    def open(self):
+        return self.store
+
+    def reset(self):
+        self.store.docs.clear()
+        return self.store
+
+
+def _write_docx(path, paragraphs):
+    document = docx.Document()
+    for text in paragraphs:
+        document.add_paragraph(text)
+    document.save(path)
+    return os.path.normpath(str(path))
+
+
+@pytest.fixture
+def index(tmp_path):
+    docs_dir = tmp_path / "docs"
+    docs_dir.mkdir()
+    return FakeIndex(docs_dir, tmp_path / "index")
+
+
+def test_plan_compares_manifest_with_docs(index, tmp_path):
+    same = _write_docx(tmp_path / "docs" / "a.docx", ["不变"])
+    changed = _write_docx(tmp_path / "docs" / "b.docx", ["修改"])
+    new = _write_docx(tmp_path / "docs" / "c.docx", ["新增"])
+    stat = os.stat(same)
+    manifest = {
+        same: {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": "s1", "ids": []},
+        changed: {"mtime": 0, "size": 0, "sha256": "s2", "ids": []},
+        "/gone.docx": {"mtime": 0, "size": 0, "sha256": "s3", "ids": ["x"]},
+    }
+    todo, removed, unchanged = IngestPipeline(index, workers=1).plan(manifest)
+    assert todo == [(changed, "s2"), (new, None)]
+    assert removed == ["/gone.docx"]
+    assert unchanged == 1
+
+
+def _chunks(path, digest, count):
+    texts = [f"{path}-{i}" for i in range(count)]
+    metadatas = [{"source": path, "sha256": digest} for _ in range(count)]
+    ids = [f"{digest}:{i}" for i in range(count)]
+    return path, digest, texts, metadatas, ids
+
+
+def test_writer_records_document_after_all_chunks(index, tmp_path):
+    a = _write_docx(tmp_path / "docs" / "a.docx", ["a"])
+    b = _write_docx(tmp_path / "docs" / "b.docx", ["b"])
+    manifest = {}
+    stats = {"added": 0, "updated": 0, "unchanged": 0, "chunks": 0, "batches": 0}
+    writer = _Writer(index, index.store, manifest, stats, batch_size=2, queue_size=1)
+
+    # 直接调用 _add，检查攒批过程中的清单
+    writer._add(*_chunks(a, "da", 3))
+    assert index.store.batches == [["da:0", "da:1"]]
+    assert a not in manifest  # 还有一个片段没写入
+    writer._add(*_chunks(b, "db", 1))
+    assert index.store.batches[-1] == ["da:2", "db:0"]
+    assert set(manifest) == {a, b}
+    assert index.load_manifest()[a]["ids"] == ["da:0", "da:1", "da:2"]
+    assert stats == {"added": 2, "updated": 0, "unchanged": 0, "chunks": 4, "batches": 2}
+
+
+def test_writer_replaces_old_chunks_and_skips_same_content(index, tmp_path):
+    a = _write_docx(tmp_path / "docs" / "a.docx", ["a"])
+    b = _write_docx(tmp_path / "docs" / "b.docx", ["b"])
+    index.store.docs.update({"old:0": "旧片段", "keep:0": "未变化"})
+    manifest = {
+        a: {"mtime": 0, "size": 0, "sha256": "old", "ids": ["old:0"]},
+        b: {"mtime": 0, "size": 0, "sha256": "keep", "ids": ["keep:0"]},
+    }
+    stats = {"added": 0, "updated": 0, "unchanged": 0, "chunks": 0, "batches": 0}
+    writer = _Writer(index, index.store, manifest, stats, batch_size=8, queue_size=4)
+    writer.start()
+    writer.put(_chunks(a, "new", 1))
+    writer.put((b, "keep", None, None, None))
+    writer.finish()
+
+    assert index.store.docs == {"new:0": f"{a}-0", "keep:0": "未变化"}
+    assert manifest[a]["sha256"] == "new"
+    assert manifest[b]["mtime"] == os.stat(b).st_mtime
+    assert stats["updated"] == 1 and stats["unchanged"] == 1
+    assert index.load_manifest() == manifest
+
+
+def test_writer_error_is_raised_to_producer(index, tmp_path):
+    a = _write_docx(tmp_path / "docs" / "a.docx", ["a"])
+    store = FakeStore(fail=True)
+    stats = {"added": 0, "updated": 0, "unchanged": 0, "chunks": 0, "batches": 0}
+    writer = _Writer(index, store, {}, stats, batch_size=1, queue_size=1)
+    writer.start()
+    writer.put(_chunks(a, "da", 1))
+    with pytest.raises(RuntimeError, match="写入向量索引失败"):
+        writer.finish()
+
+
+def test_run_ingests_changes_and_marks_synced(index, tmp_path):
+    a = _write_docx(tmp_path / "docs" / "a.docx", ["第一段。", "第二段。"])
+    _write_docx(tmp_path / "docs" / "b.docx", ["另一个文档"])
+    index.save_manifest({"/gone.docx": {"mtime": 0, "size": 0, "sha256": "x", "ids": ["gone:0"]}})
+    index.store.docs["gone:0"] = "已删除的文档"
+
+    stats = IngestPipeline(index, workers=2, embed_batch_size=1).run()
+    assert (stats["added"], stats["removed"], stats["failed"]) == (2, 1, 0)
+    assert stats["chunks"] == stats["batches"] == 2
+    assert "gone:0" not in index.store.docs
+    manifest = index.load_manifest()
+    assert manifest[a]["sha256"] == file_hash(a)
+    with open(index.synced_path, encoding="utf-8") as f:
+        assert json.load(f)["stats"]["added"] == 2
+
+    # 再运行一次：没有变化的文档不重新解析
+    stats = IngestPipeline(index, workers=2).run()
+    assert (stats["added"], stats["unchanged"], stats["chunks"]) == (0, 2, 0)
+    assert index.load_manifest() == manifest
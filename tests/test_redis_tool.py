@@ -0,0 +1,210 @@
+import asyncio
+
+import fakeredis
+from langchain.schema import AIMessage
+
+from src.agentapi.utils import redis_tool
+from src.agentapi.utils.message_codec import encode_message
+from src.agentapi.utils.redis_tool import (_COMPACT_SCRIPT, AsyncRedisConversationMemory, AsyncSessionStore,
+                                           RedisConversationMemory, count_tokens)
+
+
+def turn(i):
+    return {"input": f"问题{i}"}, {"response": f"回答{i}"}
+
+
+def contents(memory):
+    return [msg.content for msg in memory.chat_memory.messages]
+
+
+
+
+def test_sync_memory_picks_up_other_worker_turns():
+    server = fakeredis.FakeServer()
+    a = RedisConversationMemory(fakeredis.FakeRedis(server=server), "s1", max_history=5)
+    b = RedisConversationMemory(fakeredis.FakeRedis(server=server), "s1", max_history=5)
+    a.save_context(*turn(1))
+    b.sync()
+    assert contents(b) == ["问题1", "回答1"]
+    b.save_context(*turn(2))
+    assert b.seq == 2
+    # a 没有同步就保存，序号冲突，下次同步时重新加载全部历史
+    a.save_context(*turn(3))
+    assert a.seq == -1
+    a.sync()
+    assert contents(a) == ["问题1", "回答1", "问题2", "回答2", "问题3", "回答3"]
+
+
+def test_max_history_trims_redis_and_memory():
+    client = fakeredis.FakeRedis()
+    memory = RedisConversationMemory(client, "s1", max_history=2)
+    for i in range(4):
+        memory.save_context(*turn(i))
+    assert contents(memory) == ["问题2", "回答2", "问题3", "回答3"]
+    assert client.llen("chat:s1") == 4
+    assert contents(RedisConversationMemory(client, "s1", max_history=2)) == contents(memory)
+
+
+
+
+def async_client(server):
+    return fakeredis.FakeAsyncRedis(server=server)
+
+
+def test_async_refresh_loads_other_worker_turns_before_next_turn():
+    async def main():
+        server = fakeredis.FakeServer()
+        a = await AsyncRedisConversationMemory.create(async_client(server), "s1", max_history=5)
+        b = await AsyncRedisConversationMemory.create(async_client(server), "s1", max_history=5)
+        await a.asave_context(*turn(1))
+        await a.asave_context(*turn(2))
+        # 另一个 worker 复用的记忆在生成下一轮回答之前就看到了这两轮
+        await b.arefresh()
+        assert contents(b) == ["问题1", "回答1", "问题2", "回答2"]
+        assert b.seq == 2
+        await b.asave_context(*turn(3))
+        assert b.seq == 3
+        await a.arefresh()
+        assert contents(a) == contents(b)
+
+    asyncio.run(main())
+
+
+def test_async_refresh_reloads_after_expiry():
+    async def main():
+        server = fakeredis.FakeServer()
+        client = async_client(server)
+        memory = await AsyncRedisConversationMemory.create(client, "s1", max_history=5)
+        await memory.asave_context(*turn(1))
+        await client.delete("chat:s1", "chat:s1:seq")
+        await memory.arefresh()
+        assert contents(memory) == [] and memory.seq == 0
+
+    asyncio.run(main())
+
+
+def test_save_script_merges_concurrent_writes():
+    async def main():
+        server = fakeredis.FakeServer()
+        a = await AsyncRedisConversationMemory.create(async_client(server), "s1", max_history=5)
+        b = await AsyncRedisConversationMemory.create(async_client(server), "s1", max_history=5)
+        await a.asave_context(*turn(1))
+        # b 没有刷新，保存时脚本发现序号不一致，读回完整的历史
+        await b.asave_context(*turn(2))
+        assert contents(b) == ["问题1", "回答1", "问题2", "回答2"]
+        assert b.seq == 2
+
+    asyncio.run(main())
+
+
+
+
+def test_session_serializes_requests_for_the_same_session():
+    async def main():
+        store = AsyncSessionStore(async_client(fakeredis.FakeServer()), max_history=5)
+        order = []
+
+        async def request(session_id, i):
+            async with store.session(session_id) as chain:
+                order.append(("start", session_id, i))
+                await asyncio.sleep(0.01)
+                await chain.memory.asave_context(*turn(i))
+                order.append(("end", session_id, i))
+
+        await asyncio.gather(request("s1", 1), request("s1", 2), request("s2", 3))
+        s1 = [item for item in order if item[1] == "s1"]
+        assert s1 == [("start", "s1", 1), ("end", "s1", 1), ("start", "s1", 2), ("end", "s1", 2)]
+        # 不同的会话并发执行
+        assert order.index(("start", "s2", 3)) < order.index(("end", "s1", 1))
+
+        async with store.session("s1") as chain:
+            assert contents(chain.memory) == ["问题1", "回答1", "问题2", "回答2"]
+        assert len(store) == 2
+
+    asyncio.run(main())
+
+
+def test_session_store_reuses_chain_and_refreshes():
+    async def main():
+        server = fakeredis.FakeServer()
+        worker_a = AsyncSessionStore(async_client(server), max_history=5)
+        worker_b = AsyncSessionStore(async_client(server), max_history=5)
+        async with worker_a.session("s1") as chain_a:
+            pass
+        async with worker_b.session("s1") as chain_b:
+            await chain_b.memory.asave_context(*turn(1))
+        async with worker_a.session("s1") as chain:
+            assert chain is chain_a
+            assert contents(chain.memory) == ["问题1", "回答1"]
+
+    asyncio.run(main())
+
+def test_budgeted_messages_keep_latest_and_summary():
+    memory = RedisConversationMemory(fakeredis.FakeRedis(), "s1", max_history=10, token_budget=12)
+    memory.save_context({"input": "我叫张三"}, {"response": "你好张三"})
+    memory.save_context({"input": "我喜欢川菜"}, {"response": "好的"})
+    memory.summary = "用户"
+    messages = memory.budgeted_messages()
+    assert messages[0].content == "之前对话的摘要：用户"
+    assert [m.content for m in messages[1:]] == ["我喜欢川菜", "好的"]
+
+
+def test_compact_script():
+    client = fakeredis.FakeRedis()
+    compact = client.register_script(_COMPACT_SCRIPT)
+    keys = ["chat:s1", "chat:s1:seq", "chat:s1:summary"]
+    messages = [encode_message("human" if i % 2 == 0 else "ai", str(i), 0.0) for i in range(6)]
+    client.lpush("chat:s1", *messages)  # 最早的消息在列表尾部
+    client.set("chat:s1:seq", 3)
+    oldest = client.lrange("chat:s1", -4, -1)
+
+    # 摘要已经被其他 worker 更新过，放弃
+    client.set("chat:s1:summary", "别人的摘要")
+    assert compact(keys=keys, args=["新摘要", "", 86400, 6, *oldest]) == 0
+    assert client.llen("chat:s1") == 6
+
+    # 生成摘要期间轮数上限截掉了最早的两条，只删除剩下的两条
+    client.delete("chat:s1:summary")
+    client.rpop("chat:s1", 2)
+    assert compact(keys=keys, args=["新摘要", "", 86400, 6, *oldest]) == 2
+    assert client.lrange("chat:s1", 0, -1) == messages[::-1][:2]
+    assert client.get("chat:s1:summary") == "新摘要".encode("utf-8")
+    assert int(client.get("chat:s1:seq")) == 9
+
+
+def test_count_tokens():
+    assert count_tokens("你好，世界") == 5
+    assert count_tokens("hello world!") == 3
+    assert count_tokens("") == 0
+
+
+class FakeChatModel:
+    def __init__(self):
+        self.prompts = []
+
+    async def ainvoke(self, messages):
+        self.prompts.append(messages)
+        return AIMessage(content="用户叫张三")
+
+
+def test_compaction_moves_old_turns_into_summary(monkeypatch):
+    model = FakeChatModel()
+    monkeypatch.setattr(redis_tool, "chat_model", model)
+
+    async def main():
+        server = fakeredis.FakeServer()
+        memory = await AsyncRedisConversationMemory.create(async_client(server), "s1", max_history=20, token_budget=8)
+        await memory.asave_context({"input": "我叫张三"}, {"response": "你好张三"})
+        await memory.asave_context({"input": "推荐一道菜"}, {"response": "宫保鸡丁"})
+        await asyncio.gather(*redis_tool._background_tasks)
+
+        assert "我叫张三" in model.prompts[0][1].content
+        client = async_client(server)
+        assert await client.get("chat:s1:summary") == "用户叫张三".encode("utf-8")
+        assert await client.llen("chat:s1") == 2
+        # 序号跳过了 max_history，下一次刷新时重新加载压缩后的历史和摘要
+        await memory.arefresh()
+        assert memory.summary == "用户叫张三"
+        assert contents(memory) == ["推荐一道菜", "宫保鸡丁"]
+
+    asyncio.run(main())
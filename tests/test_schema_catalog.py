@@ -0,0 +1,112 @@
+import fakeredis
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from src.agentapi.utils.schema_catalog import SchemaCatalog
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement):
+        sql = str(statement)
+        self.db.statements.append(sql)
+        if sql.startswith("SET SESSION"):
+            if not self.db.stats_expiry:
+                raise OperationalError(sql, {}, Exception("Unknown system variable 'information_schema_stats_expiry'"))
+            return FakeResult([])
+        if "information_schema.TABLES" in sql:
+            return FakeResult([(name, "2024-01-01", self.db.update_times[name], f"{name} 注释")
+                               for name in self.db.tables])
+        return FakeResult([(name, "id", "int", "NO", "PRI", "编号") for name in self.db.tables])
+
+    def rollback(self):
+        self.db.rollbacks += 1
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeDB:
+    """模拟 SQLDatabase：information_schema 的查询结果由 update_times 决定"""
+
+    def __init__(self, stats_expiry=True):
+        self.tables = ["orders", "dishes"]
+        self.update_times = {name: "2024-01-01 00:00:00" for name in self.tables}
+        self.stats_expiry = stats_expiry
+        self.statements = []
+        self.rollbacks = 0
+        self.info_calls = []
+        self._engine = self
+
+    @property
+    def url(self):
+        return type("URL", (), {"database": "restaurant"})()
+
+    def connect(self):
+        return FakeConnection(self)
+
+    def get_usable_table_names(self):
+        return self.tables
+
+    def get_table_info(self, names):
+        self.info_calls.extend(names)
+        return "\n".join(f"CREATE TABLE {name} ({self.update_times[name]})" for name in names)
+
+
+def test_stats_cache_is_disabled_before_reading_versions():
+    db = FakeDB()
+    SchemaCatalog(db, check_interval=0).table_versions(["orders"])
+    assert db.statements[0] == "SET SESSION information_schema_stats_expiry = 0"
+    assert "information_schema.TABLES" in db.statements[1]
+
+
+def test_without_stats_expiry_variable_falls_back_once():
+    db = FakeDB(stats_expiry=False)
+    catalog = SchemaCatalog(db, check_interval=0)
+    assert catalog.table_versions(["orders"])["orders"]
+    catalog.table_versions(["orders"])
+    # 不支持的数据库上只尝试一次
+    assert sum(sql.startswith("SET SESSION") for sql in db.statements) == 1
+    assert db.rollbacks == 1
+
+
+@pytest.mark.parametrize("redis_client", [None, fakeredis.FakeRedis(decode_responses=True)])
+def test_data_change_refreshes_only_that_table(redis_client):
+    db = FakeDB()
+    catalog = SchemaCatalog(db, redis_client, check_interval=0)
+    catalog.warm_up()
+    assert sorted(db.info_calls) == ["dishes", "orders"]
+    assert catalog.is_warm()
+    ddl_before = catalog.table_ddl_versions(["orders"])
+
+    db.update_times["orders"] = "2024-01-02 00:00:00"
+    assert not catalog.is_warm()
+    assert "2024-01-02" in catalog.get_table_info(["orders", "dishes"])
+    assert sorted(db.info_calls) == ["dishes", "orders", "orders"]
+    # 只有数据变化，结构版本号不变
+    assert catalog.table_ddl_versions(["orders"]) == ddl_before
+
+
+def test_redis_cache_is_shared_between_workers():
+    redis_client = fakeredis.FakeRedis(decode_responses=True)
+    SchemaCatalog(FakeDB(), redis_client, check_interval=0).warm_up()
+    db = FakeDB()
+    assert "CREATE TABLE orders" in SchemaCatalog(db, redis_client, check_interval=0).get_table_info(["orders"])
+    assert db.info_calls == []
+
+
+def test_unknown_table():
+    assert SchemaCatalog(FakeDB()).get_table_info(["missing"]).startswith("Error:")
@@ -0,0 +1,146 @@
+import asyncio
+
+import fakeredis
+import pytest
+from fastapi import HTTPException
+
+from src.agentapi.utils.single_flight import SingleFlight, flight_key
+
+
+def test_flight_key():
+    assert flight_key("今天的订单总额？", "db") == flight_key("今天的订单总额", "db")
+    assert flight_key("今天的订单总额", "db") != flight_key("今天的订单总额", "other")
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = 0
+
+    async def fn():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return calls
+
+    async def main():
+        return await asyncio.gather(*(flight.do("k", fn) for _ in range(5)))
+
+    assert asyncio.run(main()) == [1] * 5
+    assert calls == 1
+    assert flight.stats() == {"inflight": 0, "leaders": 1, "shared": 4, "remote_shared": 0}
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight()
+
+    async def main():
+        return await asyncio.gather(flight.do("a", lambda: asyncio.sleep(0, "a")),
+                                    flight.do("b", lambda: asyncio.sleep(0, "b")))
+
+    assert asyncio.run(main()) == ["a", "b"]
+    assert flight.stats()["leaders"] == 2
+
+
+def test_exception_is_shared():
+    flight = SingleFlight()
+
+    async def fn():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def main():
+        return await asyncio.gather(flight.do("k", fn), flight.do("k", fn), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert flight.stats()["leaders"] == 1
+
+
+def test_cancelled_waiter_does_not_cancel_leader():
+    flight = SingleFlight()
+
+    async def fn():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        first = asyncio.ensure_future(flight.do("k", fn))
+        second = asyncio.ensure_future(flight.do("k", fn))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "done"
+
+
+def workers(n, **kwargs):
+    server = fakeredis.FakeServer()
+    return [SingleFlight(fakeredis.FakeAsyncRedis(server=server), **kwargs) for _ in range(n)]
+
+
+def test_cross_worker_follower_shares_leader_result():
+    async def main():
+        a, b = workers(2)
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return {"answer": len(calls)}
+
+        results = await asyncio.gather(a.do("k", fn), b.do("k", fn))
+        return results, calls, a.stats(), b.stats()
+
+    results, calls, a_stats, b_stats = asyncio.run(main())
+    assert results == [{"answer": 1}, {"answer": 1}]
+    assert calls == [1]
+    assert a_stats["leaders"] + b_stats["leaders"] == 1
+    assert a_stats["remote_shared"] + b_stats["remote_shared"] == 1
+
+
+def test_cross_worker_error_is_shared():
+    async def main():
+        a, b = workers(2)
+
+        async def fn():
+            await asyncio.sleep(0.05)
+            raise HTTPException(status_code=503, detail="代理繁忙")
+
+        return await asyncio.gather(a.do("k", fn), b.do("k", fn), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert [(e.status_code, e.detail) for e in results] == [(503, "代理繁忙"), (503, "代理繁忙")]
+
+
+def test_follower_does_not_read_previous_run_result():
+    async def main():
+        a, b = workers(2, result_ttl=60)
+        assert await a.do("k", lambda: asyncio.sleep(0, "第一次")) == "第一次"
+
+        # 第一次的结果还没有过期，第二次执行的等待者必须拿到第二次的结果
+        async def second():
+            await asyncio.sleep(0.1)
+            return "第二次"
+
+        leader = asyncio.ensure_future(a.do("k", second))
+        await asyncio.sleep(0.02)
+        return await asyncio.gather(leader, b.do("k", second)), b.stats()
+
+    results, b_stats = asyncio.run(main())
+    assert results == ["第二次", "第二次"]
+    assert b_stats["remote_shared"] == 1 and b_stats["leaders"] == 0
+
+
+def test_follower_runs_itself_when_leader_disappears():
+    async def main():
+        server = fakeredis.FakeServer()
+        client = fakeredis.FakeAsyncRedis(server=server)
+        # 执行者异常退出：锁还在，但不会有结果，锁过期后等待者自己执行
+        await client.set("single_flight:lock:k", "dead-leader", ex=1)
+        flight = SingleFlight(fakeredis.FakeAsyncRedis(server=server), wait_timeout=5)
+        return await flight.do("k", lambda: asyncio.sleep(0, "自己执行")), flight.stats()
+
+    result, stats = asyncio.run(main())
+    assert result == "自己执行" and stats["leaders"] == 1
@@ -0,0 +1,68 @@
+import pytest
+
+from src.agentapi.utils import table_selector
+from src.agentapi.utils.table_selector import TableSelector, tokenize
+
+DOCS = {
+    "dishes": "dishes 菜品表 id 编号 name 菜品名称 price 价格",
+    "orders": "orders 订单表 id 订单编号 dish_id 菜品编号 quantity 数量 created_at 下单的时间",
+    "users": "users 用户表 username 用户名 is_admin 是否是管理员 created_at 注册的时间",
+}
+
+
+class FakeCatalog:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def get_table_docs(self):
+        return self.docs
+
+
+@pytest.fixture
+def selector(monkeypatch):
+    # 向量模型不可用，只使用词法得分
+    monkeypatch.setattr(table_selector, "embed_texts", lambda texts: None)
+    return TableSelector(FakeCatalog(dict(DOCS)), top_k=4)
+
+
+def test_tokenize():
+    assert tokenize("Order_Items 订单明细") == {"order", "items", "订", "单", "明", "细", "订单", "单明", "明细"}
+
+
+def test_tokenize_numbers_and_single_char():
+    assert tokenize("t1 菜") == {"t1", "菜"}
+    assert tokenize("") == set()
+
+
+def test_tokenize_drops_stop_words():
+    # "的" 不再与前后的字组成 "品的"、"的价"
+    assert tokenize("菜品的价格是多少") == {"菜", "品", "菜品", "价", "格", "是", "价格", "格是"}
+
+
+def test_unrelated_table_is_excluded(selector):
+    # 问题与 users 只有 "是"、"表" 这样的单字相同
+    assert selector.select("宫保鸡丁的价格是多少") == ["dishes"]
+    assert sorted(selector.select("每个菜品的销量")) == ["dishes", "orders"]
+
+
+def test_english_column_names_match(selector):
+    assert selector.select("按 created_at 统计") == ["orders", "users"]
+
+
+def test_no_relevant_table_returns_empty(selector):
+    assert selector.select("今天天气怎么样") == []
+
+
+def test_similarity_adds_tables(monkeypatch):
+    import numpy as np
+    monkeypatch.setattr(table_selector, "embed_texts", lambda texts: np.eye(len(texts), dtype=np.float32))
+    monkeypatch.setattr(table_selector, "embed_query", lambda text: np.array([0, 0, 1], dtype=np.float32))
+    selector = TableSelector(FakeCatalog(dict(DOCS)), min_similarity=0.6)
+    # users 与问题没有共同的词，但向量相似度足够高
+    assert selector.select("管理员有几个") == ["users"]
+
+
+def test_refresh_rebuilds_on_schema_change(selector):
+    selector.select("价格")
+    selector.catalog.docs = {**DOCS, "coupons": "coupons 优惠券表 discount 折扣"}
+    assert selector.select("优惠券的折扣") == ["coupons"]